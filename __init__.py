@@ -1,2 +1,2 @@
-# ChargptChat plugin
+# ChargptChat plugin
 # 为 XXXBot 提供 chargpt.ai AI 聊天集成 
\ No newline at end of file
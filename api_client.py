@@ -1,434 +1,889 @@
-import aiohttp
-import asyncio
-import json
-import time
-from loguru import logger
-from typing import Dict, List, Optional, AsyncGenerator
-
-
-class ChargptAPIClient:
-    """Chargpt.ai API客户端，处理与API的通信"""
-    
-    def __init__(self, api_token: str, base_url: str, client_version: str, language: str,
-                default_model: str = "openai/gpt-4o", prompt_template: str = "{message}"):
-        """初始化API客户端
-        
-        Args:
-            api_token: API授权令牌
-            base_url: API基础URL
-            client_version: 客户端版本号
-            language: 语言设置
-            default_model: 默认使用的模型
-            prompt_template: 提示词模板
-        """
-        self.api_token = api_token
-        self.base_url = base_url.rstrip("/")  # 移除末尾斜杠
-        self.client_version = client_version
-        self.language = language
-        self.default_model = default_model
-        self.prompt_template = prompt_template
-        
-        # 会话存储，key为会话ID，value为历史消息
-        self.conversations: Dict[str, List[Dict]] = {}
-        
-    async def get_quota(self) -> Dict:
-        """获取用户配额信息
-        
-        Returns:
-            Dict: 用户配额信息
-        """
-        url = f"{self.base_url}/api/quota/retrieve"
-        
-        headers = self._get_headers()
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    logger.error(f"获取配额失败: {response.status} - {error_text}")
-                    return {"success": False, "error": f"API错误: {response.status}"}
-                
-                try:
-                    data = await response.json()
-                    return {"success": True, "data": data}
-                except Exception as e:
-                    logger.error(f"解析配额响应失败: {str(e)}")
-                    return {"success": False, "error": f"解析响应失败: {str(e)}"}
-    
-    async def chat(self, session_id: str, message: str, model: str = None) -> AsyncGenerator[str, None]:
-        """发送消息并以流式方式接收响应
-        
-        Args:
-            session_id: 会话ID，用于跟踪对话历史
-            message: 用户消息
-            model: 使用的模型，为空则使用默认模型
-            
-        Yields:
-            str: 响应消息片段
-        """
-        url = f"{self.base_url}/api/v2/chat/conversation"
-        
-        # 如果未指定模型，使用默认模型
-        model_to_use = model if model else self.default_model
-        # 生成提示词
-        prompt = self.prompt_template.format(message=message)
-        
-        # 准备简单的请求体，模拟网页请求
-        payload = {
-            "message": message,
-            "conversation_id": session_id,
-            "model": model_to_use,    # 使用指定的模型
-            "prompt": prompt          # 使用模板生成的提示词
-        }
-        
-        headers = self._get_headers()
-        logger.debug(f"发送聊天请求，payload: {payload}")
-        
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(url, headers=headers, json=payload, timeout=60) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"聊天请求失败: {response.status} - {error_text}")
-                        yield f"API错误: {response.status}"
-                        return
-                    
-                    logger.debug(f"收到响应，content-type: {response.headers.get('content-type')}")
-                    
-                    # 读取SSE响应
-                    buffer = ""
-                    full_response = ""
-                    line_count = 0
-                    raw_lines = []  # 用于保存原始响应行
-                    
-                    async for line in response.content:
-                        line_text = line.decode('utf-8')
-                        line_count += 1
-                        raw_lines.append(line_text)
-                        
-                        # 每10行打印一次原始数据以便调试
-                        if line_count <= 5 or line_count % 20 == 0:
-                            logger.debug(f"原始响应行 {line_count}: {line_text}")
-                        
-                        # 处理事件行
-                        if line_text.startswith('event:'):
-                            event_type = line_text[6:].strip()
-                            logger.debug(f"检测到事件: {event_type}")
-                            
-                            # 如果是错误事件，准备获取后续数据行
-                            if event_type == "error":
-                                logger.warning("收到错误事件，等待错误详情...")
-                                continue
-                        
-                        # 解析方式 1: data: 前缀
-                        if line_text.startswith('data:'):
-                            data = line_text[5:].strip()
-                            
-                            if data == "[DONE]":
-                                logger.debug("收到[DONE]标记")
-                                break
-                                
-                            try:
-                                json_data = json.loads(data)
-                                
-                                # 检查是否是错误响应
-                                if json_data.get('code') in [1000, 1001, 1002, 1003, 1004, 1005] and 'message' in json_data:
-                                    error_msg = json_data.get('message', '未知错误')
-                                    debug_info = json_data.get('debugInfo', '')
-                                    error_text = f"API错误({json_data.get('code')}): {error_msg}"
-                                    if debug_info:
-                                        error_text += f"\n调试信息: {debug_info}"
-                                    logger.error(error_text)
-                                    yield error_text
-                                    return
-                                
-                                # 解析方式 1a: 使用code和data字段
-                                if json_data.get('code') == 202 and 'data' in json_data:
-                                    data_obj = json_data['data']
-                                    if data_obj.get('type') == 'chat' and 'content' in data_obj:
-                                        content = data_obj['content']
-                                        if content:
-                                            logger.debug(f"提取的内容块: {content}")
-                                            buffer += content
-                                            full_response += content
-                                            yield content
-                                
-                                # 解析方式 1b: 使用OpenAI风格的格式
-                                elif 'choices' in json_data and len(json_data['choices']) > 0:
-                                    delta = json_data['choices'][0].get('delta', {})
-                                    content = delta.get('content', '')
-                                    
-                                    if content:
-                                        logger.debug(f"提取的OpenAI风格内容块: {content}")
-                                        buffer += content
-                                        full_response += content
-                                        yield content
-                                        
-                                # 解析方式 1c: 其他code处理
-                                elif json_data.get('code') in [201, 203]:
-                                    # 流开始或结束标记
-                                    logger.debug(f"收到流控制标记 code={json_data.get('code')}")
-                                    
-                                # 解析方式 1d: 直接尝试提取content字段
-                                elif 'content' in json_data:
-                                    content = json_data['content']
-                                    if content:
-                                        logger.debug(f"直接提取content字段: {content}")
-                                        buffer += content
-                                        full_response += content
-                                        yield content
-                            except json.JSONDecodeError as e:
-                                logger.warning(f"无法解析JSON数据({e}): {data}")
-                        
-                        # 解析方式 2: 尝试直接解析每一行为JSON
-                        elif line_text.strip():
-                            try:
-                                direct_json = json.loads(line_text.strip())
-                                logger.debug(f"直接解析行为JSON: {direct_json}")
-                                
-                                # 提取可能的内容
-                                if 'content' in direct_json:
-                                    content = direct_json['content']
-                                    logger.debug(f"从直接JSON中提取内容: {content}")
-                                    buffer += content
-                                    full_response += content
-                                    yield content
-                                elif 'data' in direct_json and isinstance(direct_json['data'], dict):
-                                    if 'content' in direct_json['data']:
-                                        content = direct_json['data']['content']
-                                        logger.debug(f"从嵌套JSON中提取内容: {content}")
-                                        buffer += content
-                                        full_response += content
-                                        yield content
-                            except json.JSONDecodeError:
-                                # 忽略非JSON行
-                                pass
-                    
-                    logger.debug(f"响应处理完成，共收到 {line_count} 行数据")
-                    
-                    # 如果没有成功解析任何内容，尝试替代解析方法
-                    if not full_response:
-                        logger.warning("常规解析未能提取内容，尝试备用解析方法")
-                        
-                        # 备用方法：搜索包含"content"的行
-                        content_fragments = []
-                        for line in raw_lines:
-                            if '"content":"' in line or '"content": "' in line:
-                                logger.debug(f"找到包含content的行: {line}")
-                                try:
-                                    # 尝试提取content值
-                                    start_idx = line.find('"content":"') + 11
-                                    if start_idx < 11:  # 如果没找到，尝试带空格的版本
-                                        start_idx = line.find('"content": "') + 12
-                                    
-                                    if start_idx > 11:  # 如果找到了
-                                        end_idx = line.find('"', start_idx)
-                                        if end_idx > start_idx:
-                                            content = line[start_idx:end_idx]
-                                            logger.debug(f"使用字符串搜索提取content: {content}")
-                                            content_fragments.append(content)
-                                except Exception as e:
-                                    logger.warning(f"备用解析内容时出错: {str(e)}")
-                        
-                        if content_fragments:
-                            full_text = "".join(content_fragments)
-                            logger.debug(f"备用方法提取的完整内容: {full_text}")
-                            yield full_text
-                            full_response = full_text
-                    
-                    # 更新会话历史
-                    if full_response:
-                        try:
-                            # 添加用户消息到历史
-                            history = self.conversations.get(session_id, [])
-                            history.append({"role": "user", "content": message})
-                            # 添加AI回复到历史
-                            history.append({"role": "assistant", "content": full_response})
-                            # 更新会话历史
-                            self.conversations[session_id] = history
-                            logger.debug(f"已更新会话历史，当前长度: {len(history)}")
-                        except Exception as e:
-                            logger.warning(f"更新会话历史出错: {str(e)}")
-                    else:
-                        logger.warning("未收到有效回复内容")
-                        
-            except asyncio.TimeoutError:
-                logger.error("聊天请求超时")
-                yield "请求超时，请稍后再试"
-            except Exception as e:
-                logger.error(f"聊天请求异常: {str(e)}")
-                yield f"请求异常: {str(e)}"
-                
-    async def generate_image(self, session_id: str, prompt: str, model: str = None, 
-                           ratio: str = "1:1", web_access: str = "close", 
-                           timezone: str = "Asia/Shanghai") -> AsyncGenerator[str, None]:
-        """生成图片
-        
-        Args:
-            session_id: 会话ID
-            prompt: 图片描述提示词
-            model: 使用的模型，为空则使用默认图片模型
-            ratio: 图片比例，默认1:1
-            web_access: 网络访问设置
-            timezone: 时区设置
-            
-        Yields:
-            str: 包含生成进度和最终图片链接的消息片段
-        """
-        url = f"{self.base_url}/api/v2/chat/conversation"
-        
-        # 如果未指定模型，使用默认图片模型
-        model_to_use = model if model else "openai/gpt-4o-image"
-        
-        # 准备请求体
-        payload = {
-            "model": model_to_use,
-            "prompt": prompt,
-            "webAccess": web_access,
-            "timezone": timezone
-        }
-        
-        if ratio:
-            payload["ratio"] = ratio
-            
-        headers = self._get_headers()
-        logger.debug(f"发送图片生成请求，payload: {payload}")
-        
-        image_url = None  # 保存提取的图片URL
-        
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(url, headers=headers, json=payload, timeout=180) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"图片生成请求失败: {response.status} - {error_text}")
-                        yield f"API错误: {response.status}"
-                        return
-                    
-                    logger.debug(f"收到图片生成响应，content-type: {response.headers.get('content-type')}")
-                    
-                    # 读取SSE响应
-                    progress_info = ""
-                    markdown_image = ""
-                    line_count = 0
-                    
-                    async for line in response.content:
-                        line_text = line.decode('utf-8')
-                        line_count += 1
-                        
-                        # 每5行打印一次原始数据以便调试
-                        if line_count <= 10 or line_count % 20 == 0:
-                            logger.debug(f"图片生成响应行 {line_count}: {line_text}")
-                        
-                        # 解析 data: 前缀
-                        if line_text.startswith('data:'):
-                            data = line_text[5:].strip()
-                            
-                            if data == "[DONE]":
-                                logger.debug("收到[DONE]标记")
-                                break
-                                
-                            try:
-                                json_data = json.loads(data)
-                                
-                                # 检查是否是进度更新
-                                if json_data.get('code') == 202 and 'data' in json_data:
-                                    data_obj = json_data['data']
-                                    if data_obj.get('type') == 'chat' and 'content' in data_obj:
-                                        content = data_obj['content']
-                                        if content:
-                                            # 检查是否是进度信息
-                                            if "进度" in content or "%" in content or "生成中" in content or "排队中" in content:
-                                                # 更新进度信息
-                                                progress_info = content
-                                                yield content
-                                                
-                                            # 检查是否包含图片URL (Markdown格式)
-                                            elif "![" in content and "](http" in content:
-                                                markdown_image = content
-                                                # 提取图片URL
-                                                start_idx = content.find("](") + 2
-                                                end_idx = content.find(")", start_idx)
-                                                if start_idx > 1 and end_idx > start_idx:
-                                                    image_url = content[start_idx:end_idx]
-                                                    logger.info(f"提取到图片URL: {image_url}")
-                                                yield content
-                                            else:
-                                                yield content
-                            except json.JSONDecodeError:
-                                pass
-                    
-                    logger.debug(f"图片生成响应处理完成，共收到 {line_count} 行数据")
-                    
-                    # 如果找到了图片URL，可以在这里下载保存
-                    if image_url and session_id:
-                        try:
-                            # 添加用户提示和AI回复到历史
-                            history = self.conversations.get(session_id, [])
-                            # 用户消息
-                            history.append({"role": "user", "content": f"生成图片: {prompt}"})
-                            # AI回复 (包含图片的Markdown)
-                            history.append({"role": "assistant", "content": markdown_image})
-                            # 更新会话历史
-                            self.conversations[session_id] = history
-                            logger.debug(f"已更新图片生成历史，当前长度: {len(history)}")
-                        except Exception as e:
-                            logger.warning(f"更新图片生成历史出错: {str(e)}")
-                        
-            except asyncio.TimeoutError:
-                logger.error("图片生成请求超时")
-                yield "图片生成请求超时，请稍后再试"
-            except Exception as e:
-                logger.error(f"图片生成请求异常: {str(e)}")
-                yield f"图片生成请求异常: {str(e)}"
-                
-    def _get_headers(self) -> Dict[str, str]:
-        """获取请求头
-        
-        Returns:
-            Dict[str, str]: HTTP请求头
-        """
-        return {
-            "Authorization": f"Bearer {self.api_token}",
-            "Content-Type": "application/json",
-            "Accept": "*/*",
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36 Edg/134.0.0.0",
-            "Origin": "chrome-extension://minfmdkpoboejckenbchpjbjjkbdebdm",
-            "i-lang": self.language,
-            "i-version": self.client_version,
-            "sec-ch-ua": "\"Chromium\";v=\"134\", \"Not:A-Brand\";v=\"24\", \"Microsoft Edge\";v=\"134\"",
-            "sec-ch-ua-mobile": "?0",
-            "sec-ch-ua-platform": "\"Windows\"",
-            "sec-fetch-dest": "empty",
-            "sec-fetch-mode": "cors",
-            "sec-fetch-site": "cross-site"
-        }
-    
-    def clear_conversation(self, session_id: str) -> None:
-        """清除特定会话的历史记录
-        
-        Args:
-            session_id: 会话ID
-        """
-        if session_id in self.conversations:
-            del self.conversations[session_id]
-    
-    def set_default_model(self, model: str) -> None:
-        """设置默认模型
-        
-        Args:
-            model: 模型名称，格式为"提供商/模型名"
-        """
-        self.default_model = model
-        logger.info(f"默认模型已更新为: {model}")
-            
-    def get_conversation_history(self, session_id: str) -> List[Dict]:
-        """获取会话历史
-        
-        Args:
-            session_id: 会话ID
-            
-        Returns:
-            List[Dict]: 会话历史消息列表
-        """
-        return self.conversations.get(session_id, []) 
\ No newline at end of file
+import aiohttp
+import asyncio
+import itertools
+import json
+import time
+from collections import OrderedDict
+from loguru import logger
+from typing import AsyncContextManager, Callable, Dict, List, Optional, AsyncGenerator, Tuple
+
+from .circuit_breaker import CircuitBreakerRegistry, CircuitOpenError, CircuitTicket
+from .context_builder import ContextBuilder
+from .conversation_db import SQLiteConversationBackend
+from .hedging import HedgedRequests
+from .model_selector import ModelSelector
+from .response_cache import ResponseCache, make_cache_key
+from .scheduler import SchedulerRejected
+from .session_store import SessionStore
+from .sse_decoder import SSEDecoder, SSEEvent, ContentFallbackScanner
+from .stream_timeouts import PhaseTimeouts, StreamDeadline, StreamStalled, TimeoutPolicy
+from .token_pool import TokenPool, TokenState
+
+
+# 表示请求失败的业务错误码
+ERROR_CODES = (1000, 1001, 1002, 1003, 1004, 1005)
+
+# 流式回复中途停顿超时时附加在已收到内容后的标记
+DEFAULT_STALL_MARKER = "\n\n（回复超时中断，以上为部分内容）"
+
+# 最多记录多少个改用对冲请求上游会话的会话
+MAX_UPSTREAM_IDS = 10000
+
+
+class UpstreamError(Exception):
+    """上游请求失败，异常信息为发给用户的错误提示"""
+    
+    def __init__(self, message: str, fallback: bool = False):
+        """初始化异常
+        
+        Args:
+            message: 发给用户的错误提示
+            fallback: 是否可以换用同组的其他模型重试（超时、业务错误码或模型熔断）
+        """
+        super().__init__(message)
+        self.fallback = fallback
+
+
+class ChargptAPIClient:
+    """Chargpt.ai API客户端，处理与API的通信"""
+    
+    def __init__(self, api_token: str, base_url: str, client_version: str, language: str,
+                default_model: str = "openai/gpt-4o", prompt_template: str = "{message}",
+                pool_limit: int = 100, pool_limit_per_host: int = 20,
+                keepalive_timeout: float = 30, dns_cache_ttl: int = 300,
+                max_history: int = 10, session_ttl: float = 86400, max_sessions: int = 1000,
+                max_history_chars: int = 5_000_000, history_db: Optional[str] = None,
+                history_retention_days: float = 30, response_cache: Optional[ResponseCache] = None,
+                cache_ignore_history: bool = False,
+                circuit_breakers: Optional[CircuitBreakerRegistry] = None,
+                timeout_policy: Optional[TimeoutPolicy] = None, stall_marker: str = DEFAULT_STALL_MARKER,
+                hedging: Optional[HedgedRequests] = None, token_pool: Optional[TokenPool] = None,
+                model_selector: Optional[ModelSelector] = None,
+                context_builder: Optional[ContextBuilder] = None):
+        """初始化API客户端
+        
+        Args:
+            api_token: API授权令牌
+            base_url: API基础URL
+            client_version: 客户端版本号
+            language: 语言设置
+            default_model: 默认使用的模型
+            prompt_template: 提示词模板
+            pool_limit: 连接池总连接数上限
+            pool_limit_per_host: 连接池单个主机连接数上限
+            keepalive_timeout: 空闲连接保活时间（秒）
+            dns_cache_ttl: DNS缓存时间（秒）
+            max_history: 每个会话保留的最大对话轮数
+            session_ttl: 会话空闲过期时间（秒）
+            max_sessions: 最多保留的会话数
+            max_history_chars: 所有会话历史的总字符数上限
+            history_db: 会话历史数据库路径，为空则不持久化
+            history_retention_days: 持久化会话的保留天数
+            response_cache: 可选的回复缓存，为空则不缓存也不合并请求
+            cache_ignore_history: 为True时所有聊天请求都使用缓存，否则只缓存没有历史的会话的请求
+            circuit_breakers: 按端点和模型的熔断器，为空则只统计不熔断
+            timeout_policy: 按请求类型和模型的阶段超时（连接/首字节/停顿/总时长），为空则使用默认值
+            stall_marker: 流式回复中途停顿超时时，附加在已收到内容之后的标记
+            hedging: 聊天请求的对冲策略，为空则不对冲
+            token_pool: 多个API令牌组成的账号池，为空则只使用 api_token
+            model_selector: 按延迟自动选择模型，为空则总是使用指定或默认的模型
+            context_builder: 按token预算把会话历史组装进提示词，为空则只发送当前消息
+        """
+        self.api_token = api_token
+        self.base_url = base_url.rstrip("/")  # 移除末尾斜杠
+        self.client_version = client_version
+        self.language = language
+        self.default_model = default_model
+        self.prompt_template = prompt_template
+        self.context_builder = context_builder
+        
+        # 连接池配置
+        self.pool_limit = pool_limit
+        self.pool_limit_per_host = pool_limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        
+        # 共享的HTTP会话，在start()中创建，close()中关闭
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._connector: Optional[aiohttp.TCPConnector] = None
+        self._requests_total = 0
+        self._requests_in_flight = 0
+        
+        # 会话存储，按会话ID保存有界的历史消息，可选持久化到SQLite
+        history_backend = None
+        if history_db:
+            history_backend = SQLiteConversationBackend(
+                history_db,
+                keep_messages=max_history * 2,
+                retention_days=history_retention_days
+            )
+        self.conversations = SessionStore(
+            max_history=max_history,
+            ttl=session_ttl,
+            max_sessions=max_sessions,
+            max_total_chars=max_history_chars,
+            backend=history_backend,
+            summarizer=context_builder.summarize if context_builder is not None else None
+        )
+        
+        # 回复缓存，只用于与会话历史无关的请求
+        self.response_cache = response_cache
+        self.cache_ignore_history = cache_ignore_history
+        
+        # 熔断器，上游持续出错时快速失败，避免请求堆积在超时上
+        self.circuit_breakers = circuit_breakers or CircuitBreakerRegistry(enabled=False)
+        
+        # 分阶段超时，卡住的流尽早结束，不必等满总超时
+        self.timeout_policy = timeout_policy or TimeoutPolicy({
+            "chat": PhaseTimeouts(total=60),
+            "image": PhaseTimeouts(first_byte=120, idle=60, total=180)
+        })
+        self.stall_marker = stall_marker
+        
+        # 对冲请求，首字节过慢时再发一个相同的请求，降低长尾延迟
+        # 对冲请求使用单独的上游会话，胜出后该会话之后的请求改用这个上游会话（会话ID -> 上游会话ID）
+        self.hedging = hedging
+        self._upstream_ids: "OrderedDict[str, str]" = OrderedDict()
+        self._hedge_ids = itertools.count(1)
+        
+        # 账号池，按负载和余额分配令牌，同一会话固定使用同一个令牌
+        self.token_pool = token_pool or TokenPool([api_token], pool_limit_per_host=pool_limit_per_host)
+        
+        # 模型选择器，未指定模型的请求在默认模型的等价组内按延迟选择，失败时换用下一个
+        self.model_selector = model_selector
+        
+    async def start(self) -> None:
+        """创建共享的HTTP会话和连接池，并打开会话历史存储（可重复调用）"""
+        await self.conversations.open()
+        if self._session is not None and not self._session.closed:
+            return
+        self._connector = aiohttp.TCPConnector(
+            limit=self.pool_limit,
+            limit_per_host=self.pool_limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.dns_cache_ttl,
+            use_dns_cache=True
+        )
+        self._session = aiohttp.ClientSession(connector=self._connector)
+        logger.debug(f"已创建HTTP连接池: limit={self.pool_limit}, limit_per_host={self.pool_limit_per_host}")
+        
+    async def close(self) -> None:
+        """关闭共享的HTTP会话，释放连接池，并提交未写入的会话历史"""
+        if self.response_cache is not None:
+            await self.response_cache.close()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.debug("已关闭HTTP连接池")
+        self._session = None
+        self._connector = None
+        await self.conversations.close()
+        
+    async def get_session(self) -> aiohttp.ClientSession:
+        """获取共享的HTTP会话，未创建或已关闭时自动创建
+        
+        Returns:
+            aiohttp.ClientSession: 共享的HTTP会话
+        """
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
+        
+    def get_pool_stats(self) -> Dict:
+        """获取连接池使用情况
+        
+        Returns:
+            Dict: 连接池统计信息
+        """
+        stats = {
+            "limit": self.pool_limit,
+            "limit_per_host": self.pool_limit_per_host,
+            "active": 0,
+            "idle": 0,
+            "requests_total": self._requests_total,
+            "requests_in_flight": self._requests_in_flight,
+            "open": self._session is not None and not self._session.closed
+        }
+        connector = self._connector
+        if connector is not None and not connector.closed:
+            # aiohttp未提供公开的统计接口，这里读取连接器内部状态
+            stats["active"] = len(getattr(connector, "_acquired", ()))
+            stats["idle"] = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+        return stats
+        
+    async def get_quota(self, token: Optional[TokenState] = None) -> Dict:
+        """获取用户配额信息，并更新账号池中该令牌的可用余额
+        
+        Args:
+            token: 查询的令牌，为空则查询第一个令牌
+            
+        Returns:
+            Dict: 用户配额信息
+        """
+        url = f"{self.base_url}/api/quota/retrieve"
+        
+        if token is None:
+            token = self.token_pool.tokens[0]
+        headers = self._get_headers(token.token)
+        
+        try:
+            ticket = self.circuit_breakers.acquire("quota")
+        except CircuitOpenError as e:
+            logger.warning(f"{e.name} 熔断中，快速失败")
+            return {"success": False, "error": str(e)}
+        
+        session = await self.get_session()
+        self._requests_total += 1
+        self._requests_in_flight += 1
+        try:
+            async with session.get(url, headers=headers) as response:
+                ticket.mark_first_byte()
+                if response.status != 200:
+                    error_text = await response.text()
+                    logger.error(f"获取配额失败: {response.status} - {error_text}")
+                    self._record_status(ticket, response.status)
+                    self.token_pool.record_status(token, response.status)
+                    return {"success": False, "error": f"API错误: {response.status}"}
+                
+                try:
+                    data = await response.json()
+                    ticket.success()
+                    self.token_pool.update_quota(token, data)
+                    return {"success": True, "data": data}
+                except Exception as e:
+                    logger.error(f"解析配额响应失败: {str(e)}")
+                    ticket.model_failure()
+                    return {"success": False, "error": f"解析响应失败: {str(e)}"}
+        except Exception:
+            ticket.failure()
+            raise
+        finally:
+            ticket.release()
+            self._requests_in_flight -= 1
+    
+    async def get_all_quotas(self) -> List[Tuple[TokenState, Dict]]:
+        """并发查询账号池中所有令牌的配额
+        
+        Returns:
+            List[Tuple[TokenState, Dict]]: (令牌, get_quota的结果) 列表
+        """
+        async def query(token: TokenState) -> Dict:
+            try:
+                return await self.get_quota(token)
+            except Exception as e:
+                logger.error(f"获取令牌 {token.label} 的配额异常: {str(e)}")
+                return {"success": False, "error": str(e)}
+        
+        tokens = self.token_pool.tokens
+        results = await asyncio.gather(*(query(token) for token in tokens))
+        return list(zip(tokens, results))
+    
+    async def chat(self, session_id: str, message: str, model: str = None,
+                   save_history: bool = True,
+                   slot: Optional[Callable[[], AsyncContextManager]] = None) -> AsyncGenerator[str, None]:
+        """发送消息并以流式方式接收响应
+        
+        开启回复缓存时，与会话历史无关的请求会先查缓存，未命中时与相同的进行中请求共享同一个上游流。
+        开启模型选择时，未指定模型的请求在默认模型的等价组内自动选择模型。
+        
+        Args:
+            session_id: 会话ID，用于跟踪对话历史
+            message: 用户消息
+            model: 使用的模型，为空则使用默认模型（或由模型选择器选择）
+            save_history: 是否把这轮对话写入会话历史
+            slot: 创建上游调度槽位的函数，返回异步上下文管理器；只有真正发起上游请求时才占用，
+                命中缓存或合并到进行中的相同请求时不占用
+            
+        Yields:
+            str: 响应消息片段
+        """
+        # 如果未指定模型，使用默认模型
+        model_to_use = model if model else self.default_model
+        route = not model and self.model_selector is not None
+        
+        # 会话首次使用时从持久化存储加载历史
+        if save_history:
+            await self.conversations.ensure_loaded(session_id)
+        
+        cache = self.response_cache
+        if cache is None or not (self.cache_ignore_history or session_id not in self.conversations):
+            completed: List[str] = []
+            stream = self._chat_stream(session_id, message, model_to_use, completed.append, route)
+            async for chunk in self._in_slot(stream, slot):
+                yield chunk
+            if completed and save_history:
+                self._record_chat(session_id, message, completed[0])
+            return
+        
+        key = make_cache_key(model_to_use, message)
+        cached = cache.get(key)
+        if cached is not None:
+            logger.debug(f"回复缓存命中: {key[:50]}")
+            yield cached
+            if save_history:
+                self._record_chat(session_id, message, cached)
+            return
+        
+        flight, leader = cache.join(
+            key, lambda on_complete: self._in_slot(
+                self._chat_stream(session_id, message, model_to_use, on_complete, route), slot))
+        if not leader:
+            logger.debug(f"合并到进行中的相同请求: {key[:50]}")
+        async for chunk in flight.subscribe():
+            yield chunk
+        if flight.result is not None and save_history:
+            self._record_chat(session_id, message, flight.result)
+    
+    async def complete(self, session_id: str, message: str, model: str = None) -> Tuple[str, bool]:
+        """发送消息并等待完整回复，不使用回复缓存，也不写入会话历史（用于批量任务）
+        
+        Args:
+            session_id: 上游的会话ID
+            message: 用户消息
+            model: 使用的模型，为空则使用默认模型（或由模型选择器选择）
+            
+        Returns:
+            Tuple[str, bool]: (完整回复，失败时为错误提示或中断前的部分内容, 是否成功)
+        """
+        model_to_use = model if model else self.default_model
+        route = not model and self.model_selector is not None
+        completed: List[str] = []
+        parts: List[str] = []
+        async for chunk in self._chat_stream(session_id, message, model_to_use, completed.append, route):
+            parts.append(chunk)
+        if completed:
+            return completed[0], True
+        return "".join(parts), False
+    
+    @staticmethod
+    async def _in_slot(stream: AsyncGenerator[str, None],
+                       slot: Optional[Callable[[], AsyncContextManager]]) -> AsyncGenerator[str, None]:
+        """占用上游调度槽位读取上游流，排队被拒绝时返回提示"""
+        if slot is None:
+            async for chunk in stream:
+                yield chunk
+            return
+        try:
+            async with slot():
+                async for chunk in stream:
+                    yield chunk
+        except SchedulerRejected as e:
+            yield str(e)
+    
+    def _record_chat(self, session_id: str, message: str, response: str) -> None:
+        """将一轮对话写入会话历史"""
+        try:
+            # 添加用户消息和AI回复到历史
+            self.conversations.add_turn(session_id, message, response)
+            logger.debug(f"已更新会话历史，当前会话数: {len(self.conversations)}")
+        except Exception as e:
+            logger.warning(f"更新会话历史出错: {str(e)}")
+    
+    async def _chat_stream(self, session_id: str, message: str, model_to_use: str,
+                           on_complete: Callable[[str], None], route: bool = False) -> AsyncGenerator[str, None]:
+        """向上游发送聊天请求并流式返回响应
+        
+        开启对冲时首字节过慢会再发一个相同的请求；route为True时在模型的等价组内按延迟依次尝试，
+        收到首个数据块之前超时或返回业务错误时换用下一个模型。
+        
+        Args:
+            session_id: 会话ID，作为上游的conversation_id
+            message: 用户消息
+            model_to_use: 使用的模型
+            on_complete: 成功收到完整回复时的回调，参数为完整回复；出错时不会调用
+            route: 是否由模型选择器选择模型
+            
+        Yields:
+            str: 响应消息片段，出错时为错误提示
+        """
+        selector = self.model_selector if route else None
+        models = selector.candidates(model_to_use) if selector is not None else [model_to_use]
+        for index, model in enumerate(models):
+            started = time.monotonic()
+            ttfb = None
+            chars = 0
+            stalled = False
+            try:
+                async for chunk in self._chat_model_stream(session_id, message, model, on_complete):
+                    if ttfb is None:
+                        ttfb = time.monotonic() - started
+                    chars += len(chunk)
+                    stalled = chunk is self.stall_marker
+                    yield chunk
+            except UpstreamError as e:
+                fallback = e.fallback and ttfb is None and index + 1 < len(models)
+                if selector is not None:
+                    selector.record_failure(model, fallback)
+                if fallback:
+                    logger.warning(f"模型 {model} 请求失败，切换到 {models[index + 1]}: {str(e)}")
+                    continue
+                yield str(e)
+                return
+            if selector is not None:
+                if stalled or ttfb is None:
+                    selector.record_failure(model)
+                else:
+                    selector.record_success(model, ttfb, chars, time.monotonic() - started - ttfb)
+            return
+    
+    async def _chat_model_stream(self, session_id: str, message: str, model_to_use: str,
+                                 on_complete: Callable[[str], None]) -> AsyncGenerator[str, None]:
+        """使用指定模型发送聊天请求，开启对冲时首字节过慢会再发一个相同的请求
+        
+        上游按 conversation_id 保存对话上下文，对冲请求不能重复发到同一个上游会话，
+        因此对冲请求使用新的上游会话：对冲请求落败时这个上游会话直接丢弃；胜出时本会话之后的请求
+        改用它，原上游会话（可能已经收到这轮消息）不再使用。新的上游会话没有之前的上下文，
+        所以只对本地没有历史的会话、或开启了上下文组装（提示词中带有历史）的请求发送对冲请求。
+        
+        Args:
+            session_id: 会话ID
+            message: 用户消息
+            model_to_use: 使用的模型
+            on_complete: 成功收到完整回复时的回调
+            
+        Yields:
+            str: 响应消息片段
+            
+        Raises:
+            UpstreamError: 请求失败
+        """
+        conversation_id = self._upstream_ids.get(session_id, session_id)
+        if self.hedging is None or (self.context_builder is None and session_id in self.conversations):
+            async for chunk in self._chat_attempt(session_id, message, model_to_use, on_complete, conversation_id):
+                yield chunk
+            return
+        
+        hedge_id = f"{session_id}#hedge{next(self._hedge_ids)}"
+        
+        def hedge_complete(response: str) -> None:
+            # 只有胜出的请求会完整结束
+            self._upstream_ids[session_id] = hedge_id
+            self._upstream_ids.move_to_end(session_id)
+            if len(self._upstream_ids) > MAX_UPSTREAM_IDS:
+                self._upstream_ids.popitem(last=False)
+            on_complete(response)
+        
+        async for chunk in self.hedging.run(
+                lambda: self._chat_attempt(session_id, message, model_to_use, on_complete, conversation_id),
+                model_to_use,
+                lambda: self._chat_attempt(session_id, message, model_to_use, hedge_complete, hedge_id)):
+            yield chunk
+    
+    async def _chat_attempt(self, session_id: str, message: str, model_to_use: str,
+                            on_complete: Callable[[str], None],
+                            conversation_id: Optional[str] = None) -> AsyncGenerator[str, None]:
+        """发送一次聊天请求
+        
+        Args:
+            session_id: 会话ID，用于组装会话历史
+            message: 用户消息
+            model_to_use: 使用的模型
+            on_complete: 成功收到完整回复时的回调，参数为完整回复；出错时不会调用
+            conversation_id: 上游的conversation_id，为空时使用会话ID
+            
+        Yields:
+            str: 响应消息片段
+            
+        Raises:
+            UpstreamError: 请求失败，异常信息为发给用户的错误提示
+        """
+        url = f"{self.base_url}/api/v2/chat/conversation"
+        
+        # 生成提示词，开启上下文组装时按模型的token预算带上会话历史
+        prompt = self._build_prompt(session_id, message, model_to_use)
+        
+        # 准备简单的请求体，模拟网页请求
+        conversation_id = conversation_id or session_id
+        payload = {
+            "message": message,
+            "conversation_id": conversation_id,
+            "model": model_to_use,    # 使用指定的模型
+            "prompt": prompt          # 使用模板生成的提示词
+        }
+        
+        timeouts = self.timeout_policy.resolve("chat", model_to_use)
+        logger.debug(f"发送聊天请求，payload: {payload}")
+        
+        try:
+            ticket = self.circuit_breakers.acquire("chat", model_to_use)
+        except CircuitOpenError as e:
+            logger.warning(f"{e.name} 熔断中，快速失败")
+            raise UpstreamError(str(e), fallback=True) from None
+        
+        token = self.token_pool.acquire(conversation_id)
+        headers = self._get_headers(token.token)
+        session = await self.get_session()
+        self._requests_total += 1
+        self._requests_in_flight += 1
+        response_parts: List[str] = []
+        try:
+            try:
+                deadline = timeouts.deadline()
+                response = await deadline.wait(
+                    session.post(url, headers=headers, json=payload, timeout=timeouts.client_timeout()))
+                async with response:
+                    if response.status != 200:
+                        error_text = await response.text()
+                        logger.error(f"聊天请求失败: {response.status} - {error_text}")
+                        self._record_status(ticket, response.status)
+                        self.token_pool.record_status(token, response.status)
+                        raise UpstreamError(f"API错误: {response.status}")
+                    
+                    logger.debug(f"收到响应，content-type: {response.headers.get('content-type')}")
+                    
+                    # 读取SSE响应
+                    decoder = SSEDecoder()
+                    fallback = ContentFallbackScanner()
+                    
+                    async for event in self._iter_events(response, decoder, deadline):
+                        ticket.mark_first_byte()
+                        kind, content = self._parse_event(event)
+                        
+                        if kind == "done":
+                            logger.debug("收到[DONE]标记")
+                            break
+                        elif kind == "error":
+                            logger.error(content)
+                            ticket.model_failure()
+                            self.token_pool.record_error(token, content)
+                            raise UpstreamError(content, fallback=True)
+                        elif kind == "content":
+                            if fallback.enabled:
+                                fallback.disable()
+                            response_parts.append(content)
+                            yield content
+                        elif kind == "unknown":
+                            # 记录无法识别的数据，供备用解析使用
+                            fallback.scan(event.data)
+                    
+                    logger.debug(f"响应处理完成，共收到 {decoder.line_count} 行数据，{decoder.event_count} 个事件")
+                    full_response = "".join(response_parts)
+                    
+                    # 如果没有成功解析任何内容，使用备用解析结果
+                    if not full_response:
+                        logger.warning("常规解析未能提取内容，尝试备用解析方法")
+                        full_text = fallback.result()
+                        if full_text:
+                            logger.debug(f"备用方法提取的完整内容: {full_text}")
+                            yield full_text
+                            full_response = full_text
+                    
+                    if full_response:
+                        ticket.success()
+                        self.token_pool.consume(token, "chat")
+                        on_complete(full_response)
+                    else:
+                        ticket.model_failure()
+                        logger.warning("未收到有效回复内容")
+                        
+            except UpstreamError:
+                raise
+            except StreamStalled as e:
+                ticket.failure(timeout=True)
+                if not response_parts:
+                    logger.error(f"聊天请求超时: {str(e)}")
+                    raise UpstreamError("请求超时，请稍后再试", fallback=True) from None
+                # 已经收到部分回复，以部分回复加中断标记结束，不当作错误
+                logger.warning(f"聊天回复中断: {str(e)}，已收到{sum(map(len, response_parts))}个字符")
+                yield self.stall_marker
+            except asyncio.TimeoutError:
+                logger.error("聊天请求超时")
+                ticket.failure(timeout=True)
+                raise UpstreamError("请求超时，请稍后再试", fallback=True) from None
+            except Exception as e:
+                logger.error(f"聊天请求异常: {str(e)}")
+                ticket.failure()
+                raise UpstreamError(f"请求异常: {str(e)}") from None
+        finally:
+            ticket.release()
+            self.token_pool.release(token)
+            self._requests_in_flight -= 1
+                
+    async def generate_image(self, session_id: str, prompt: str, model: str = None, 
+                           ratio: str = "1:1", web_access: str = "close", 
+                           timezone: str = "Asia/Shanghai") -> AsyncGenerator[str, None]:
+        """生成图片
+        
+        Args:
+            session_id: 会话ID
+            prompt: 图片描述提示词
+            model: 使用的模型，为空则使用默认图片模型
+            ratio: 图片比例，默认1:1
+            web_access: 网络访问设置
+            timezone: 时区设置
+            
+        Yields:
+            str: 包含生成进度和最终图片链接的消息片段
+        """
+        url = f"{self.base_url}/api/v2/chat/conversation"
+        
+        # 如果未指定模型，使用默认图片模型
+        model_to_use = model if model else "openai/gpt-4o-image"
+        
+        # 准备请求体
+        payload = {
+            "model": model_to_use,
+            "prompt": prompt,
+            "webAccess": web_access,
+            "timezone": timezone
+        }
+        
+        if ratio:
+            payload["ratio"] = ratio
+            
+        timeouts = self.timeout_policy.resolve("image", model_to_use)
+        logger.debug(f"发送图片生成请求，payload: {payload}")
+        
+        if session_id:
+            await self.conversations.ensure_loaded(session_id)
+        
+        image_url = None  # 保存提取的图片URL
+        
+        try:
+            ticket = self.circuit_breakers.acquire("image", model_to_use)
+        except CircuitOpenError as e:
+            logger.warning(f"{e.name} 熔断中，快速失败")
+            yield str(e)
+            return
+        
+        token = self.token_pool.acquire(session_id)
+        headers = self._get_headers(token.token)
+        session = await self.get_session()
+        self._requests_total += 1
+        self._requests_in_flight += 1
+        received_content = False
+        try:
+            try:
+                deadline = timeouts.deadline()
+                response = await deadline.wait(
+                    session.post(url, headers=headers, json=payload, timeout=timeouts.client_timeout()))
+                async with response:
+                    if response.status != 200:
+                        error_text = await response.text()
+                        logger.error(f"图片生成请求失败: {response.status} - {error_text}")
+                        self._record_status(ticket, response.status)
+                        self.token_pool.record_status(token, response.status)
+                        yield f"API错误: {response.status}"
+                        return
+                    
+                    logger.debug(f"收到图片生成响应，content-type: {response.headers.get('content-type')}")
+                    
+                    # 读取SSE响应
+                    decoder = SSEDecoder()
+                    markdown_image = ""
+                    
+                    async for event in self._iter_events(response, decoder, deadline):
+                        ticket.mark_first_byte()
+                        kind, content = self._parse_event(event)
+                        
+                        if kind == "done":
+                            logger.debug("收到[DONE]标记")
+                            break
+                        elif kind == "error":
+                            logger.error(content)
+                            ticket.model_failure()
+                            self.token_pool.record_error(token, content)
+                            yield content
+                            return
+                        elif kind != "content":
+                            continue
+                        
+                        received_content = True
+                        # 检查是否包含图片URL (Markdown格式)
+                        if "![" in content and "](http" in content:
+                            markdown_image = content
+                            # 提取图片URL
+                            start_idx = content.find("](") + 2
+                            end_idx = content.find(")", start_idx)
+                            if start_idx > 1 and end_idx > start_idx:
+                                image_url = content[start_idx:end_idx]
+                                logger.info(f"提取到图片URL: {image_url}")
+                        yield content
+                    
+                    logger.debug(f"图片生成响应处理完成，共收到 {decoder.line_count} 行数据")
+                    if image_url:
+                        ticket.success()
+                        self.token_pool.consume(token, "image")
+                    else:
+                        ticket.model_failure()
+                    
+                    # 如果找到了图片URL，可以在这里下载保存
+                    if image_url and session_id:
+                        try:
+                            # 添加用户提示和AI回复 (包含图片的Markdown) 到历史
+                            self.conversations.add_turn(session_id, f"生成图片: {prompt}", markdown_image)
+                            logger.debug(f"已更新图片生成历史，当前会话数: {len(self.conversations)}")
+                        except Exception as e:
+                            logger.warning(f"更新图片生成历史出错: {str(e)}")
+                        
+            except StreamStalled as e:
+                ticket.failure(timeout=True)
+                if received_content:
+                    logger.warning(f"图片生成响应中断: {str(e)}")
+                    yield self.stall_marker
+                else:
+                    logger.error(f"图片生成请求超时: {str(e)}")
+                    yield "图片生成请求超时，请稍后再试"
+            except asyncio.TimeoutError:
+                logger.error("图片生成请求超时")
+                ticket.failure(timeout=True)
+                yield "图片生成请求超时，请稍后再试"
+            except Exception as e:
+                logger.error(f"图片生成请求异常: {str(e)}")
+                ticket.failure()
+                yield f"图片生成请求异常: {str(e)}"
+        finally:
+            ticket.release()
+            self.token_pool.release(token)
+            self._requests_in_flight -= 1
+                
+    def _build_prompt(self, session_id: str, message: str, model: str) -> str:
+        """按提示词模板生成提示词"""
+        if self.context_builder is None:
+            return self.prompt_template.format(message=message, context="")
+        history, summary = self.conversations.get_context(session_id)
+        return self.context_builder.build(self.prompt_template, message, history, summary, model)
+            
+    @staticmethod
+    def _record_status(ticket: CircuitTicket, status: int) -> None:
+        """按HTTP状态码记录失败：服务端错误和限流说明上游不可用，其他错误只记在模型上"""
+        if status >= 500 or status == 429:
+            ticket.failure()
+        else:
+            ticket.model_failure()
+            
+    async def _iter_events(self, response: aiohttp.ClientResponse, decoder: SSEDecoder,
+                           deadline: StreamDeadline) -> AsyncGenerator[SSEEvent, None]:
+        """从响应流中增量解码SSE事件
+        
+        Args:
+            response: HTTP响应
+            decoder: SSE解码器
+            deadline: 请求的阶段超时，首块数据受首字节超时限制，之后每块受停顿超时限制
+            
+        Yields:
+            SSEEvent: 解码出的事件
+            
+        Raises:
+            StreamStalled: 等待数据超时
+        """
+        content = response.content
+        while True:
+            chunk = await deadline.wait(content.readany())
+            if not chunk:
+                break
+            deadline.received = True
+            for event in decoder.feed(chunk):
+                yield event
+        for event in decoder.flush():
+            yield event
+            
+    def _parse_event(self, event: SSEEvent) -> Tuple[str, str]:
+        """解析一个SSE事件
+        
+        Args:
+            event: SSE事件
+            
+        Returns:
+            Tuple[str, str]: (类型, 内容)，类型为 done/error/content/control/unknown 之一
+        """
+        if event.is_done:
+            return "done", ""
+        
+        json_data = event.json()
+        if not isinstance(json_data, dict):
+            if event.event == "error":
+                return "error", f"API错误: {event.text.strip()}"
+            logger.warning(f"无法解析JSON数据: {event.text[:200]}")
+            return "unknown", ""
+        
+        code = json_data.get('code')
+        
+        # 检查是否是错误响应
+        if (code in ERROR_CODES and 'message' in json_data) or event.event == "error":
+            error_msg = json_data.get('message', '未知错误')
+            debug_info = json_data.get('debugInfo', '')
+            error_text = f"API错误({code}): {error_msg}"
+            if debug_info:
+                error_text += f"\n调试信息: {debug_info}"
+            return "error", error_text
+        
+        # 解析方式 1: 使用code和data字段
+        data_obj = json_data.get('data')
+        if code == 202 and isinstance(data_obj, dict):
+            if data_obj.get('type') == 'chat' and data_obj.get('content'):
+                return "content", data_obj['content']
+            return "unknown", ""
+        
+        # 解析方式 2: 使用OpenAI风格的格式
+        choices = json_data.get('choices')
+        if choices:
+            content = choices[0].get('delta', {}).get('content', '')
+            return ("content", content) if content else ("control", "")
+        
+        # 解析方式 3: 流开始或结束标记
+        if code in (201, 203):
+            logger.debug(f"收到流控制标记 code={code}")
+            return "control", ""
+        
+        # 解析方式 4: 直接提取content字段或嵌套的data.content字段
+        content = json_data.get('content')
+        if content is None and isinstance(data_obj, dict):
+            content = data_obj.get('content')
+        if isinstance(content, str) and content:
+            return "content", content
+        
+        return "unknown", ""
+        
+    def _get_headers(self, token: Optional[str] = None) -> Dict[str, str]:
+        """获取请求头
+        
+        Args:
+            token: 使用的API令牌，为空则使用 api_token
+            
+        Returns:
+            Dict[str, str]: HTTP请求头
+        """
+        return {
+            "Authorization": f"Bearer {token or self.api_token}",
+            "Content-Type": "application/json",
+            "Accept": "*/*",
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36 Edg/134.0.0.0",
+            "Origin": "chrome-extension://minfmdkpoboejckenbchpjbjjkbdebdm",
+            "i-lang": self.language,
+            "i-version": self.client_version,
+            "sec-ch-ua": "\"Chromium\";v=\"134\", \"Not:A-Brand\";v=\"24\", \"Microsoft Edge\";v=\"134\"",
+            "sec-ch-ua-mobile": "?0",
+            "sec-ch-ua-platform": "\"Windows\"",
+            "sec-fetch-dest": "empty",
+            "sec-fetch-mode": "cors",
+            "sec-fetch-site": "cross-site"
+        }
+    
+    def clear_conversation(self, session_id: str) -> None:
+        """清除特定会话的历史记录
+        
+        Args:
+            session_id: 会话ID
+        """
+        self.conversations.clear(session_id)
+    
+    def set_default_model(self, model: str) -> None:
+        """设置默认模型
+        
+        Args:
+            model: 模型名称，格式为"提供商/模型名"
+        """
+        self.default_model = model
+        logger.info(f"默认模型已更新为: {model}")
+            
+    async def get_conversation_history(self, session_id: str) -> List[Dict]:
+        """获取会话历史，不在内存中的会话会先从持久化存储加载
+        
+        Args:
+            session_id: 会话ID
+            
+        Returns:
+            List[Dict]: 会话历史消息列表
+        """
+        await self.conversations.ensure_loaded(session_id)
+        return self.conversations.get(session_id) 
\ No newline at end of file
@@ -0,0 +1,305 @@
+"""批量任务：把JSONL文件中的问题逐条发送给AI，结果写入JSONL文件
+
+在 XXXBot 的 plugins 目录下以模块方式运行（使用插件的 config.toml 中的API配置）:
+
+    python -m ChargptChat.batch prompts.jsonl -o results.jsonl --concurrency 4 --rate 2
+
+输入每行一个JSON对象: {"id": "faq-1", "prompt": "问题", "model": "openai/gpt-4o"}，
+id 缺省时使用行号，model 缺省时使用 --model 或配置中的默认模型。id 只用于输出，
+每行都在独立的上游会话中请求，互不共享上下文。
+输出每行一个JSON对象: {"id", "model", "ok", "response", "seconds"}，失败时 ok 为false，
+response 为错误提示或中断前的部分回复。
+
+- 按行流式读取输入，同时处理的行数有上限，内存占用与文件大小无关
+- 每完成一行立即写入输出，并更新检查点（输出文件名加 .ckpt）；中断后重新运行同一命令会从检查点继续，
+  已完成的行不会重复请求（检查点写入前中断时，最后完成的几行可能在输出中重复出现）
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import tomllib
+import uuid
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+from loguru import logger
+
+from .api_client import ChargptAPIClient
+from .stream_timeouts import PhaseTimeouts, TimeoutPolicy
+from .token_pool import TokenPool
+
+
+class RateLimiter:
+    """按固定间隔放行请求，rate 为每秒请求数，小于等于0表示不限速"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+
+    async def wait(self) -> None:
+        if self.interval <= 0:
+            return
+        now = time.monotonic()
+        start = max(now, self._next)
+        self._next = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+class Checkpoint:
+    """批量任务的检查点
+
+    记录输入文件中之前所有行都已完成的位置（字节偏移），以及该位置之后已经完成的行号。
+    后者的数量受 run_batch 的 window 限制，因此检查点大小与输入文件大小无关。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offset = 0
+        self.line = 0
+        self.done_ahead: Set[int] = set()
+        self.ok = 0
+        self.failed = 0
+
+        # 已读取、但之前还有未完成行的条目: 行号 -> [结束偏移, 是否完成]
+        self._window: "OrderedDict[int, list]" = OrderedDict()
+
+    def __len__(self) -> int:
+        """已读取、但之前还有未完成行的行数"""
+        return len(self._window)
+
+    def load(self) -> bool:
+        """读取检查点文件，文件不存在时返回False"""
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.offset = data["offset"]
+        self.line = data["line"]
+        self.done_ahead = set(data.get("done_ahead", []))
+        self.ok = data.get("ok", 0)
+        self.failed = data.get("failed", 0)
+        return True
+
+    def start(self, line: int, end_offset: int) -> None:
+        """开始处理一行"""
+        self._window[line] = [end_offset, False]
+
+    def finish(self, line: int, ok: Optional[bool] = None) -> None:
+        """一行处理完成，推进已完成位置并保存检查点
+
+        Args:
+            line: 行号
+            ok: 请求是否成功，None 表示没有发送请求（空行、格式错误或之前已完成）
+        """
+        self._window[line][1] = True
+        if ok is True:
+            self.ok += 1
+        elif ok is False:
+            self.failed += 1
+        while self._window:
+            first_line, (end_offset, done) = next(iter(self._window.items()))
+            if not done:
+                break
+            self._window.popitem(last=False)
+            self.offset = end_offset
+            self.line = first_line
+            self.done_ahead.discard(first_line)
+        self.save()
+
+    def save(self) -> None:
+        done_ahead = sorted(self.done_ahead | {line for line, (_, done) in self._window.items() if done})
+        data = {"offset": self.offset, "line": self.line, "done_ahead": done_ahead,
+                "ok": self.ok, "failed": self.failed}
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+def parse_row(raw: bytes, line: int) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """解析一行输入
+
+    Returns:
+        Tuple[Optional[str], Optional[str], Optional[str]]: (id, 问题, 模型)，空行返回 (None, None, None)
+
+    Raises:
+        ValueError: 不是JSON对象，或 prompt 不是非空字符串
+    """
+    text = raw.decode("utf-8").strip()
+    if not text:
+        return None, None, None
+    row = json.loads(text)
+    if not isinstance(row, dict):
+        raise ValueError("每行必须是JSON对象")
+    prompt = row.get("prompt")
+    if not isinstance(prompt, str) or not prompt.strip():
+        raise ValueError("prompt 必须是非空字符串")
+    model = row.get("model")
+    if model is not None and not isinstance(model, str):
+        raise ValueError("model 必须是字符串")
+    row_id = row.get("id")
+    return str(row_id if row_id is not None else line), prompt, model
+
+
+def create_client(config: Dict, concurrency: int) -> ChargptAPIClient:
+    """按插件配置创建API客户端，连接数按并发数设置"""
+    api_config = config.get("api", {})
+    model_config = config.get("model", {})
+    chat_config = config.get("chat", {})
+    api_token = api_config.get("api_token", "")
+    pool_size = max(concurrency, 1)
+    return ChargptAPIClient(
+        api_token=api_token,
+        base_url=api_config.get("base_url", "https://api.chargpt.ai"),
+        client_version=api_config.get("client_version", "1.1.76"),
+        language=api_config.get("language", "zh-CN"),
+        default_model=model_config.get("default_model", "openai/gpt-4o"),
+        prompt_template=model_config.get("prompt_template", "{message}"),
+        pool_limit=pool_size,
+        pool_limit_per_host=pool_size,
+        timeout_policy=TimeoutPolicy(
+            {
+                "chat": PhaseTimeouts(
+                    connect=chat_config.get("connect_timeout", 10),
+                    first_byte=chat_config.get("first_byte_timeout", 30),
+                    idle=chat_config.get("idle_timeout", 20),
+                    total=chat_config.get("timeout", 60)
+                )
+            },
+            config.get("model_timeouts", {})
+        ),
+        token_pool=TokenPool(
+            [api_token] + list(api_config.get("api_tokens", [])),
+            pool_limit_per_host=pool_size,
+            eject_seconds=api_config.get("token_eject_seconds", 60),
+            quota_eject_seconds=api_config.get("quota_eject_seconds", 600)
+        )
+    )
+
+
+async def run_batch(client: ChargptAPIClient, input_path: str, output_path: str, checkpoint: Checkpoint,
+                    resume: bool = False, concurrency: int = 4, rate: float = 0.0, model: str = "",
+                    window: int = 0) -> None:
+    """处理整个输入文件
+
+    Args:
+        client: API客户端
+        input_path: 输入JSONL文件
+        output_path: 输出JSONL文件，从检查点继续时追加写入
+        checkpoint: 检查点
+        resume: 是否从检查点继续，为False时清空输出文件
+        concurrency: 同时处理的行数
+        rate: 每秒最多发出的请求数，小于等于0表示不限速
+        model: 输入中没有指定模型时使用的模型，为空则使用默认模型
+        window: 最早的未完成行之后最多读取多少行，某一行特别慢时暂停读取，
+            避免检查点和内存中的已完成行无限增长；小于等于0时为 concurrency 的10倍
+    """
+    window = window if window > 0 else concurrency * 10
+    progressed = asyncio.Event()
+    limiter = RateLimiter(rate)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+    skip = set(checkpoint.done_ahead)
+    submitted = 0
+
+    with open(input_path, "rb") as source, open(output_path, "a" if resume else "w", encoding="utf-8") as output:
+
+        async def worker():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                line, row_id, prompt, row_model = item
+                await limiter.wait()
+                started = time.monotonic()
+                try:
+                    # 每行使用独立的上游会话，id相同的行或多次运行之间不共享上下文
+                    text, ok = await client.complete(f"batch-{uuid.uuid4().hex}", prompt, row_model or model or None)
+                except Exception as e:
+                    text, ok = f"请求异常: {str(e)}", False
+                seconds = time.monotonic() - started
+                result = {"id": row_id, "model": row_model or model or client.default_model, "ok": ok,
+                          "response": text, "seconds": round(seconds, 3)}
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                output.flush()
+                checkpoint.finish(line, ok)
+                progressed.set()
+                if not ok:
+                    logger.warning(f"第{line}行（{row_id}）失败: {text[:100]}")
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        source.seek(checkpoint.offset)
+        offset = checkpoint.offset
+        line = checkpoint.line
+        started = time.monotonic()
+        for raw in source:
+            while len(checkpoint) >= window:
+                progressed.clear()
+                await progressed.wait()
+            offset += len(raw)
+            line += 1
+            checkpoint.start(line, offset)
+            if line in skip:
+                checkpoint.finish(line)
+                continue
+            try:
+                row_id, prompt, row_model = parse_row(raw, line)
+            except (ValueError, UnicodeDecodeError) as e:
+                logger.error(f"第{line}行格式错误，已跳过: {str(e)}")
+                row_id, prompt = None, None
+            if not prompt:
+                checkpoint.finish(line)
+                continue
+            submitted += 1
+            await queue.put((line, row_id, prompt, row_model))
+            if submitted % 100 == 0:
+                logger.info(f"已提交 {submitted} 行，成功 {checkpoint.ok}，失败 {checkpoint.failed}，"
+                            f"{submitted / (time.monotonic() - started):.1f} 行/秒")
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量发送JSONL文件中的问题")
+    parser.add_argument("input", help="输入JSONL文件，每行 {\"id\", \"prompt\", \"model\"}")
+    parser.add_argument("-o", "--output", required=True, help="输出JSONL文件")
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(__file__), "config.toml"), help="配置文件")
+    parser.add_argument("--model", default="", help="输入中没有指定模型时使用的模型")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时处理的行数")
+    parser.add_argument("--rate", type=float, default=0.0, help="每秒最多发出的请求数，0表示不限速")
+    parser.add_argument("--restart", action="store_true", help="忽略已有的检查点，从头开始")
+    parser.add_argument("--log-level", default="INFO", help="日志级别")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    with open(args.config, "rb") as f:
+        config = tomllib.load(f)
+
+    checkpoint = Checkpoint(args.output + ".ckpt")
+    resume = not args.restart and checkpoint.load()
+    if resume:
+        logger.info(f"从检查点继续: 第{checkpoint.line}行之后，已成功 {checkpoint.ok}，失败 {checkpoint.failed}")
+    concurrency = max(1, args.concurrency)
+
+    async def run():
+        client = create_client(config, concurrency)
+        await client.start()
+        try:
+            await run_batch(client, args.input, args.output, checkpoint, resume=resume,
+                            concurrency=concurrency, rate=args.rate, model=args.model)
+        finally:
+            await client.close()
+
+    started = time.monotonic()
+    asyncio.run(run())
+    logger.info(f"批量任务完成，成功 {checkpoint.ok}，失败 {checkpoint.failed}，耗时 {time.monotonic() - started:.1f}秒")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""模拟 chargpt.ai 上游的本地SSE服务，供基准测试使用
+
+请求体中的 model 字段决定返回的内容（场景）:
+- bench/code202: code 202 格式的数据块
+- bench/openai: OpenAI 风格的 choices/delta 数据块
+- bench/error: 开始标记后返回错误码 1001
+- bench/stall: 发送一半数据块后停顿 stall_seconds 秒
+- bench/huge: huge_chunks 个较大的数据块
+其他模型按 bench/code202 处理。模型名含 image 的请求按图片生成处理，返回进度和图片链接。
+"""
+import asyncio
+import json
+import multiprocessing
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+SCENARIOS = ("code202", "openai", "error", "stall", "huge")
+
+# 图片生成请求返回的图片链接，不会被实际下载
+IMAGE_URL = "http://127.0.0.1/bench.png"
+
+
+class UpstreamProfile:
+    """模拟上游的行为参数"""
+
+    def __init__(self, chunks: int = 100, chunk_chars: int = 16, ttfb: float = 0.0, interval: float = 0.0,
+                 stall_seconds: float = 5.0, huge_chunks: int = 5000, huge_chunk_chars: int = 256):
+        """初始化参数
+
+        Args:
+            chunks: 每个回复的数据块数
+            chunk_chars: 每个数据块的字符数
+            ttfb: 发送第一个数据块前的等待时间（秒）
+            interval: 相邻数据块之间的间隔（秒）
+            stall_seconds: stall 场景的停顿时间（秒）
+            huge_chunks: huge 场景的数据块数
+            huge_chunk_chars: huge 场景每个数据块的字符数
+        """
+        self.chunks = chunks
+        self.chunk_chars = chunk_chars
+        self.ttfb = ttfb
+        self.interval = interval
+        self.stall_seconds = stall_seconds
+        self.huge_chunks = huge_chunks
+        self.huge_chunk_chars = huge_chunk_chars
+
+    def to_dict(self) -> Dict:
+        return dict(self.__dict__)
+
+
+def build_events(scenario: str, profile: UpstreamProfile) -> List[bytes]:
+    """生成某个场景的全部SSE事件（不含停顿）
+
+    Returns:
+        List[bytes]: 按顺序发送的事件
+    """
+    chunks, chars = profile.chunks, profile.chunk_chars
+    if scenario == "huge":
+        chunks, chars = profile.huge_chunks, profile.huge_chunk_chars
+    text = ("流式回复内容abc" * (chars // 8 + 1))[:chars]
+
+    events = [b'data: {"code":201,"data":{"type":"start"}}\n\n']
+    if scenario == "image":
+        for percent in (25, 50, 75, 100):
+            events.append(json_event({"code": 202, "data": {"type": "chat", "content": f"图片生成进度 {percent}%"}}))
+        events.append(json_event({"code": 202, "data": {"type": "chat", "content": f"![image]({IMAGE_URL})"}}))
+        events.append(b'data: {"code":203,"data":{"type":"end"}}\n\n')
+        events.append(b"data: [DONE]\n\n")
+        return events
+    if scenario == "error":
+        events.append(json_event({"code": 1001, "message": "bench error", "debugInfo": "fake upstream"}))
+        return events
+    for _ in range(chunks):
+        if scenario == "openai":
+            events.append(json_event({"choices": [{"delta": {"content": text}}]}))
+        else:
+            events.append(json_event({"code": 202, "data": {"type": "chat", "content": text}}))
+    events.append(b'data: {"code":203,"data":{"type":"end"}}\n\n')
+    events.append(b"data: [DONE]\n\n")
+    return events
+
+
+def json_event(payload: Dict) -> bytes:
+    return b"data: " + json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n\n"
+
+
+def create_app(profile: UpstreamProfile) -> web.Application:
+    """创建模拟上游的aiohttp应用"""
+    cache: Dict[str, List[bytes]] = {}
+
+    async def conversation(request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        model = str(payload.get("model", ""))
+        scenario = model.rpartition("/")[2]
+        if "image" in model:
+            scenario = "image"
+        elif scenario not in SCENARIOS:
+            scenario = "code202"
+        events = cache.get(scenario)
+        if events is None:
+            events = cache[scenario] = build_events(scenario, profile)
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        if profile.ttfb > 0:
+            await asyncio.sleep(profile.ttfb)
+        stall_at = len(events) // 2 if scenario == "stall" else -1
+        try:
+            for index, event in enumerate(events):
+                if index == stall_at:
+                    await asyncio.sleep(profile.stall_seconds)
+                elif index and profile.interval > 0:
+                    await asyncio.sleep(profile.interval)
+                await response.write(event)
+            await response.write_eof()
+        except (ConnectionResetError, asyncio.CancelledError):
+            pass
+        return response
+
+    async def quota(request: web.Request) -> web.Response:
+        return web.json_response({"available": 1000, "used": 0, "total": 1000})
+
+    app = web.Application()
+    app.router.add_post("/api/v2/chat/conversation", conversation)
+    app.router.add_get("/api/quota/retrieve", quota)
+    return app
+
+
+def _serve(profile: UpstreamProfile, port_queue: "multiprocessing.Queue") -> None:
+    async def main():
+        runner = web.AppRunner(create_app(profile), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port_queue.put(site._server.sockets[0].getsockname()[1])
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+class FakeUpstream:
+    """在子进程中运行模拟上游，避免服务端的CPU开销计入被测客户端"""
+
+    def __init__(self, profile: UpstreamProfile):
+        self.profile = profile
+        self._process: Optional[multiprocessing.Process] = None
+        self.port = 0
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self) -> None:
+        port_queue = multiprocessing.Queue()
+        self._process = multiprocessing.Process(target=_serve, args=(self.profile, port_queue), daemon=True)
+        self._process.start()
+        self.port = port_queue.get(timeout=30)
+
+    def close(self) -> None:
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join(timeout=5)
+            self._process = None
+
+    def __enter__(self) -> "FakeUpstream":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
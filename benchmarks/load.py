@@ -0,0 +1,366 @@
+"""ChargptChat 端到端压测
+
+直接调用插件的 handle_text / handle_at / handle_command，模拟大量群聊同时使用机器人，
+用于上线前评估容量。需要在 XXXBot 环境中运行（插件依赖 WechatAPI 和 utils 模块）:
+
+    cd XXXBot
+    python plugins/ChargptChat/benchmarks/load.py --rooms 500 --rate 50 --duration 60
+
+- 插件使用 config.toml 中的实际配置，只把上游地址指向本地模拟上游（见 fake_upstream.py）
+- 微信客户端由 FakeWechatClient 代替，记录每次发送、撤回和编辑消息的时间
+- 会话历史写入临时数据库，不保存图片，不影响正式数据
+
+输出用户可见延迟（从收到消息到机器人发出第一条回复）的 p50/p95/p99、被拒绝的消息数和事件循环延迟。
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from fake_upstream import FakeUpstream, UpstreamProfile
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 插件发出的非最终回复：思考提示、排队提示和图片进度
+ACK_PREFIXES = ("思考中...", "我正在思考上一个问题", "相同的问题正在处理中", "图片生成中...")
+
+# 插件在本地拒绝请求时的回复
+REJECT_MARKERS = ("排队的问题过多", "当前请求较多")
+
+COMMANDS = ("help", "stats", "model")
+
+
+def percentiles(values: List[float]) -> Dict:
+    """计算 p50/p95/p99/max（毫秒）"""
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+
+    def pick(q: float) -> float:
+        return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 1)
+
+    return {"count": len(values), "p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99),
+            "max": round(values[-1] * 1000, 1)}
+
+
+class FakeWechatClient:
+    """代替 WechatAPIClient，记录插件的每次发送并模拟发送耗时"""
+
+    def __init__(self, send_delay: float = 0.05):
+        """初始化客户端
+
+        Args:
+            send_delay: 每次调用微信接口的耗时（秒）
+        """
+        self.send_delay = send_delay
+        # (时间, 方法, 目标, 文本, @的用户)
+        self.calls: List[Tuple[float, str, str, str, List[str]]] = []
+        self.listener = None
+        self._next_id = 0
+
+    async def _call(self, method: str, target: str, text: str = "", at: Optional[List[str]] = None):
+        if self.send_delay > 0:
+            await asyncio.sleep(self.send_delay)
+        now = time.perf_counter()
+        self.calls.append((now, method, target, text, at or []))
+        if self.listener is not None:
+            self.listener(now, method, target, text, at or [])
+        self._next_id += 1
+        return self._next_id, int(time.time()), self._next_id
+
+    async def send_at_message(self, wxid: str, content: str, at: List[str]):
+        return await self._call("send_at_message", wxid, content, at)
+
+    async def send_text_message(self, wxid: str, content: str, at=""):
+        return await self._call("send_text_message", wxid, content)
+
+    async def revoke_message(self, *args):
+        return await self._call("revoke_message", str(args[0]) if len(args) > 1 else "")
+
+    async def edit_message(self, wxid: str, message_id, content: str):
+        return await self._call("edit_message", wxid, content)
+
+    def counts(self) -> Dict[str, int]:
+        result: Dict[str, int] = defaultdict(int)
+        for _, method, _, _, _ in self.calls:
+            result[method] += 1
+        return dict(result)
+
+
+class Workload:
+    """压测的消息组成"""
+
+    def __init__(self, rooms: int = 100, users: int = 20, rate: float = 20.0, duration: float = 30.0,
+                 trigger_ratio: float = 0.3, at_ratio: float = 0.2, image_ratio: float = 0.05,
+                 command_ratio: float = 0.02, duplicate_ratio: float = 0.1, seed: int = 1):
+        """初始化消息组成
+
+        Args:
+            rooms: 群聊数
+            users: 每个群的用户数
+            rate: 所有群合计每秒的消息数（泊松到达）
+            duration: 发送消息的时间（秒）
+            trigger_ratio: 发给机器人的消息比例，其余为不含触发词的普通聊天
+            at_ratio: 发给机器人的消息中通过@发送的比例
+            image_ratio: 发给机器人的消息中图片生成请求的比例
+            command_ratio: 发给机器人的消息中插件命令的比例
+            duplicate_ratio: 与本群上一个问题相同的比例
+            seed: 随机数种子，相同参数下生成相同的消息序列
+        """
+        self.rooms = rooms
+        self.users = users
+        self.rate = rate
+        self.duration = duration
+        self.trigger_ratio = trigger_ratio
+        self.at_ratio = at_ratio
+        self.image_ratio = image_ratio
+        self.command_ratio = command_ratio
+        self.duplicate_ratio = duplicate_ratio
+        self.seed = seed
+
+    def to_dict(self) -> Dict:
+        return dict(self.__dict__)
+
+
+class LoadRun:
+    """一次压测：生成消息、调用插件处理函数并统计延迟"""
+
+    def __init__(self, plugin, bot: FakeWechatClient, workload: Workload):
+        self.plugin = plugin
+        self.bot = bot
+        self.workload = workload
+        self.random = random.Random(workload.seed)
+
+        # (目标, 用户) -> 等待回复的 (开始时间, 类型)
+        self.pending: Dict[Tuple[str, str], Deque[Tuple[float, str]]] = defaultdict(deque)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.handler_times: List[float] = []
+        self.loop_lags: List[float] = []
+        self.sent: Dict[str, int] = defaultdict(int)
+        self.rejected = 0
+        self.unmatched = 0
+        self._last_question: Dict[str, str] = {}
+        self._tasks: set = set()
+        bot.listener = self._on_send
+
+    def _on_send(self, now: float, method: str, target: str, text: str, at: List[str]) -> None:
+        """机器人发出@消息时，第一条不是提示的回复即为用户看到回复的时间"""
+        if method != "send_at_message" or text.startswith(ACK_PREFIXES):
+            return
+        rejected = any(marker in text for marker in REJECT_MARKERS) or text == self.plugin.quota_reject_message
+        for user in at:
+            queue = self.pending.get((target, user))
+            if not queue:
+                self.unmatched += 1
+                continue
+            started, kind = queue.popleft()
+            if rejected:
+                self.rejected += 1
+                self.latencies["rejected"].append(now - started)
+            else:
+                self.latencies[kind].append(now - started)
+
+    def _message(self, number: int) -> Tuple[str, dict]:
+        """生成一条消息
+
+        Returns:
+            Tuple[str, dict]: (类型, 消息)，类型为 chatter/chat/image/command 之一
+        """
+        workload = self.workload
+        rng = self.random
+        room = f"bench-room-{rng.randrange(workload.rooms)}@chatroom"
+        user = f"bench-user-{rng.randrange(workload.users)}"
+        message = {"MsgId": number, "FromWxid": room, "SenderWxid": user, "room_id": room, "sender_id": user}
+
+        trigger = self.plugin.trigger_keyword
+        if rng.random() >= workload.trigger_ratio:
+            message["content"] = f"普通聊天消息 {number}"
+            return "chatter", message
+
+        roll = rng.random()
+        if roll < workload.command_ratio:
+            message["content"] = f"{trigger}_{rng.choice(COMMANDS)}"
+            return "command", message
+        if roll < workload.command_ratio + workload.image_ratio:
+            kind, question = "image", f"{self.plugin.image_command}一只猫 {number}"
+        elif room in self._last_question and rng.random() < workload.duplicate_ratio:
+            kind, question = "chat", self._last_question[room]
+        else:
+            kind, question = "chat", f"问题 {number}：今天适合做什么？"
+            self._last_question[room] = question
+
+        # 未开启 respond_to_at 时插件不处理@消息，全部使用触发词发送
+        if self.plugin.respond_to_at and rng.random() < workload.at_ratio:
+            message["content"] = question
+            message["at"] = True
+        else:
+            message["content"] = f"{trigger} {question}"
+        return kind, message
+
+    async def _dispatch(self, kind: str, message: dict) -> None:
+        plugin = self.plugin
+        started = time.perf_counter()
+        if kind != "chatter":
+            self.pending[(message["room_id"], message["sender_id"])].append((started, kind))
+        try:
+            if kind == "command":
+                await plugin.handle_command(self.bot, plugin.router.parse_text(message))
+            elif message.get("at"):
+                await plugin.handle_at(self.bot, message)
+            else:
+                await plugin.handle_text(self.bot, message)
+        except Exception as e:
+            logger.error(f"处理消息异常: {str(e)}")
+        self.handler_times.append(time.perf_counter() - started)
+
+    async def _monitor_loop(self, interval: float = 0.05) -> None:
+        """事件循环延迟：定时器实际唤醒时间比预期晚多少"""
+        while True:
+            expected = time.perf_counter() + interval
+            await asyncio.sleep(interval)
+            self.loop_lags.append(max(0.0, time.perf_counter() - expected))
+
+    def _waiting(self) -> int:
+        return sum(len(queue) for queue in self.pending.values())
+
+    async def run(self, drain_timeout: float) -> Dict:
+        monitor = asyncio.create_task(self._monitor_loop())
+        workload = self.workload
+        started = time.perf_counter()
+        number = 0
+        next_at = started
+        while True:
+            next_at += self.random.expovariate(workload.rate)
+            if next_at - started >= workload.duration:
+                break
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            number += 1
+            kind, message = self._message(number)
+            self.sent[kind] += 1
+            task = asyncio.create_task(self._dispatch(kind, message))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        # 等待处理中的请求完成
+        drain_started = time.perf_counter()
+        while (self._tasks or self._waiting()) and time.perf_counter() - drain_started < drain_timeout:
+            await asyncio.sleep(0.1)
+        elapsed = time.perf_counter() - started
+        monitor.cancel()
+        await asyncio.gather(monitor, return_exceptions=True)
+
+        return {
+            "elapsed": round(elapsed, 2),
+            "messages": dict(self.sent),
+            "rejected": self.rejected,
+            "unanswered": self._waiting(),
+            "unmatched_replies": self.unmatched,
+            "latency_ms": {kind: percentiles(values) for kind, values in self.latencies.items()},
+            "handler_ms": percentiles(self.handler_times),
+            "loop_lag_ms": percentiles(self.loop_lags),
+            "bot_calls": self.bot.counts(),
+            "upstream_requests": self.plugin.api_client.get_pool_stats()["requests_total"]
+        }
+
+
+def load_plugin(bot_root: str):
+    """按 XXXBot 的方式导入插件（plugins.<插件目录>.main）"""
+    sys.path.insert(0, bot_root)
+    package = f"{os.path.basename(os.path.dirname(PLUGIN_DIR))}.{os.path.basename(PLUGIN_DIR)}"
+    return importlib.import_module(f"{package}.main").ChargptChat
+
+
+async def main_async(args, workload: Workload, profile: UpstreamProfile) -> Dict:
+    plugin = load_plugin(args.bot_root)()
+    if not hasattr(plugin, "api_client"):
+        raise SystemExit("插件配置加载失败，请检查 config.toml")
+
+    with FakeUpstream(profile) as upstream, tempfile.TemporaryDirectory() as tmpdir:
+        # 只替换上游地址和会写入正式数据的部分，其余使用实际配置
+        plugin.enable = True
+        plugin.save_images = False
+        plugin.api_client.base_url = upstream.base_url
+        if args.model:
+            plugin.api_client.default_model = args.model
+        backend = plugin.api_client.conversations.backend
+        if backend is not None:
+            backend.path = os.path.join(tmpdir, "conversations.db")
+        plugin.image_saver.jobs_file = os.path.join(tmpdir, "save_jobs.json")
+
+        await plugin.async_init()
+        try:
+            bot = FakeWechatClient(send_delay=args.send_delay)
+            result = await LoadRun(plugin, bot, workload).run(args.drain_timeout)
+        finally:
+            await plugin.on_disable()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ChargptChat 端到端压测")
+    parser.add_argument("--rooms", type=int, default=100, help="群聊数")
+    parser.add_argument("--users", type=int, default=20, help="每个群的用户数")
+    parser.add_argument("--rate", type=float, default=20.0, help="合计每秒消息数")
+    parser.add_argument("--duration", type=float, default=30.0, help="发送消息的时间（秒）")
+    parser.add_argument("--trigger-ratio", type=float, default=0.3, help="发给机器人的消息比例")
+    parser.add_argument("--at-ratio", type=float, default=0.2, help="通过@发送的比例")
+    parser.add_argument("--image-ratio", type=float, default=0.05, help="图片生成请求的比例")
+    parser.add_argument("--command-ratio", type=float, default=0.02, help="插件命令的比例")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.1, help="重复本群上一个问题的比例")
+    parser.add_argument("--seed", type=int, default=1, help="随机数种子")
+    parser.add_argument("--model", default="", help="覆盖默认模型，如 bench/stall 可模拟上游卡住")
+    parser.add_argument("--ttfb", type=float, default=1.0, help="模拟上游的首字节等待（秒）")
+    parser.add_argument("--interval", type=float, default=0.02, help="模拟上游的数据块间隔（秒）")
+    parser.add_argument("--chunks", type=int, default=50, help="每个回复的数据块数")
+    parser.add_argument("--send-delay", type=float, default=0.05, help="每次调用微信接口的耗时（秒）")
+    parser.add_argument("--drain-timeout", type=float, default=120.0, help="停止发送后等待回复的最长时间（秒）")
+    parser.add_argument("--bot-root", default=os.path.dirname(os.path.dirname(PLUGIN_DIR)), help="XXXBot 根目录")
+    parser.add_argument("--output", help="把结果写入JSON文件")
+    parser.add_argument("--log-level", default="WARNING", help="日志级别")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    workload = Workload(
+        rooms=args.rooms, users=args.users, rate=args.rate, duration=args.duration,
+        trigger_ratio=args.trigger_ratio, at_ratio=args.at_ratio, image_ratio=args.image_ratio,
+        command_ratio=args.command_ratio, duplicate_ratio=args.duplicate_ratio, seed=args.seed
+    )
+    profile = UpstreamProfile(chunks=args.chunks, ttfb=args.ttfb, interval=args.interval)
+    result = asyncio.run(main_async(args, workload, profile))
+    result["workload"] = workload.to_dict()
+    result["upstream"] = profile.to_dict()
+
+    print(f"消息: {result['messages']}  耗时 {result['elapsed']}秒")
+    for kind, stats in result["latency_ms"].items():
+        if stats["count"]:
+            print(f"  {kind:8s} n={stats['count']:<6d} p50 {stats['p50']:8.1f}ms  p95 {stats['p95']:8.1f}ms  "
+                  f"p99 {stats['p99']:8.1f}ms  max {stats['max']:8.1f}ms")
+    print(f"被拒绝: {result['rejected']}  未回复: {result['unanswered']}")
+    handler, lag = result["handler_ms"], result["loop_lag_ms"]
+    if handler["count"]:
+        print(f"处理函数耗时 p99 {handler['p99']}ms  max {handler['max']}ms")
+    if lag["count"]:
+        print(f"事件循环延迟 p50 {lag['p50']}ms  p99 {lag['p99']}ms  max {lag['max']}ms")
+    print(f"微信接口调用: {result['bot_calls']}  上游请求: {result['upstream_requests']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
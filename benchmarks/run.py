@@ -0,0 +1,230 @@
+"""ChargptAPIClient 基准测试
+
+用法（在插件目录下运行）:
+    python benchmarks/run.py                          # 运行全部基准，结果写入 benchmarks/results/<提交>.json
+    python benchmarks/run.py --sessions 50 --requests 4
+    python benchmarks/run.py --compare benchmarks/results/<旧提交>.json
+
+测量项:
+- parse: 不经过网络，SSE解码加事件解析的CPU时间（微秒/数据块）
+- stream: 通过本地模拟上游（子进程）在N个并发会话下的首字节额外延迟、吞吐量和客户端峰值内存
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Dict, List
+
+from loguru import logger
+
+from fake_upstream import SCENARIOS, FakeUpstream, UpstreamProfile, build_events
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(PLUGIN_DIR, "benchmarks", "results")
+
+
+def load_plugin(module: str):
+    """以插件包的方式导入插件模块（插件模块之间使用相对导入）"""
+    sys.path.insert(0, os.path.dirname(PLUGIN_DIR))
+    try:
+        return importlib.import_module(f"{os.path.basename(PLUGIN_DIR)}.{module}")
+    finally:
+        sys.path.pop(0)
+
+
+api_client = load_plugin("api_client")
+sse_decoder = load_plugin("sse_decoder")
+stream_timeouts = load_plugin("stream_timeouts")
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PLUGIN_DIR, stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def new_client(base_url: str, sessions: int):
+    pool_size = max(10, sessions)
+    return api_client.ChargptAPIClient(
+        api_token="bench-token",
+        base_url=base_url,
+        client_version="bench",
+        language="zh-CN",
+        pool_limit=pool_size,
+        pool_limit_per_host=pool_size,
+        max_sessions=max(1000, sessions * 2),
+        timeout_policy=stream_timeouts.TimeoutPolicy({
+            "chat": stream_timeouts.PhaseTimeouts(first_byte=10, idle=0.5, total=120)
+        })
+    )
+
+
+def bench_parse(scenario: str, profile: UpstreamProfile, read_size: int, rounds: int) -> Dict:
+    """测量解码和解析一个完整回复的CPU时间"""
+    stream = b"".join(build_events(scenario, profile))
+    pieces = [stream[i:i + read_size] for i in range(0, len(stream), read_size)]
+    client = new_client("http://127.0.0.1", 1)
+    parse_event = client._parse_event
+
+    events = 0
+    started = time.process_time()
+    for _ in range(rounds):
+        decoder = sse_decoder.SSEDecoder()
+        for piece in pieces:
+            for event in decoder.feed(piece):
+                parse_event(event)
+                events += 1
+        for event in decoder.flush():
+            parse_event(event)
+            events += 1
+    elapsed = time.process_time() - started
+    return {
+        "events": events // rounds,
+        "bytes": len(stream),
+        "us_per_event": elapsed / events * 1e6,
+        "mb_per_second": len(stream) * rounds / elapsed / 1e6
+    }
+
+
+async def run_sessions(base_url: str, scenario: str, sessions: int, requests: int) -> Dict:
+    """N个会话并发，每个会话依次发送 requests 个请求"""
+    client = new_client(base_url, sessions)
+    await client.start()
+    ttfbs: List[float] = []
+    chars = 0
+    chunks = 0
+    errors = 0
+
+    async def session(number: int):
+        nonlocal chars, chunks, errors
+        for index in range(requests):
+            started = time.perf_counter()
+            first = None
+            text_length = 0
+            async for chunk in client.chat(f"bench-{number}-{index}", "你好", f"bench/{scenario}"):
+                if first is None:
+                    first = time.perf_counter() - started
+                text_length += len(chunk)
+                chunks += 1
+            if first is not None:
+                ttfbs.append(first)
+            if scenario == "error" or text_length == 0:
+                errors += 1
+            chars += text_length
+
+    started = time.perf_counter()
+    await asyncio.gather(*(session(number) for number in range(sessions)))
+    elapsed = time.perf_counter() - started
+    await client.close()
+
+    ttfbs.sort()
+    return {
+        "elapsed": elapsed,
+        "requests_per_second": sessions * requests / elapsed,
+        "chunks_per_second": chunks / elapsed,
+        "chars_per_second": chars / elapsed,
+        "ttfb_p50": percentile(ttfbs, 0.5),
+        "ttfb_p95": percentile(ttfbs, 0.95),
+        "errors": errors
+    }
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def bench_stream(upstream: FakeUpstream, scenario: str, sessions: int, requests: int) -> Dict:
+    """先测吞吐量和首字节延迟，再单独用 tracemalloc 测峰值内存（tracemalloc 会拖慢运行）"""
+    result = asyncio.run(run_sessions(upstream.base_url, scenario, sessions, requests))
+    # 首字节额外延迟 = 客户端观察到的首字节延迟 - 模拟上游故意等待的时间
+    result["ttfb_overhead_ms"] = (result["ttfb_p50"] - upstream.profile.ttfb) * 1000
+
+    tracemalloc.start()
+    asyncio.run(run_sessions(upstream.base_url, scenario, sessions, 1))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result["peak_memory_mb"] = peak / 1024 / 1024
+    return result
+
+
+def compare(current: Dict, baseline: Dict) -> None:
+    """打印与基准结果的差异（百分比）"""
+    print(f"\n对比 {baseline.get('revision')} -> {current.get('revision')}:")
+    for section in ("parse", "stream"):
+        for scenario, metrics in current.get(section, {}).items():
+            old_metrics = baseline.get(section, {}).get(scenario, {})
+            for name, value in metrics.items():
+                old = old_metrics.get(name)
+                if not isinstance(value, (int, float)) or not old:
+                    continue
+                change = (value - old) / old * 100
+                print(f"  {section}.{scenario}.{name}: {old:.4g} -> {value:.4g} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ChargptAPIClient 基准测试")
+    parser.add_argument("--sessions", type=int, default=20, help="并发会话数")
+    parser.add_argument("--requests", type=int, default=5, help="每个会话依次发送的请求数")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="逗号分隔的场景")
+    parser.add_argument("--chunks", type=int, default=100, help="每个回复的数据块数")
+    parser.add_argument("--chunk-chars", type=int, default=16, help="每个数据块的字符数")
+    parser.add_argument("--ttfb", type=float, default=0.0, help="模拟上游的首字节等待（秒）")
+    parser.add_argument("--interval", type=float, default=0.0, help="模拟上游的数据块间隔（秒）")
+    parser.add_argument("--read-size", type=int, default=4096, help="parse基准每次喂给解码器的字节数")
+    parser.add_argument("--rounds", type=int, default=50, help="parse基准的重复次数")
+    parser.add_argument("--output", help="结果文件，默认 benchmarks/results/<提交>.json")
+    parser.add_argument("--compare", help="与之前的结果文件对比")
+    parser.add_argument("--log-level", default="CRITICAL", help="插件日志级别，DEBUG日志会明显拖慢测量结果")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    profile = UpstreamProfile(chunks=args.chunks, chunk_chars=args.chunk_chars, ttfb=args.ttfb,
+                              interval=args.interval, stall_seconds=2.0)
+    results = {
+        "revision": git_revision(),
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "params": {"sessions": args.sessions, "requests": args.requests, **profile.to_dict()},
+        "parse": {},
+        "stream": {}
+    }
+
+    for scenario in scenarios:
+        rounds = max(1, args.rounds // 20) if scenario == "huge" else args.rounds
+        results["parse"][scenario] = parse_result = bench_parse(scenario, profile, args.read_size, rounds)
+        print(f"parse  {scenario:8s} {parse_result['us_per_event']:8.2f} us/块  {parse_result['mb_per_second']:8.1f} MB/s")
+
+    with FakeUpstream(profile) as upstream:
+        for scenario in scenarios:
+            results["stream"][scenario] = stream_result = bench_stream(upstream, scenario, args.sessions, args.requests)
+            print(f"stream {scenario:8s} {stream_result['requests_per_second']:8.1f} 请求/s  "
+                  f"{stream_result['chunks_per_second']:9.0f} 块/s  "
+                  f"首字节额外延迟 p50 {stream_result['ttfb_overhead_ms']:6.2f}ms  "
+                  f"峰值内存 {stream_result['peak_memory_mb']:6.2f}MB  错误 {stream_result['errors']}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{results['revision']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已写入: {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+
+class CircuitOpenError(Exception):
+    """上游熔断中，请求被快速拒绝"""
+
+    def __init__(self, name: str, retry_after: float):
+        self.name = name
+        self.retry_after = retry_after
+        if retry_after >= 1:
+            super().__init__(f"AI服务暂时不可用，请约{int(retry_after) + 1}秒后再试")
+        else:
+            super().__init__("AI服务暂时不可用，请稍后再试")
+
+
+class CircuitBreaker:
+    """单个上游端点或模型的熔断器
+
+    - 关闭(closed)：正常放行，在时间窗口内统计失败（错误、超时和慢请求）
+    - 打开(open)：窗口内请求数达到下限且失败率超过阈值时打开，之后的请求直接失败
+    - 半开(half_open)：打开一段时间后放行少量试探请求，成功则关闭，失败则重新打开
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    # 延迟指数加权平均的平滑系数
+    EWMA_ALPHA = 0.2
+
+    def __init__(self, name: str, window: float = 60, min_requests: int = 5, failure_rate: float = 0.5,
+                 open_seconds: float = 30, slow_call_seconds: float = 30, half_open_probes: int = 1):
+        """初始化熔断器
+
+        Args:
+            name: 名称，如 endpoint:chat 或 model:openai/gpt-4o
+            window: 统计失败率的时间窗口（秒）
+            min_requests: 窗口内至少有多少个请求才会判断是否熔断
+            failure_rate: 打开熔断的失败率阈值（0-1）
+            open_seconds: 打开后多久进入半开状态（秒）
+            slow_call_seconds: 首字节延迟超过该值的请求也算作失败，小于等于0表示不统计慢请求
+            half_open_probes: 半开状态下同时放行的试探请求数
+        """
+        self.name = name
+        self.window = window
+        self.min_requests = max(1, min_requests)
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.slow_call_seconds = slow_call_seconds
+        self.half_open_probes = max(1, half_open_probes)
+
+        self.state = self.CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        # 时间窗口内的请求结果: (时间, 是否失败)
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._failures = 0
+
+        # 统计信息
+        self.latency = 0.0
+        self.total = 0
+        self.total_failures = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.opened = 0
+
+    def allow(self) -> bool:
+        """判断是否放行一个请求，半开状态下放行的请求会占用一个试探名额"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.open_seconds:
+                self.rejected += 1
+                return False
+            self.state = self.HALF_OPEN
+            self._probes = 0
+            logger.info(f"熔断器 {self.name} 进入半开状态，开始试探")
+        if self.state == self.HALF_OPEN:
+            if self._probes >= self.half_open_probes:
+                self.rejected += 1
+                return False
+            self._probes += 1
+        return True
+
+    def release(self) -> None:
+        """归还未产生结果的请求占用的试探名额"""
+        if self.state == self.HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def retry_after(self) -> float:
+        """距离进入半开状态还有多少秒"""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+
+    def idle(self, now: float) -> bool:
+        """时间窗口内没有请求，且未处于熔断或试探中（熔断时间已过的视为空闲）"""
+        if self.state == self.HALF_OPEN or self.retry_after() > 0:
+            return False
+        self._prune(now)
+        return not self._outcomes
+
+    def record(self, failed: bool, latency: Optional[float] = None, timeout: bool = False) -> None:
+        """记录一个请求的结果
+
+        Args:
+            failed: 请求是否失败
+            latency: 首字节延迟（秒），未收到响应时为None
+            timeout: 是否因超时失败
+        """
+        now = time.monotonic()
+        if latency is not None:
+            self.latency += self.EWMA_ALPHA * (latency - self.latency)
+            if self.slow_call_seconds > 0 and latency > self.slow_call_seconds:
+                failed = True
+        self.total += 1
+        if failed:
+            self.total_failures += 1
+        if timeout:
+            self.timeouts += 1
+
+        if self.state == self.HALF_OPEN:
+            self._probes = max(0, self._probes - 1)
+            if failed:
+                self._open(now)
+            else:
+                self.state = self.CLOSED
+                self._outcomes.clear()
+                self._failures = 0
+                logger.info(f"熔断器 {self.name} 试探成功，已恢复")
+            return
+        if self.state == self.OPEN:
+            return
+
+        self._outcomes.append((now, failed))
+        self._failures += failed
+        self._prune(now)
+        count = len(self._outcomes)
+        if count >= self.min_requests and self._failures / count >= self.failure_rate:
+            self._open(now)
+
+    def get_stats(self) -> Dict:
+        """获取熔断器状态"""
+        self._prune(time.monotonic())
+        count = len(self._outcomes)
+        return {
+            "state": self.state,
+            "window_requests": count,
+            "window_failure_rate": round(self._failures / count, 3) if count else 0.0,
+            "latency": round(self.latency, 2),
+            "total": self.total,
+            "failures": self.total_failures,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+            "opened": self.opened,
+            "retry_after": round(self.retry_after(), 1)
+        }
+
+    def _open(self, now: float) -> None:
+        self.state = self.OPEN
+        self._opened_at = now
+        self._probes = 0
+        self._outcomes.clear()
+        self._failures = 0
+        self.opened += 1
+        logger.warning(f"熔断器 {self.name} 已打开，{self.open_seconds}秒内的请求将直接失败")
+
+    def _prune(self, now: float) -> None:
+        deadline = now - self.window
+        outcomes = self._outcomes
+        while outcomes and outcomes[0][0] < deadline:
+            _, failed = outcomes.popleft()
+            self._failures -= failed
+
+
+class CircuitTicket:
+    """一次上游请求占用的熔断器，请求结束时记录结果"""
+
+    __slots__ = ("endpoint", "model", "started", "first_byte", "_done")
+
+    def __init__(self, endpoint: CircuitBreaker, model: Optional[CircuitBreaker]):
+        self.endpoint = endpoint
+        self.model = model
+        self.started = time.monotonic()
+        self.first_byte: Optional[float] = None
+        self._done = False
+
+    def mark_first_byte(self) -> None:
+        """收到上游响应时调用，用于统计首字节延迟"""
+        if self.first_byte is None:
+            self.first_byte = time.monotonic() - self.started
+
+    def success(self) -> None:
+        """请求成功"""
+        self._finish(False, False)
+
+    def failure(self, timeout: bool = False) -> None:
+        """上游不可用：连接失败、超时或服务端错误，端点和模型都记为失败"""
+        self._finish(True, True, timeout)
+
+    def model_failure(self) -> None:
+        """上游可用但模型返回了错误，只记录模型失败"""
+        self._finish(False, True)
+
+    def release(self) -> None:
+        """请求未产生结果（如被取消）时归还占用"""
+        if self._done:
+            return
+        self._done = True
+        self.endpoint.release()
+        if self.model is not None:
+            self.model.release()
+
+    def _finish(self, endpoint_failed: bool, model_failed: bool, timeout: bool = False) -> None:
+        if self._done:
+            return
+        self._done = True
+        self.endpoint.record(endpoint_failed, self.first_byte, timeout)
+        if self.model is not None:
+            self.model.record(model_failed, self.first_byte, timeout)
+
+
+class CircuitBreakerRegistry:
+    """按端点和模型管理熔断器
+
+    模型名可能来自用户输入，模型熔断器按最近使用顺序保存，超过 max_models 个时
+    淘汰最久未使用且空闲（窗口内没有请求、未处于熔断中）的熔断器。
+    """
+
+    def __init__(self, enabled: bool = True, max_models: int = 64, **options):
+        """初始化熔断器集合
+
+        Args:
+            enabled: 是否启用熔断，关闭时只统计不拒绝
+            max_models: 最多保留多少个模型熔断器
+            options: 传给每个 CircuitBreaker 的参数
+        """
+        self.enabled = enabled
+        self.max_models = max(1, max_models)
+        self.options = options
+        self._breakers: "OrderedDict[str, CircuitBreaker]" = OrderedDict()
+        self._models = 0
+
+    def get(self, name: str) -> CircuitBreaker:
+        """获取（不存在时创建）指定名称的熔断器"""
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, **self.options)
+            self._breakers[name] = breaker
+            if name.startswith("model:"):
+                self._models += 1
+                if self._models > self.max_models:
+                    self._evict_idle(keep=name)
+        else:
+            self._breakers.move_to_end(name)
+        return breaker
+
+    def acquire(self, endpoint: str, model: Optional[str] = None) -> CircuitTicket:
+        """为一次上游请求检查端点和模型的熔断器
+
+        Args:
+            endpoint: 端点名称，如 chat/image/quota
+            model: 使用的模型，为空则只检查端点
+
+        Returns:
+            CircuitTicket: 请求结束时用于记录结果
+
+        Raises:
+            CircuitOpenError: 端点或模型处于熔断状态
+        """
+        endpoint_breaker = self.get(f"endpoint:{endpoint}")
+        model_breaker = self.get(f"model:{model}") if model else None
+        if self.enabled:
+            if not endpoint_breaker.allow():
+                raise CircuitOpenError(endpoint_breaker.name, endpoint_breaker.retry_after())
+            if model_breaker is not None and not model_breaker.allow():
+                endpoint_breaker.release()
+                raise CircuitOpenError(model_breaker.name, model_breaker.retry_after())
+        return CircuitTicket(endpoint_breaker, model_breaker)
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """获取所有熔断器的状态"""
+        return {name: breaker.get_stats() for name, breaker in self._breakers.items()}
+
+    def _evict_idle(self, keep: str) -> None:
+        """从最久未使用的开始淘汰空闲的模型熔断器，直到数量回到上限以内"""
+        now = time.monotonic()
+        for name in list(self._breakers):
+            if self._models <= self.max_models:
+                return
+            if name == keep or not name.startswith("model:"):
+                continue
+            if not self._breakers[name].idle(now):
+                continue
+            del self._breakers[name]
+            self._models -= 1
+
+    def open_breakers(self) -> List[str]:
+        """当前处于打开或半开状态的熔断器名称"""
+        return [name for name, breaker in self._breakers.items() if breaker.state != CircuitBreaker.CLOSED]
@@ -0,0 +1,106 @@
+import asyncio
+import os
+import time
+import tomllib
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from loguru import logger
+
+
+class ConfigWatcher:
+    """轮询配置文件的修改时间，文件变化时重新加载
+
+    只调用 os.stat 比较修改时间和大小，不依赖额外的文件监听库；
+    读取和解析TOML在后台线程中进行，不阻塞事件循环。
+    解析失败或 on_change 抛出异常时记录错误并保留旧配置，文件再次变化时重试。
+    """
+
+    def __init__(self, path: str, on_change: Callable[[Dict[str, Any]], Awaitable[None]], interval: float = 5.0):
+        """初始化配置监视器
+
+        Args:
+            path: 配置文件路径
+            on_change: 文件变化且解析成功时调用，参数为新的配置；抛出异常表示新配置无效
+            interval: 检查间隔（秒）
+        """
+        self.path = path
+        self.on_change = on_change
+        self.interval = max(0.1, interval)
+        self._signature: Optional[Tuple[int, int]] = None
+        self._task: Optional[asyncio.Task] = None
+
+        # 统计信息
+        self.reloads = 0
+        self.failures = 0
+        self.last_reload: Optional[float] = None
+        self.last_error = ""
+
+    async def start(self) -> None:
+        """记录当前的文件状态并启动后台检查任务"""
+        if self._task is not None:
+            return
+        self._signature = self._stat()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """停止后台检查任务"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def check(self) -> bool:
+        """检查一次文件是否变化，变化时重新加载
+
+        Returns:
+            bool: 是否加载了新配置
+        """
+        signature = self._stat()
+        if signature is None or signature == self._signature:
+            return False
+        self._signature = signature
+        try:
+            config = await asyncio.to_thread(self._load)
+            await self.on_change(config)
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            logger.error(f"重新加载配置文件失败，继续使用旧配置: {str(e)}")
+            return False
+        self.reloads += 1
+        self.last_reload = time.time()
+        self.last_error = ""
+        return True
+
+    def get_stats(self) -> Dict:
+        """获取配置热加载统计信息"""
+        return {
+            "reloads": self.reloads,
+            "failures": self.failures,
+            "last_reload": self.last_reload,
+            "last_error": self.last_error
+        }
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error(f"检查配置文件异常: {str(e)}")
+
+    def _stat(self) -> Optional[Tuple[int, int]]:
+        """文件的修改时间和大小，文件不存在（如编辑器替换文件的瞬间）时返回None"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load(self) -> Dict[str, Any]:
+        with open(self.path, "rb") as f:
+            return tomllib.load(f)
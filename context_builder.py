@@ -0,0 +1,142 @@
+import re
+from typing import Dict, List, Optional
+
+# 估算时每条消息额外计入的token数（角色标签和换行）
+MESSAGE_OVERHEAD = 4
+
+ROLE_LABELS = {"user": "用户", "assistant": "AI"}
+
+SUMMARY_HEADER = "以下是更早的对话摘要："
+RECENT_HEADER = "以下是最近的对话："
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    """不依赖分词器估算文本的token数
+
+    非ASCII字符（中文等）按每字1个token，ASCII字符按每4个字符1个token，
+    对常见模型的分词结果略微高估，用于控制请求大小足够。
+    """
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return len(text) - ascii_chars + (ascii_chars + 3) // 4
+
+
+class ContextBuilder:
+    """按token预算把会话历史组装进提示词
+
+    - 从最新的一轮开始向前装入完整的历史消息，直到用完该模型的token预算
+    - 装不下的更早消息压缩为滚动摘要：每条消息只保留开头一小段，摘要超出上限时丢弃最旧的内容
+    - 会话存储因轮数上限丢弃的消息也会并入该会话的摘要（见 SessionStore 的 summarizer）
+
+    因此无论会话多长，发给上游的提示词都不超过预算，请求大小和上游延迟保持稳定。
+    """
+
+    def __init__(self, max_tokens: int = 3000, model_tokens: Optional[Dict[str, int]] = None,
+                 summary_tokens: int = 300, summary_line_chars: int = 80):
+        """初始化上下文组装器
+
+        Args:
+            max_tokens: 默认的提示词token预算（包含历史、摘要和当前消息）
+            model_tokens: 按模型覆盖的token预算
+            summary_tokens: 摘要最多占用的token数
+            summary_line_chars: 摘要中每条消息保留的最大字符数
+        """
+        self.max_tokens = max_tokens
+        self.model_tokens = dict(model_tokens or {})
+        self.summary_tokens = summary_tokens
+        self.summary_line_chars = summary_line_chars
+
+        # 统计信息
+        self.builds = 0
+        self.compacted = 0
+        self.prompt_tokens = 0
+
+    def budget_for(self, model: str) -> int:
+        """获取模型的token预算"""
+        return self.model_tokens.get(model, self.max_tokens)
+
+    def summarize(self, summary: str, role: str, content: str) -> str:
+        """把一条消息并入滚动摘要
+
+        Args:
+            summary: 当前摘要
+            role: 消息角色
+            content: 消息内容
+
+        Returns:
+            str: 新的摘要
+        """
+        text = _WHITESPACE.sub(" ", content).strip()
+        if len(text) > self.summary_line_chars:
+            text = text[:self.summary_line_chars] + "…"
+        line = f"{ROLE_LABELS.get(role, role)}: {text}"
+        lines = summary.split("\n") if summary else []
+        lines.append(line)
+        # 从最旧的一条开始丢弃，直到摘要不超过上限（至少保留最新的一条）
+        tokens = sum(estimate_tokens(item) + 1 for item in lines)
+        while len(lines) > 1 and tokens > self.summary_tokens:
+            tokens -= estimate_tokens(lines.pop(0)) + 1
+        return "\n".join(lines)
+
+    def build(self, template: str, message: str, history: List[Dict[str, str]], summary: str, model: str) -> str:
+        """组装发送给上游的提示词
+
+        Args:
+            template: 提示词模板，可包含 {message} 和 {context}；不含 {context} 时上下文放在最前面
+            message: 当前用户消息
+            history: 会话历史消息（按时间顺序，不含当前消息）
+            summary: 会话存储中已丢弃消息的摘要
+            model: 使用的模型
+
+        Returns:
+            str: 提示词
+        """
+        prompt = template.format(message=message, context="")
+        remaining = self.budget_for(model) - estimate_tokens(prompt)
+
+        # 从最新的消息开始装入，给摘要预留空间
+        reserve = self.summary_tokens if summary or history else 0
+        recent: List[str] = []
+        index = len(history)
+        while index > 0:
+            item = history[index - 1]
+            line = f"{ROLE_LABELS.get(item['role'], item['role'])}: {item['content']}"
+            cost = estimate_tokens(line) + MESSAGE_OVERHEAD
+            if cost > remaining - reserve:
+                break
+            remaining -= cost
+            recent.append(line)
+            index -= 1
+        recent.reverse()
+
+        # 装不下的更早消息并入摘要
+        for item in history[:index]:
+            summary = self.summarize(summary, item["role"], item["content"])
+        if index:
+            self.compacted += 1
+
+        parts = []
+        if summary and estimate_tokens(summary) <= remaining:
+            parts.append(f"{SUMMARY_HEADER}\n{summary}")
+        if recent:
+            parts.append(RECENT_HEADER + "\n" + "\n".join(recent))
+        context = "\n\n".join(parts)
+
+        if context:
+            if "{context}" in template:
+                prompt = template.format(message=message, context=context)
+            else:
+                prompt = f"{context}\n\n{prompt}"
+        self.builds += 1
+        self.prompt_tokens += estimate_tokens(prompt)
+        return prompt
+
+    def get_stats(self) -> Dict:
+        """获取上下文组装统计信息"""
+        return {
+            "max_tokens": self.max_tokens,
+            "builds": self.builds,
+            "compacted": self.compacted,
+            "avg_prompt_tokens": self.prompt_tokens / self.builds if self.builds else 0.0
+        }
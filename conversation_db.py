@@ -0,0 +1,245 @@
+import asyncio
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from loguru import logger
+
+
+class SQLiteConversationBackend:
+    """基于SQLite(WAL模式)的会话历史持久化后端
+
+    所有数据库操作都在单独的单线程执行器中完成，不会阻塞事件循环。
+    写入先进入内存队列，按时间间隔或批量大小合并为一个事务提交；
+    读取会先提交队列中的写入，保证读到的数据与写入顺序一致。
+    后台任务定期压缩数据：只保留每个会话最近的消息，并删除过期会话。
+    """
+
+    def __init__(self, path: str, keep_messages: int = 20, retention_days: float = 30,
+                 flush_interval: float = 1.0, batch_size: int = 200, compact_interval: float = 3600):
+        """初始化持久化后端
+
+        Args:
+            path: 数据库文件路径
+            keep_messages: 压缩时每个会话保留的最近消息数
+            retention_days: 会话最后一条消息超过多少天后被删除，小于等于0表示不删除
+            flush_interval: 写入队列的提交间隔（秒）
+            batch_size: 队列达到该长度时立即提交
+            compact_interval: 后台压缩间隔（秒）
+        """
+        self.path = path
+        self.keep_messages = keep_messages
+        self.retention_days = retention_days
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.compact_interval = compact_interval
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        # 待写入的操作: ("append", session_id, role, content, created_at) 或 ("clear", session_id)
+        self._pending: List[Tuple] = []
+        self._flush_event: Optional[asyncio.Event] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._compact_task: Optional[asyncio.Task] = None
+        self._closing = False
+
+        # 统计信息
+        self.writes = 0
+        self.loads = 0
+        self.compactions = 0
+
+    @property
+    def is_open(self) -> bool:
+        return self._conn is not None
+
+    async def open(self) -> None:
+        """打开数据库并启动后台任务"""
+        if self._conn is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chargpt-history")
+        self._conn = await self._run(self._open_sync)
+        self._flush_event = asyncio.Event()
+        self._closing = False
+        self._flush_task = asyncio.create_task(self._flush_loop())
+        self._compact_task = asyncio.create_task(self._compact_loop())
+        logger.info(f"会话历史数据库已打开: {self.path}")
+
+    async def close(self) -> None:
+        """提交剩余写入并关闭数据库"""
+        if self._conn is None:
+            return
+        # 通知写入任务退出，而不是直接取消，避免中断正在提交的事务
+        self._closing = True
+        self._flush_event.set()
+        self._compact_task.cancel()
+        await asyncio.gather(self._flush_task, self._compact_task, return_exceptions=True)
+        self._flush_task = None
+        self._compact_task = None
+        await self.flush()
+        conn = self._conn
+        self._conn = None
+        await self._run(conn.close)
+        self._executor.shutdown(wait=True)
+        self._executor = None
+        logger.info("会话历史数据库已关闭")
+
+    def enqueue_append(self, session_id: str, role: str, content: str) -> None:
+        """将一条消息加入写入队列
+
+        Args:
+            session_id: 会话ID
+            role: 消息角色
+            content: 消息内容
+        """
+        if self._conn is None:
+            return
+        self._pending.append(("append", session_id, role, content, time.time()))
+        if len(self._pending) >= self.batch_size:
+            self._flush_event.set()
+
+    def enqueue_clear(self, session_id: str) -> None:
+        """将清除会话的操作加入写入队列
+
+        Args:
+            session_id: 会话ID
+        """
+        if self._conn is None:
+            return
+        self._pending.append(("clear", session_id))
+        self._flush_event.set()
+
+    async def flush(self) -> None:
+        """立即提交写入队列"""
+        if self._conn is None or not self._pending:
+            return
+        ops, self._pending = self._pending, []
+        await self._run(self._write_sync, ops)
+
+    async def load(self, session_id: str, limit: int) -> List[Tuple[str, str]]:
+        """读取会话最近的消息
+
+        Args:
+            session_id: 会话ID
+            limit: 最多读取的消息数
+
+        Returns:
+            List[Tuple[str, str]]: 按时间顺序排列的 (角色, 内容) 列表
+        """
+        if self._conn is None:
+            return []
+        # 先提交队列中的写入，执行器按提交顺序执行，保证读到最新数据
+        await self.flush()
+        self.loads += 1
+        return await self._run(self._load_sync, session_id, limit)
+
+    async def compact(self) -> None:
+        """压缩数据库：裁剪每个会话的旧消息并删除过期会话"""
+        if self._conn is None:
+            return
+        await self.flush()
+        await self._run(self._compact_sync)
+        self.compactions += 1
+
+    def get_stats(self) -> dict:
+        """获取持久化统计信息"""
+        return {
+            "open": self.is_open,
+            "pending": len(self._pending),
+            "writes": self.writes,
+            "loads": self.loads,
+            "compactions": self.compactions
+        }
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def _flush_loop(self) -> None:
+        """按间隔或批量大小提交写入队列"""
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"写入会话历史失败: {str(e)}")
+
+    async def _compact_loop(self) -> None:
+        """定期在后台压缩数据库"""
+        while True:
+            await asyncio.sleep(self.compact_interval)
+            try:
+                await self.compact()
+            except Exception as e:
+                logger.error(f"压缩会话历史失败: {str(e)}")
+
+    def _open_sync(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "session_id TEXT NOT NULL, "
+            "role TEXT NOT NULL, "
+            "content TEXT NOT NULL, "
+            "created_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, id)")
+        conn.commit()
+        return conn
+
+    def _write_sync(self, ops: List[Tuple]) -> None:
+        conn = self._conn
+        with conn:
+            rows = []
+            for op in ops:
+                if op[0] == "append":
+                    rows.append(op[1:])
+                    continue
+                # 清除操作之前的追加需要先写入，保证顺序
+                if rows:
+                    conn.executemany(
+                        "INSERT INTO messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)", rows)
+                    rows = []
+                conn.execute("DELETE FROM messages WHERE session_id = ?", (op[1],))
+            if rows:
+                conn.executemany(
+                    "INSERT INTO messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)", rows)
+        self.writes += len(ops)
+
+    def _load_sync(self, session_id: str, limit: int) -> List[Tuple[str, str]]:
+        cursor = self._conn.execute(
+            "SELECT role, content FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+            (session_id, limit)
+        )
+        rows = cursor.fetchall()
+        rows.reverse()
+        return rows
+
+    def _compact_sync(self) -> None:
+        conn = self._conn
+        with conn:
+            conn.execute(
+                "DELETE FROM messages WHERE id IN ("
+                "SELECT id FROM (SELECT id, ROW_NUMBER() OVER "
+                "(PARTITION BY session_id ORDER BY id DESC) AS rn FROM messages) WHERE rn > ?)",
+                (self.keep_messages,)
+            )
+            if self.retention_days > 0:
+                deadline = time.time() - self.retention_days * 86400
+                conn.execute(
+                    "DELETE FROM messages WHERE session_id IN ("
+                    "SELECT session_id FROM messages GROUP BY session_id HAVING MAX(created_at) < ?)",
+                    (deadline,)
+                )
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        logger.debug("会话历史数据库压缩完成")
@@ -0,0 +1,211 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Callable, Deque, Dict, Optional, Tuple
+
+from loguru import logger
+
+# 对冲额度的上限，避免长时间空闲后积累的额度在短时间内集中用掉
+MAX_HEDGE_CREDITS = 10.0
+
+
+class TTFBTracker:
+    """记录某个模型最近的首字节延迟，用于计算对冲延迟"""
+
+    __slots__ = ("samples", "_sorted")
+
+    def __init__(self, max_samples: int = 200):
+        self.samples: Deque[float] = deque(maxlen=max_samples)
+        self._sorted: Optional[list] = None
+
+    def add(self, seconds: float) -> None:
+        self.samples.append(seconds)
+        self._sorted = None
+
+    def quantile(self, q: float) -> float:
+        """最近样本的分位数，没有样本时返回0"""
+        if not self.samples:
+            return 0.0
+        if self._sorted is None:
+            self._sorted = sorted(self.samples)
+        index = min(len(self._sorted) - 1, int(q * len(self._sorted)))
+        return self._sorted[index]
+
+
+class HedgedRequests:
+    """对冲请求
+
+    首个数据块在延迟（该模型最近首字节延迟的分位数，如p90）内没有到达时，再发一个相同的请求，
+    两个请求中先返回数据的胜出，另一个立即取消。每个请求积累 budget 个对冲额度，
+    每次对冲消耗一个额度，因此额外请求数不超过总请求数的 budget 比例。
+    配置了 try_acquire 时，对冲请求还要占用一个上游并发槽位，没有空闲槽位时不对冲。
+    """
+
+    def __init__(self, quantile: float = 0.9, default_delay: float = 5.0, min_delay: float = 1.0,
+                 budget: float = 0.05, min_samples: int = 20, max_samples: int = 200, max_models: int = 64,
+                 try_acquire: Optional[Callable[[], bool]] = None, release: Optional[Callable[[], None]] = None):
+        """初始化对冲策略
+
+        Args:
+            quantile: 用首字节延迟的哪个分位数作为对冲延迟
+            default_delay: 样本不足时的对冲延迟（秒）
+            min_delay: 对冲延迟的下限（秒）
+            budget: 对冲请求占总请求数的比例上限
+            min_samples: 至少有多少个样本才按分位数计算延迟
+            max_samples: 每个模型保留的最近样本数
+            max_models: 最多记录多少个模型的首字节延迟，超出时淘汰最久未使用的模型
+            try_acquire: 不排队地占用一个上游并发槽位，成功返回True；为空则对冲请求不占用槽位
+            release: 归还 try_acquire 占用的槽位
+        """
+        self.quantile = quantile
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.budget = budget
+        self.min_samples = max(1, min_samples)
+        self.max_samples = max_samples
+        self.max_models = max(1, max_models)
+        self.try_acquire = try_acquire
+        self.release = release
+
+        self._trackers: "OrderedDict[str, TTFBTracker]" = OrderedDict()
+        self._credits = 0.0
+
+        # 统计信息
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+        self.capacity_denied = 0
+
+    def delay_for(self, key: str) -> float:
+        """获取某个模型当前的对冲延迟（秒）"""
+        tracker = self._trackers.get(key)
+        if tracker is None or len(tracker.samples) < self.min_samples:
+            return self.default_delay
+        return max(self.min_delay, tracker.quantile(self.quantile))
+
+    async def run(self, factory: Callable[[], AsyncIterator[str]], key: str,
+                  hedge_factory: Optional[Callable[[], AsyncIterator[str]]] = None) -> AsyncIterator[str]:
+        """执行一个可能被对冲的流式请求
+
+        Args:
+            factory: 创建一次请求的函数，返回异步迭代器，失败时抛出异常
+            key: 统计首字节延迟的键，一般为模型名
+            hedge_factory: 创建对冲请求的函数，为空时使用 factory
+
+        Yields:
+            str: 胜出请求的响应片段
+
+        Raises:
+            Exception: 所有请求都失败时，抛出最后一个失败请求的异常
+        """
+        self.requests += 1
+        self._credits = min(MAX_HEDGE_CREDITS, self._credits + self.budget)
+        delay = self.delay_for(key)
+
+        # 进行中的请求: 等待首个数据块的任务 -> (迭代器, 开始时间)
+        pending: Dict[asyncio.Future, Tuple[AsyncIterator[str], float]] = {}
+        primary = factory()
+        pending[asyncio.ensure_future(primary.__anext__())] = (primary, time.monotonic())
+        winner = None
+        # 对冲请求占用的槽位，对冲请求结束时归还
+        hedge = None
+        holding_slot = False
+
+        async def close(iterator: AsyncIterator[str]) -> None:
+            nonlocal holding_slot
+            await self._close(iterator)
+            if iterator is hedge and holding_slot:
+                holding_slot = False
+                self.release()
+
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                if self._credits < 1:
+                    self.budget_denied += 1
+                elif self.try_acquire is not None and not self.try_acquire():
+                    self.capacity_denied += 1
+                else:
+                    holding_slot = self.try_acquire is not None
+                    self._credits -= 1
+                    self.hedged += 1
+                    logger.debug(f"{key} {delay:.1f}秒内未收到数据，发送对冲请求")
+                    hedge = (hedge_factory or factory)()
+                    pending[asyncio.ensure_future(hedge.__anext__())] = (hedge, time.monotonic())
+
+            failed = None
+            while pending and winner is None:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    iterator, started = pending.pop(task)
+                    if winner is None and not task.cancelled() and task.exception() is None:
+                        winner = (task.result(), iterator, started)
+                    else:
+                        failed = task
+                        await close(iterator)
+            if winner is None:
+                # 所有请求都失败，空回复（StopAsyncIteration）直接结束
+                if failed is not None and not isinstance(failed.exception(), StopAsyncIteration):
+                    failed.result()
+                return
+
+            first_chunk, iterator, started = winner
+            self._tracker(key).add(time.monotonic() - started)
+            if iterator is not primary:
+                self.hedge_wins += 1
+                logger.debug(f"{key} 对冲请求胜出")
+            # 失败者立即取消
+            for task, (loser, _) in list(pending.items()):
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                await close(loser)
+            pending.clear()
+
+            yield first_chunk
+            async for chunk in iterator:
+                yield chunk
+        finally:
+            for task, (iterator, _) in pending.items():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                await close(iterator)
+            if winner is not None:
+                await close(winner[1])
+
+    def get_stats(self) -> Dict:
+        """获取对冲统计信息
+
+        Returns:
+            Dict: 统计信息，hedge_rate 为对冲请求占比，win_rate 为对冲请求胜出的比例
+        """
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "budget_denied": self.budget_denied,
+            "capacity_denied": self.capacity_denied,
+            "hedge_rate": self.hedged / self.requests if self.requests else 0.0,
+            "win_rate": self.hedge_wins / self.hedged if self.hedged else 0.0,
+            "delays": {key: round(self.delay_for(key), 2) for key in self._trackers}
+        }
+
+    def _tracker(self, key: str) -> TTFBTracker:
+        tracker = self._trackers.get(key)
+        if tracker is None:
+            tracker = TTFBTracker(self.max_samples)
+            self._trackers[key] = tracker
+            if len(self._trackers) > self.max_models:
+                self._trackers.popitem(last=False)
+        else:
+            self._trackers.move_to_end(key)
+        return tracker
+
+    @staticmethod
+    async def _close(iterator: AsyncIterator[str]) -> None:
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            try:
+                await aclose()
+            except Exception as e:
+                logger.debug(f"关闭请求流异常: {str(e)}")
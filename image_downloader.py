@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+import aiohttp
+from loguru import logger
+
+
+class ImageDownloadError(Exception):
+    """图片下载失败或被拒绝"""
+
+    def __init__(self, message: str, retryable: bool = False):
+        """初始化异常
+
+        Args:
+            message: 错误信息
+            retryable: 是否值得重试（如服务端错误），不是图片或超过大小上限时为False
+        """
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class ImageDownloader:
+    """将图片流式下载到磁盘
+
+    响应体按固定大小的块读取，写文件在线程池中完成，不会阻塞事件循环，
+    内存中最多只保留一个块。内容先写入同目录下的临时文件，下载完成后原子地重命名为目标文件，
+    因此目标路径上不会出现写了一半的图片。
+    """
+
+    def __init__(self, max_bytes: int = 20 * 1024 * 1024, chunk_size: int = 64 * 1024,
+                 workers: int = 2, timeout: float = 60):
+        """初始化下载器
+
+        Args:
+            max_bytes: 单张图片的最大字节数，超出时中止下载
+            chunk_size: 每次读取和写入的块大小（字节）
+            workers: 写文件线程数
+            timeout: 单次下载的总超时时间（秒）
+        """
+        self.max_bytes = max_bytes
+        self.chunk_size = max(1024, chunk_size)
+        self.workers = max(1, workers)
+        self.timeout = timeout
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        # 统计信息
+        self.downloads = 0
+        self.failures = 0
+        self.rejected = 0
+        self.bytes_total = 0
+        self.seconds_total = 0.0
+        self.last_throughput = 0.0
+
+    async def download(self, session: aiohttp.ClientSession, url: str, path: str) -> Dict:
+        """下载图片并保存到指定路径
+
+        Args:
+            session: 共享的HTTP会话
+            url: 图片地址
+            path: 保存路径，所在目录需已存在
+
+        Returns:
+            Dict: 下载结果，包含 path/bytes/seconds/throughput（字节每秒）/
+            sha256（内容的十六进制摘要）/content_type
+
+        Raises:
+            ImageDownloadError: HTTP状态异常、不是图片或超过大小上限
+        """
+        started = time.monotonic()
+        temp_path = None
+        # 因类型或大小限制被拒绝的下载只计入 rejected，不计入 failures
+        rejected = False
+        try:
+            async with session.get(url, timeout=aiohttp.ClientTimeout(total=self.timeout)) as response:
+                if response.status != 200:
+                    raise ImageDownloadError(f"下载图片失败: HTTP {response.status}",
+                                             retryable=response.status >= 500 or response.status == 429)
+                content_type = response.headers.get("Content-Type", "")
+                if not content_type.lower().startswith("image/"):
+                    rejected = True
+                    raise ImageDownloadError(f"不是图片内容: {content_type or '未知类型'}")
+                if response.content_length is not None and response.content_length > self.max_bytes:
+                    rejected = True
+                    raise ImageDownloadError(f"图片过大: {response.content_length} 字节")
+
+                file, temp_path = await self._run(self._open_temp, path)
+                digest = hashlib.sha256()
+                size = 0
+                try:
+                    async for chunk in response.content.iter_chunked(self.chunk_size):
+                        size += len(chunk)
+                        if size > self.max_bytes:
+                            rejected = True
+                            raise ImageDownloadError(f"图片超过大小上限 {self.max_bytes} 字节")
+                        await self._run(self._write, file, digest, chunk)
+                finally:
+                    await self._run(file.close)
+
+            if size == 0:
+                raise ImageDownloadError("下载的图片为空", retryable=True)
+            await self._run(os.replace, temp_path, path)
+            temp_path = None
+        except BaseException as e:
+            # 取消时也要清理临时文件，删除文件很快，这里直接同步执行
+            if rejected:
+                self.rejected += 1
+            elif not isinstance(e, asyncio.CancelledError):
+                self.failures += 1
+            if temp_path is not None:
+                self._remove(temp_path)
+            raise
+
+        elapsed = max(time.monotonic() - started, 1e-6)
+        throughput = size / elapsed
+        self.downloads += 1
+        self.bytes_total += size
+        self.seconds_total += elapsed
+        self.last_throughput = throughput
+        logger.info(f"图片已下载到: {path}，{size / 1024:.1f}KB，耗时{elapsed:.2f}秒，{throughput / 1024:.1f}KB/s")
+        return {
+            "path": path,
+            "bytes": size,
+            "seconds": elapsed,
+            "throughput": throughput,
+            "sha256": digest.hexdigest(),
+            "content_type": content_type.split(";")[0].strip().lower()
+        }
+
+    async def close(self) -> None:
+        """关闭写文件线程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def get_stats(self) -> Dict:
+        """获取下载统计信息
+
+        Returns:
+            Dict: 统计信息，吞吐量单位为字节每秒
+        """
+        return {
+            "downloads": self.downloads,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "bytes_total": self.bytes_total,
+            "avg_throughput": self.bytes_total / self.seconds_total if self.seconds_total else 0.0,
+            "last_throughput": self.last_throughput
+        }
+
+    async def _run(self, func, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="chargpt-image")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    @staticmethod
+    def _open_temp(path: str):
+        """在目标文件所在目录创建临时文件，保证重命名是同一文件系统内的原子操作"""
+        directory, name = os.path.split(path)
+        fd, temp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".part", dir=directory or None)
+        return os.fdopen(fd, "wb"), temp_path
+
+    @staticmethod
+    def _write(file, digest, chunk: bytes) -> None:
+        """写入一个块并同时计算摘要，在写文件线程中执行"""
+        file.write(chunk)
+        digest.update(chunk)
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,257 @@
+import asyncio
+import itertools
+import json
+import os
+import random
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+import aiohttp
+from loguru import logger
+
+from .image_downloader import ImageDownloadError
+from .image_store import ImageStore
+
+
+class ImageSaveJob:
+    """一个待保存的图片"""
+
+    __slots__ = ("job_id", "url", "session_id", "prompt", "model", "attempts")
+
+    def __init__(self, job_id: str, url: str, session_id: str = "", prompt: str = "", model: str = "",
+                 attempts: int = 0):
+        self.job_id = job_id
+        self.url = url
+        self.session_id = session_id
+        self.prompt = prompt
+        self.model = model
+        self.attempts = attempts
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.job_id,
+            "url": self.url,
+            "session_id": self.session_id,
+            "prompt": self.prompt,
+            "model": self.model,
+            "attempts": self.attempts
+        }
+
+
+class ImagePersistenceQueue:
+    """后台保存图片的工作队列
+
+    回复在拿到图片URL后立即发出，图片由固定数量的后台任务下载保存，图床变慢不会增加回复延迟。
+    下载失败时按指数退避重试；所有未完成的任务记录在任务文件中，重启后继续保存。
+    """
+
+    def __init__(self, store: ImageStore, get_session: Callable[[], Awaitable[aiohttp.ClientSession]],
+                 jobs_file: Optional[str] = None, workers: int = 2, max_pending: int = 100,
+                 max_retries: int = 3, backoff: float = 2.0):
+        """初始化保存队列
+
+        Args:
+            store: 图片存储
+            get_session: 获取共享HTTP会话的协程函数
+            jobs_file: 未完成任务的记录文件路径，为空则不记录
+            workers: 后台下载任务数
+            max_pending: 最多同时存在的未完成任务数，超出时丢弃新任务
+            max_retries: 下载失败后的最大重试次数
+            backoff: 首次重试的等待时间（秒），之后每次翻倍
+        """
+        self.store = store
+        self.get_session = get_session
+        self.jobs_file = jobs_file
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.max_retries = max(0, max_retries)
+        self.backoff = backoff
+
+        # 所有未完成的任务（排队、下载中和等待重试）
+        self._jobs: Dict[str, ImageSaveJob] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._retry_handles: Dict[str, asyncio.TimerHandle] = {}
+        self._in_progress = 0
+        self._ids = itertools.count(1)
+        self._journal_lock: Optional[asyncio.Lock] = None
+        self._journal_dirty = False
+        self._journal_tasks: Set[asyncio.Task] = set()
+
+        # 统计信息
+        self.saved = 0
+        self.failed = 0
+        self.dropped = 0
+        self.retries = 0
+
+    async def start(self) -> None:
+        """恢复上次未完成的任务并启动后台任务（可重复调用）
+
+        关闭后再次启动时，内存中尚未完成的任务（包括关闭前等待重试的任务）会重新加入队列。
+        """
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._journal_lock = asyncio.Lock()
+        for job in self._jobs.values():
+            self._queue.put_nowait(job)
+        for job in await self._load_journal():
+            if job.job_id not in self._jobs:
+                self._jobs[job.job_id] = job
+                self._queue.put_nowait(job)
+        if self._jobs:
+            logger.info(f"恢复了{len(self._jobs)}个未完成的图片保存任务")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self) -> None:
+        """停止后台任务，未完成的任务保留在任务文件中"""
+        for handle in self._retry_handles.values():
+            handle.cancel()
+        self._retry_handles.clear()
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # 等待进行中的任务文件写入，再写入最终状态
+        await asyncio.gather(*self._journal_tasks, return_exceptions=True)
+        if self._journal_lock is not None:
+            await self._write_journal()
+
+    def submit(self, url: str, session_id: str = "", prompt: str = "", model: str = "") -> bool:
+        """提交一个保存任务，立即返回
+
+        Args:
+            url: 图片地址
+            session_id: 生成图片的会话ID
+            prompt: 图片提示词
+            model: 生成图片的模型
+
+        Returns:
+            bool: 是否已加入队列，队列已满或未启动时返回False
+        """
+        if self._queue is None or len(self._jobs) >= self.max_pending:
+            self.dropped += 1
+            logger.warning(f"图片保存队列已满，放弃保存: {url}")
+            return False
+        job = ImageSaveJob(f"{int(time.time() * 1000)}-{next(self._ids)}", url, session_id, prompt, model)
+        self._jobs[job.job_id] = job
+        self._queue.put_nowait(job)
+        self._schedule_journal()
+        return True
+
+    def get_stats(self) -> Dict:
+        """获取队列统计信息
+
+        Returns:
+            Dict: 统计信息
+        """
+        return {
+            "pending": len(self._jobs),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "in_progress": self._in_progress,
+            "retrying": len(self._retry_handles),
+            "max_pending": self.max_pending,
+            "workers": len(self._tasks),
+            "saved": self.saved,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "retries": self.retries
+        }
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            if job.job_id not in self._jobs:
+                continue
+            self._in_progress += 1
+            try:
+                await self._save(job)
+            finally:
+                self._in_progress -= 1
+
+    async def _save(self, job: ImageSaveJob) -> None:
+        """下载一个任务，失败时安排重试或放弃"""
+        job.attempts += 1
+        try:
+            session = await self.get_session()
+            await self.store.save(session, job.url, job.session_id, job.prompt, job.model)
+        except asyncio.CancelledError:
+            # 关闭时中断的任务保留在任务文件中，下次启动继续
+            job.attempts -= 1
+            raise
+        except Exception as e:
+            retryable = e.retryable if isinstance(e, ImageDownloadError) else True
+            if retryable and job.attempts <= self.max_retries:
+                delay = self.backoff * 2 ** (job.attempts - 1) * random.uniform(0.8, 1.2)
+                self.retries += 1
+                logger.warning(f"保存图片失败，{delay:.1f}秒后第{job.attempts}次重试: {str(e)}")
+                self._retry_handles[job.job_id] = asyncio.get_running_loop().call_later(delay, self._requeue, job)
+                self._schedule_journal()
+                return
+            self.failed += 1
+            logger.error(f"保存图片失败，已放弃: {job.url}, {str(e)}")
+        else:
+            self.saved += 1
+        self._jobs.pop(job.job_id, None)
+        self._schedule_journal()
+
+    def _requeue(self, job: ImageSaveJob) -> None:
+        self._retry_handles.pop(job.job_id, None)
+        if job.job_id in self._jobs and self._queue is not None:
+            self._queue.put_nowait(job)
+
+    def _schedule_journal(self) -> None:
+        """在后台更新任务文件，多次变更合并为一次写入"""
+        if self.jobs_file is None or self._journal_dirty:
+            return
+        self._journal_dirty = True
+        # 保留任务引用，避免写入完成前被回收，关闭时等待写入完成
+        task = asyncio.get_running_loop().create_task(self._write_journal())
+        self._journal_tasks.add(task)
+        task.add_done_callback(self._journal_tasks.discard)
+
+    async def _write_journal(self) -> None:
+        if self.jobs_file is None:
+            return
+        async with self._journal_lock:
+            self._journal_dirty = False
+            jobs = [job.to_dict() for job in self._jobs.values()]
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(None, self._write_journal_sync, jobs)
+            except Exception as e:
+                logger.error(f"写入图片保存任务文件失败: {str(e)}")
+
+    def _write_journal_sync(self, jobs: List[Dict]) -> None:
+        directory = os.path.dirname(self.jobs_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.jobs_file}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(jobs, f, ensure_ascii=False)
+        os.replace(temp_path, self.jobs_file)
+
+    async def _load_journal(self) -> List[ImageSaveJob]:
+        if self.jobs_file is None or not os.path.exists(self.jobs_file):
+            return []
+        loop = asyncio.get_running_loop()
+        try:
+            data = await loop.run_in_executor(None, self._read_journal_sync)
+            return [
+                ImageSaveJob(
+                    str(item["id"]),
+                    item["url"],
+                    item.get("session_id", ""),
+                    item.get("prompt", ""),
+                    item.get("model", ""),
+                    int(item.get("attempts", 0))
+                )
+                for item in data
+            ]
+        except Exception as e:
+            logger.error(f"读取图片保存任务文件失败: {str(e)}")
+            return []
+
+    def _read_journal_sync(self) -> List[Dict]:
+        with open(self.jobs_file, "r", encoding="utf-8") as f:
+            return json.load(f)
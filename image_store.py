@@ -0,0 +1,338 @@
+import asyncio
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import aiohttp
+from loguru import logger
+
+from .image_downloader import ImageDownloader
+
+# 常见图片类型对应的扩展名
+IMAGE_EXTENSIONS = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/jpg": "jpg",
+    "image/gif": "gif",
+    "image/webp": "webp",
+    "image/bmp": "bmp"
+}
+
+# 按保留天数定期清理的间隔（秒）
+EVICT_INTERVAL = 3600
+
+
+class ImageStore:
+    """按内容寻址的图片存储
+
+    - 图片以内容的SHA-256摘要命名，存放在 摘要前两位/接下来两位 的分片子目录中，
+      相同的图片只保存一份，不同图片也不会因为同名互相覆盖
+    - SQLite索引记录每个文件的大小和访问时间，以及 会话/提示词/模型/时间 到摘要的映射，
+      查找和淘汰都通过索引完成，不需要扫描目录
+    - 超过磁盘配额时按最近访问时间（LRU）淘汰，超过保留天数的图片也会被清理；
+      打开时和保存新图片后各检查一次，设置了保留天数时还会在后台每小时清理一次
+    """
+
+    def __init__(self, root: str, downloader: ImageDownloader, max_bytes: int = 1024 * 1024 * 1024,
+                 max_age_days: float = 0, index_file: Optional[str] = None):
+        """初始化图片存储
+
+        Args:
+            root: 存储根目录
+            downloader: 图片下载器
+            max_bytes: 磁盘配额（字节），小于等于0表示不限制
+            max_age_days: 图片保留天数，小于等于0表示不按时间清理
+            index_file: 索引数据库路径，为空时使用根目录下的 index.db
+        """
+        self.root = root
+        self.downloader = downloader
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.index_file = index_file or os.path.join(root, "index.db")
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._evict_task: Optional[asyncio.Task] = None
+        self._total_bytes = 0
+        self._file_count = 0
+
+        # 统计信息
+        self.stored = 0
+        self.duplicates = 0
+        self.evicted = 0
+
+    @property
+    def is_open(self) -> bool:
+        return self._conn is not None
+
+    async def open(self) -> None:
+        """打开索引（可重复调用）"""
+        if self._conn is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chargpt-image-index")
+        self._conn = await self._run(self._open_sync)
+        self._total_bytes, self._file_count = await self._run(self._totals_sync)
+        logger.info(f"图片存储已打开: {self.root}，共{self._file_count}张图片，{self._total_bytes / 1024 / 1024:.1f}MB")
+        # 配额或保留天数可能在上次运行后被调小
+        await self.evict()
+        if self.max_age_days > 0:
+            self._evict_task = asyncio.create_task(self._evict_loop())
+
+    async def close(self) -> None:
+        """关闭索引"""
+        if self._conn is None:
+            return
+        if self._evict_task is not None:
+            self._evict_task.cancel()
+            try:
+                await self._evict_task
+            except asyncio.CancelledError:
+                pass
+            self._evict_task = None
+        conn = self._conn
+        self._conn = None
+        await self._run(conn.close)
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    async def save(self, session: aiohttp.ClientSession, url: str, session_id: str = "",
+                   prompt: str = "", model: str = "") -> Dict:
+        """下载图片并存入存储
+
+        Args:
+            session: 共享的HTTP会话
+            url: 图片地址
+            session_id: 生成图片的会话ID
+            prompt: 图片提示词
+            model: 生成图片的模型
+
+        Returns:
+            Dict: 保存结果，包含 sha256/path/bytes/duplicate
+        """
+        if self._conn is None:
+            raise RuntimeError("图片存储未打开")
+        staging = os.path.join(self.root, ".tmp", f"{uuid.uuid4().hex}.part")
+        await self._run(os.makedirs, os.path.dirname(staging), 0o755, True)
+        result = await self.downloader.download(session, url, staging)
+        digest = result["sha256"]
+        extension = IMAGE_EXTENSIONS.get(result["content_type"], "png")
+
+        path, duplicate, created = await self._run(
+            self._commit_sync, staging, digest, extension, result["bytes"], session_id, prompt, model)
+        if duplicate:
+            self.duplicates += 1
+            logger.debug(f"图片已存在，复用: {path}")
+        else:
+            self.stored += 1
+            # 索引中已有记录、只是文件丢失时，大小已经计入总量
+            if created:
+                self._total_bytes += result["bytes"]
+                self._file_count += 1
+            logger.info(f"图片已保存到: {path}")
+            await self.evict()
+        return {"sha256": digest, "path": path, "bytes": result["bytes"], "duplicate": duplicate}
+
+    async def find(self, session_id: str, limit: int = 10) -> List[Dict]:
+        """查找会话最近生成的图片
+
+        Args:
+            session_id: 会话ID
+            limit: 最多返回的数量
+
+        Returns:
+            List[Dict]: 按时间倒序排列的图片信息，包含 sha256/path/prompt/model/created_at
+        """
+        if self._conn is None:
+            return []
+        return await self._run(self._find_sync, session_id, limit)
+
+    async def path_for(self, digest: str) -> Optional[str]:
+        """按摘要获取图片路径并更新访问时间
+
+        Args:
+            digest: 图片的SHA-256摘要
+
+        Returns:
+            Optional[str]: 图片路径，不存在时返回None
+        """
+        if self._conn is None:
+            return None
+        return await self._run(self._touch_sync, digest)
+
+    async def evict(self) -> int:
+        """按保留天数和磁盘配额淘汰图片
+
+        Returns:
+            int: 淘汰的图片数
+        """
+        if self._conn is None:
+            return 0
+        over_quota = self.max_bytes > 0 and self._total_bytes > self.max_bytes
+        if not over_quota and self.max_age_days <= 0:
+            return 0
+        removed, freed, self._total_bytes, self._file_count = await self._run(self._evict_sync)
+        if removed:
+            self.evicted += removed
+            logger.info(f"图片存储淘汰了{removed}张图片，释放{freed / 1024 / 1024:.1f}MB")
+        return removed
+
+    def get_stats(self) -> Dict:
+        """获取存储统计信息"""
+        return {
+            "open": self.is_open,
+            "files": self._file_count,
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "stored": self.stored,
+            "duplicates": self.duplicates,
+            "evicted": self.evicted
+        }
+
+    async def _evict_loop(self) -> None:
+        """定期清理超过保留天数的图片，没有新图片保存时也会执行"""
+        while True:
+            await asyncio.sleep(EVICT_INTERVAL)
+            try:
+                await self.evict()
+            except Exception as e:
+                logger.error(f"定期清理图片异常: {str(e)}")
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _blob_path(self, digest: str, extension: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], f"{digest}.{extension}")
+
+    def _open_sync(self) -> sqlite3.Connection:
+        os.makedirs(self.root, exist_ok=True)
+        conn = sqlite3.connect(self.index_file, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            "sha256 TEXT PRIMARY KEY, "
+            "extension TEXT NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, "
+            "last_access REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "sha256 TEXT NOT NULL, "
+            "session_id TEXT NOT NULL, "
+            "prompt TEXT NOT NULL, "
+            "model TEXT NOT NULL, "
+            "created_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_blobs_access ON blobs (last_access)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_blobs_created ON blobs (created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_images_session ON images (session_id, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_images_sha256 ON images (sha256)")
+        conn.commit()
+        return conn
+
+    def _totals_sync(self):
+        row = self._conn.execute("SELECT COALESCE(SUM(size), 0), COUNT(*) FROM blobs").fetchone()
+        return row[0], row[1]
+
+    def _commit_sync(self, staging: str, digest: str, extension: str, size: int,
+                     session_id: str, prompt: str, model: str):
+        """将下载好的文件移动到内容地址并写入索引，返回 (路径, 是否重复, 是否新增了索引记录)"""
+        conn = self._conn
+        now = time.time()
+        row = conn.execute("SELECT extension FROM blobs WHERE sha256 = ?", (digest,)).fetchone()
+        duplicate = row is not None and os.path.exists(self._blob_path(digest, row[0]))
+        if duplicate:
+            path = self._blob_path(digest, row[0])
+            os.remove(staging)
+        else:
+            path = self._blob_path(digest, extension)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(staging, path)
+        with conn:
+            if duplicate:
+                conn.execute("UPDATE blobs SET last_access = ? WHERE sha256 = ?", (now, digest))
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO blobs (sha256, extension, size, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (digest, extension, size, now, now)
+                )
+            conn.execute(
+                "INSERT INTO images (sha256, session_id, prompt, model, created_at) VALUES (?, ?, ?, ?, ?)",
+                (digest, session_id, prompt, model, now)
+            )
+        return path, duplicate, row is None
+
+    def _find_sync(self, session_id: str, limit: int) -> List[Dict]:
+        cursor = self._conn.execute(
+            "SELECT images.sha256, blobs.extension, images.prompt, images.model, images.created_at "
+            "FROM images JOIN blobs ON blobs.sha256 = images.sha256 "
+            "WHERE images.session_id = ? ORDER BY images.id DESC LIMIT ?",
+            (session_id, limit)
+        )
+        return [
+            {
+                "sha256": digest,
+                "path": self._blob_path(digest, extension),
+                "prompt": prompt,
+                "model": model,
+                "created_at": created_at
+            }
+            for digest, extension, prompt, model, created_at in cursor.fetchall()
+        ]
+
+    def _touch_sync(self, digest: str) -> Optional[str]:
+        conn = self._conn
+        row = conn.execute("SELECT extension FROM blobs WHERE sha256 = ?", (digest,)).fetchone()
+        if row is None:
+            return None
+        with conn:
+            conn.execute("UPDATE blobs SET last_access = ? WHERE sha256 = ?", (time.time(), digest))
+        return self._blob_path(digest, row[0])
+
+    def _evict_sync(self):
+        """删除过期图片，再按访问时间从旧到新删除直到低于配额
+
+        总量从索引中重新统计：索引操作都在同一个线程中依次执行，多个保存任务先后触发淘汰时，
+        后一次看到的是前一次淘汰之后的总量，不会重复删除。
+
+        Returns:
+            (删除数, 释放字节数, 淘汰后的总字节数, 淘汰后的图片数)
+        """
+        conn = self._conn
+        total_bytes, file_count = self._totals_sync()
+        victims = []
+        if self.max_age_days > 0:
+            deadline = time.time() - self.max_age_days * 86400
+            victims.extend(conn.execute(
+                "SELECT sha256, extension, size FROM blobs WHERE created_at < ?", (deadline,)).fetchall())
+        remaining = total_bytes - sum(size for _, _, size in victims)
+        if self.max_bytes > 0 and remaining > self.max_bytes:
+            expired = {digest for digest, _, _ in victims}
+            cursor = conn.execute("SELECT sha256, extension, size FROM blobs ORDER BY last_access")
+            for digest, extension, size in cursor:
+                if remaining <= self.max_bytes:
+                    break
+                if digest in expired:
+                    continue
+                victims.append((digest, extension, size))
+                remaining -= size
+            cursor.close()
+
+        freed = 0
+        with conn:
+            for digest, extension, size in victims:
+                try:
+                    os.remove(self._blob_path(digest, extension))
+                except FileNotFoundError:
+                    pass
+                conn.execute("DELETE FROM blobs WHERE sha256 = ?", (digest,))
+                conn.execute("DELETE FROM images WHERE sha256 = ?", (digest,))
+                freed += size
+        return len(victims), freed, total_bytes - freed, file_count - len(victims)
@@ -1,773 +1,1632 @@
-from loguru import logger
-import tomllib
-import os
-import asyncio
-import time
-import re
-from typing import Dict, List, Optional
-import aiohttp
-
-from WechatAPI import WechatAPIClient
-from utils.decorators import *
-from utils.plugin_base import PluginBase
-from .api_client import ChargptAPIClient
-
-
-class ChargptChat(PluginBase):
-    description = "Chargpt.ai AI聊天插件"
-    author = "ChatGPT"
-    version = "1.0.0"
-
-    def __init__(self):
-        super().__init__()
-        
-        # 获取配置文件路径
-        config_path = os.path.join(os.path.dirname(__file__), "config.toml")
-        
-        try:
-            with open(config_path, "rb") as f:
-                config = tomllib.load(f)
-                
-            # 读取基本配置
-            basic_config = config.get("basic", {})
-            self.enable = basic_config.get("enable", False)
-            self.trigger_keyword = basic_config.get("trigger_keyword", "ai")
-            self.respond_to_at = basic_config.get("respond_to_at", True)
-            self.allow_private_chat = basic_config.get("allow_private_chat", True)
-            
-            # 读取API配置
-            api_config = config.get("api", {})
-            self.api_token = api_config.get("api_token", "")
-            self.base_url = api_config.get("base_url", "https://api.chargpt.ai")
-            self.client_version = api_config.get("client_version", "1.1.76")
-            self.language = api_config.get("language", "zh-CN")
-            
-            # 读取模型配置
-            model_config = config.get("model", {})
-            self.default_model = model_config.get("default_model", "openai/gpt-4o")
-            self.allow_model_selection = model_config.get("allow_model_selection", False)
-            self.prompt_template = model_config.get("prompt_template", "{message}")
-            
-            # 读取图片生成配置
-            image_config = config.get("image", {})
-            self.enable_image_generation = image_config.get("enable_image_generation", True)
-            self.default_image_model = image_config.get("default_image_model", "openai/gpt-4o-image")
-            self.image_command = image_config.get("image_command", "画")
-            self.default_ratio = image_config.get("default_ratio", "1:1")
-            self.image_save_path = image_config.get("image_save_path", "images")
-            self.save_images = image_config.get("save_images", True)
-            self.web_access = image_config.get("web_access", "close")
-            self.timezone = image_config.get("timezone", "Asia/Shanghai")
-            
-            # 读取聊天配置
-            chat_config = config.get("chat", {})
-            self.max_history = chat_config.get("max_history", 10)
-            self.separate_context = chat_config.get("separate_context", True)
-            self.timeout = chat_config.get("timeout", 60)
-            self.show_thinking = chat_config.get("show_thinking", True)
-            
-            # 初始化API客户端
-            self.api_client = ChargptAPIClient(
-                api_token=self.api_token,
-                base_url=self.base_url,
-                client_version=self.client_version,
-                language=self.language,
-                default_model=self.default_model,
-                prompt_template=self.prompt_template
-            )
-            
-            # 用于记录响应状态的字典
-            self.responding_to = {}
-            
-            # 确保图片保存目录存在
-            if self.save_images:
-                image_dir = os.path.join(os.path.dirname(__file__), self.image_save_path)
-                if not os.path.exists(image_dir):
-                    try:
-                        os.makedirs(image_dir)
-                        logger.info(f"创建图片保存目录: {image_dir}")
-                    except Exception as e:
-                        logger.error(f"创建图片保存目录失败: {str(e)}")
-                        self.save_images = False
-            
-        except Exception as e:
-            logger.error(f"加载ChargptChat配置文件失败: {str(e)}")
-            self.enable = False
-
-    async def async_init(self):
-        # 检查配额，确认API可用
-        if self.enable and self.api_token:
-            try:
-                quota_result = await self.api_client.get_quota()
-                if quota_result["success"]:
-                    logger.info(f"ChargptChat API连接成功")
-                else:
-                    logger.warning(f"ChargptChat API配额检查失败: {quota_result.get('error', '未知错误')}")
-            except Exception as e:
-                logger.error(f"ChargptChat API初始化异常: {str(e)}")
-                
-    @on_text_message(priority=90)  # 设置非常高的优先级，确保最先执行
-    async def detect_trigger_keyword(self, bot: WechatAPIClient, message: dict):
-        """检测唤醒词并标记为处理中"""
-        if not self.enable:
-            return True
-            
-        # 兼容不同的消息结构
-        content = message.get("content", message.get("Content", ""))
-        
-        # 检查是否包含触发词
-        if content.lower().startswith(f"{self.trigger_keyword} ") or content.lower() == self.trigger_keyword:
-            logger.info(f"ChargptChat检测到唤醒词: {content}，继续执行自己的处理函数")
-            # 返回True以允许插件自己的后续处理函数执行
-            return True
-            
-        # 不包含触发词，继续处理
-        return True
-
-    @on_text_message(priority=50)  # 设置更高优先级，确保在handle_text之前执行
-    async def handle_blocking(self, bot: WechatAPIClient, message: dict):
-        """处理敏感词阻塞"""
-        if not self.enable:
-            return True
-            
-        # 兼容不同的消息结构
-        content = message.get("content", message.get("Content", ""))
-        from_user_id = message.get("sender_id", message.get("SenderWxid", ""))
-        room_id = message.get("room_id", message.get("FromWxid", ""))
-        
-        # 检查消息内容是否包含触发词
-        if not content.lower().startswith(f"{self.trigger_keyword} ") and not content.lower() == self.trigger_keyword:
-            return True
-            
-        # 移除触发关键词，提取实际查询内容
-        query = content[len(self.trigger_keyword):].strip() if content.lower() != self.trigger_keyword else ""
-        
-        # 敏感词名单(可以根据需要修改或从配置文件读取)
-        sensitive_words = ["敏感词1", "敏感词2", "违禁词", "色情", "暴力", "政治"]
-        
-        # 检查是否包含敏感词
-        for word in sensitive_words:
-            if word in query:
-                logger.warning(f"检测到敏感词: {word}, 消息: {query}")
-                await bot.send_at_message(room_id or from_user_id, 
-                    f"抱歉，您的消息包含敏感内容 ({word})，已被拦截。请遵守社区规则和法律法规。", 
-                    [from_user_id])
-                return False  # 阻止后续处理
-                
-        # 不含敏感词，继续处理
-        return True
-        
-    @on_at_message(priority=90)  # 设置非常高的优先级，确保最先执行
-    async def detect_at_trigger(self, bot: WechatAPIClient, message: dict):
-        """检测@消息"""
-        # 如果设置了不响应@消息，直接返回True以继续执行其他插件处理
-        if not self.enable or not self.respond_to_at:
-            return True
-            
-        # 兼容不同的消息结构
-        from_user_id = message.get("sender_id", message.get("SenderWxid", ""))
-        room_id = message.get("room_id", message.get("FromWxid", ""))
-        
-        # 必须在群聊中
-        if not room_id:
-            return True
-            
-        # 检测到@消息，继续执行自己的处理
-        logger.info(f"ChargptChat检测到@消息，继续执行自己的处理函数")
-        return True
-
-    @on_at_message(priority=70)
-    async def handle_at(self, bot: WechatAPIClient, message: dict):
-        """处理@消息"""
-        if not self.enable or not self.respond_to_at:
-            return True
-            
-        # 添加调试日志
-        logger.debug(f"ChargptChat收到@消息: {message}")
-            
-        # 兼容不同的消息结构
-        content = message.get("content", message.get("Content", "")).strip()
-        from_user_id = message.get("sender_id", message.get("SenderWxid", ""))
-        room_id = message.get("room_id", message.get("FromWxid", ""))
-        
-        # 必须在群聊中
-        if not room_id:
-            return True
-            
-        # 获取会话ID
-        session_id = room_id if self.separate_context else from_user_id
-        
-        # 检查是否已经在响应中
-        if session_id in self.responding_to and self.responding_to[session_id]:
-            await bot.send_at_message(room_id, "我正在思考上一个问题，请稍候...", [from_user_id])
-            return False  # 已经处理，阻止其他插件执行
-            
-        # 如果内容为空，发送提示
-        if not content:
-            await bot.send_at_message(room_id, "请问有什么可以帮助您的？", [from_user_id])
-            return False  # 已经处理，阻止其他插件执行
-            
-        logger.info(f"ChargptChat处理@消息: {content}")
-        
-        # 标记为正在响应
-        self.responding_to[session_id] = True
-        
-        try:
-            # 如果开启思考提示，先发送思考中的消息
-            thinking_message_id = None
-            if self.show_thinking:
-                try:
-                    thinking_result = await bot.send_at_message(room_id, "思考中...", [from_user_id])
-                    # 检查返回值类型并适当处理
-                    if isinstance(thinking_result, tuple) and len(thinking_result) > 0:
-                        thinking_message_id = thinking_result[0]  # 假设第一个元素是消息ID
-                    elif isinstance(thinking_result, dict) and thinking_result.get("status") == "success":
-                        thinking_message_id = thinking_result.get("data", {}).get("message_id")
-                    logger.debug(f"思考消息ID: {thinking_message_id}, 返回值类型: {type(thinking_result)}")
-                except Exception as e:
-                    logger.warning(f"发送思考消息异常: {str(e)}")
-            
-            # 处理响应
-            response_text = ""
-            logger.debug(f"开始处理API流式响应...")
-            chunk_count = 0
-            async for chunk in self.api_client.chat(session_id, content, None):
-                chunk_count += 1
-                response_text += chunk
-                if chunk_count % 10 == 0:  # 每收到10个块记录一次日志
-                    logger.debug(f"已接收{chunk_count}个响应块，当前长度:{len(response_text)}")
-            
-            logger.info(f"API响应接收完成，总计{chunk_count}个块，总长度:{len(response_text)}")
-            
-            # 确保回复不为空
-            if not response_text.strip():
-                response_text = "抱歉，AI没有返回有效回复。"
-                logger.warning("API返回了空响应")
-            
-            # 发送完整响应
-            if thinking_message_id:
-                # 如果有思考中消息，则撤回
-                try:
-                    # 根据API不同，可能需要不同的参数组合
-                    logger.debug(f"尝试撤回消息ID: {thinking_message_id}")
-                    
-                    # 尝试不同的撤回方式
-                    try:
-                        # 方式1: 直接使用消息ID
-                        await bot.revoke_message(thinking_message_id)
-                    except Exception:
-                        try:
-                            # 方式2: 提供聊天ID和消息ID
-                            await bot.revoke_message(room_id or from_user_id, thinking_message_id)
-                        except Exception:
-                            # 方式3: 忽略撤回
-                            logger.warning(f"无法撤回思考消息，将直接发送回复")
-                except Exception as e:
-                    logger.warning(f"撤回思考消息失败: {str(e)}")
-                
-            # 发送最终回复
-            logger.debug(f"发送最终回复，长度:{len(response_text)}")
-            await bot.send_at_message(room_id, response_text, [from_user_id])
-            return False
-                
-        except Exception as e:
-            logger.error(f"处理AI回复异常: {str(e)}")
-            await bot.send_at_message(room_id, f"处理您的请求时出错: {str(e)}", [from_user_id])
-            return False
-        finally:
-            # 标记为响应完成
-            self.responding_to[session_id] = False
-            
-    @on_text_message(priority=90)  # 设置非常高的优先级，确保最先执行
-    async def detect_command_trigger(self, bot: WechatAPIClient, message: dict):
-        """检测命令唤醒词"""
-        if not self.enable:
-            return True
-            
-        # 兼容不同的消息结构
-        content = message.get("content", message.get("Content", ""))
-        
-        # 检查是否包含命令前缀
-        if content.startswith(f"{self.trigger_keyword}_"):
-            logger.info(f"ChargptChat检测到命令唤醒词: {content}，继续执行自己的处理函数")
-            return True
-            
-        # 不包含命令前缀，继续处理
-        return True
-
-    @on_text_message(priority=70)  # 设置较高优先级，保证能在一般插件之前执行
-    async def handle_text(self, bot: WechatAPIClient, message: dict):
-        """处理文本消息"""
-        if not self.enable:
-            return True
-            
-        # 添加调试日志，查看接收到的消息结构
-        logger.debug(f"ChargptChat收到消息: {message}")
-        
-        # 兼容不同的消息结构
-        content = message.get("content", message.get("Content", ""))
-        from_user_id = message.get("sender_id", message.get("SenderWxid", ""))
-        room_id = message.get("room_id", message.get("FromWxid", ""))
-        
-        # 打印触发词和消息内容
-        logger.debug(f"ChargptChat触发词检查: 当前词='{self.trigger_keyword}', 消息内容='{content}'")
-        
-        # 检查是否是私聊消息且是否允许私聊
-        if not room_id and not self.allow_private_chat:
-            return True
-            
-        # 非触发条件，直接返回
-        if not content.lower().startswith(f"{self.trigger_keyword} ") and not content.lower() == self.trigger_keyword:
-            return True
-            
-        logger.info(f"ChargptChat处理消息: {content}")
-        
-        # 获取会话ID
-        session_id = room_id if room_id and self.separate_context else from_user_id
-        
-        # 移除触发关键词，提取实际查询内容
-        if content.lower() == self.trigger_keyword:
-            # 如果只有触发词没有内容，发送帮助信息
-            await bot.send_at_message(room_id or from_user_id, "我是ChargptAI助手，请在触发词后面输入您的问题。", [from_user_id])
-            return False  # 已经处理完成，阻止其他插件执行
-            
-        query = content[len(self.trigger_keyword):].strip()
-        if not query:
-            await bot.send_at_message(room_id or from_user_id, "我是ChargptAI助手，请在触发词后面输入您的问题。", [from_user_id])
-            return False
-        
-        # 检查是否是图片生成请求
-        is_image_request = False
-        if self.enable_image_generation and query.startswith(self.image_command):
-            image_prompt = query[len(self.image_command):].strip()
-            if image_prompt:
-                is_image_request = True
-                logger.info(f"检测到图片生成请求: {image_prompt}")
-            
-        # 提取模型信息（如果允许并且指定了）
-        model_to_use = None
-        if self.allow_model_selection and query.startswith("[") and "]" in query:
-            model_end = query.find("]")
-            model_name = query[1:model_end].strip()
-            if model_name:
-                model_to_use = model_name
-                # 移除模型指定部分
-                query = query[model_end+1:].strip()
-                logger.info(f"用户指定使用模型: {model_to_use}")
-                
-                # 重新检查是否为图片生成请求
-                if self.enable_image_generation and query.startswith(self.image_command):
-                    image_prompt = query[len(self.image_command):].strip()
-                    if image_prompt:
-                        is_image_request = True
-                        logger.info(f"检测到指定模型的图片生成请求: {image_prompt}")
-            
-        # 检查是否已经在响应中
-        if session_id in self.responding_to and self.responding_to[session_id]:
-            await bot.send_at_message(room_id or from_user_id, "我正在思考上一个问题，请稍候...", [from_user_id])
-            return False
-            
-        # 标记为正在响应
-        self.responding_to[session_id] = True
-        
-        try:
-            # 如果开启思考提示，先发送思考中的消息
-            thinking_message_id = None
-            if self.show_thinking:
-                try:
-                    thinking_result = await bot.send_at_message(room_id or from_user_id, "思考中...", [from_user_id])
-                    # 检查返回值类型并适当处理
-                    if isinstance(thinking_result, tuple) and len(thinking_result) > 0:
-                        thinking_message_id = thinking_result[0]  # 假设第一个元素是消息ID
-                    elif isinstance(thinking_result, dict) and thinking_result.get("status") == "success":
-                        thinking_message_id = thinking_result.get("data", {}).get("message_id")
-                    logger.debug(f"思考消息ID: {thinking_message_id}, 返回值类型: {type(thinking_result)}")
-                except Exception as e:
-                    logger.warning(f"发送思考消息异常: {str(e)}")
-            
-            # 根据请求类型处理响应
-            response_text = ""
-            
-            if is_image_request:
-                # 处理图片生成请求
-                image_prompt = query[len(self.image_command):].strip()
-                
-                # 检查是否指定了比例，如 "画 16:9 一个风景"
-                ratio = self.default_ratio
-                if " " in image_prompt:
-                    first_part = image_prompt.split(" ")[0]
-                    if ":" in first_part and len(first_part) <= 5:  # 简单判断是否是比例格式
-                        ratio_parts = first_part.split(":")
-                        if len(ratio_parts) == 2 and ratio_parts[0].isdigit() and ratio_parts[1].isdigit():
-                            ratio = first_part
-                            image_prompt = image_prompt[len(first_part):].strip()
-                            logger.info(f"检测到指定比例: {ratio}, 调整后的提示词: {image_prompt}")
-                
-                logger.debug(f"开始处理图片生成请求，提示词: {image_prompt}, 比例: {ratio}")
-                
-                # 获取并发送进度更新
-                progress_updates = []
-                image_url = None
-                
-                async for chunk in self.api_client.generate_image(
-                    session_id, 
-                    image_prompt, 
-                    model=model_to_use or self.default_image_model,
-                    ratio=ratio,
-                    web_access=self.web_access,
-                    timezone=self.timezone
-                ):
-                    # 累积进度更新，但不直接发送每个小更新
-                    if "进度" in chunk or "%" in chunk:
-                        progress_updates.append(chunk)
-                        # 每接收到3个进度更新，或进度达到100%，发送一次更新
-                        if len(progress_updates) >= 3 or "100%" in chunk or "生成完成" in chunk:
-                            update_text = "图片生成中...\n" + "\n".join(progress_updates[-3:])
-                            # 尝试更新思考消息，如果不行则发送新消息
-                            try:
-                                if thinking_message_id:
-                                    await bot.edit_message(room_id or from_user_id, thinking_message_id, update_text)
-                                else:
-                                    await bot.send_at_message(room_id or from_user_id, update_text, [from_user_id])
-                            except Exception as e:
-                                logger.warning(f"更新进度消息失败: {str(e)}")
-                    
-                    # 如果是图片URL，保存下来
-                    elif "![" in chunk and "](http" in chunk:
-                        response_text = chunk
-                        # 提取图片URL
-                        start_idx = chunk.find("](") + 2
-                        end_idx = chunk.find(")", start_idx)
-                        if start_idx > 1 and end_idx > start_idx:
-                            image_url = chunk[start_idx:end_idx]
-                            logger.info(f"图片生成完成，URL: {image_url}")
-                    else:
-                        response_text += chunk
-                
-                # 如果有图片URL，可以在这里下载保存到本地
-                if image_url and self.save_images:
-                    try:
-                        image_dir = os.path.join(os.path.dirname(__file__), self.image_save_path)
-                        filename = f"{int(time.time())}_{session_id[-8:]}.png"
-                        filepath = os.path.join(image_dir, filename)
-                        
-                        async with aiohttp.ClientSession() as session:
-                            async with session.get(image_url) as img_response:
-                                if img_response.status == 200:
-                                    with open(filepath, 'wb') as f:
-                                        f.write(await img_response.read())
-                                    logger.info(f"图片已保存到: {filepath}")
-                    except Exception as e:
-                        logger.error(f"保存图片失败: {str(e)}")
-            else:
-                # 处理普通文本请求
-                logger.debug(f"开始处理API流式响应...")
-                chunk_count = 0
-                async for chunk in self.api_client.chat(session_id, query, model_to_use):
-                    chunk_count += 1
-                    response_text += chunk
-                    if chunk_count % 10 == 0:  # 每收到10个块记录一次日志
-                        logger.debug(f"已接收{chunk_count}个响应块，当前长度:{len(response_text)}")
-                
-                logger.info(f"API响应接收完成，总计{chunk_count}个块，总长度:{len(response_text)}")
-            
-            # 确保回复不为空
-            if not response_text.strip():
-                response_text = "抱歉，AI没有返回有效回复。"
-                logger.warning("API返回了空响应")
-            
-            # 发送完整响应
-            if thinking_message_id:
-                # 如果有思考中消息，则撤回
-                try:
-                    # 根据API不同，可能需要不同的参数组合
-                    logger.debug(f"尝试撤回消息ID: {thinking_message_id}")
-                    
-                    # 尝试不同的撤回方式
-                    try:
-                        # 方式1: 直接使用消息ID
-                        await bot.revoke_message(thinking_message_id)
-                    except Exception:
-                        try:
-                            # 方式2: 提供聊天ID和消息ID
-                            await bot.revoke_message(room_id or from_user_id, thinking_message_id)
-                        except Exception:
-                            # 方式3: 忽略撤回
-                            logger.warning(f"无法撤回思考消息，将直接发送回复")
-                except Exception as e:
-                    logger.warning(f"撤回思考消息失败: {str(e)}")
-                
-            # 发送最终回复
-            logger.debug(f"发送最终回复，长度:{len(response_text)}")
-            await bot.send_at_message(room_id or from_user_id, response_text, [from_user_id])
-            return False
-                
-        except Exception as e:
-            logger.error(f"处理AI回复异常: {str(e)}")
-            await bot.send_at_message(room_id or from_user_id, f"处理您的请求时出错: {str(e)}", [from_user_id])
-            return False
-        finally:
-            # 标记为响应完成
-            self.responding_to[session_id] = False
-
-    @on_text_message(priority=70)
-    async def handle_command(self, bot: WechatAPIClient, message: dict):
-        """处理插件命令"""
-        if not self.enable:
-            return True
-            
-        # 兼容不同的消息结构
-        content = message.get("content", message.get("Content", ""))
-        from_user_id = message.get("sender_id", message.get("SenderWxid", ""))
-        room_id = message.get("room_id", message.get("FromWxid", ""))
-        
-        # 检查命令前缀
-        if not content.startswith(f"{self.trigger_keyword}_"):
-            return True
-            
-        logger.info(f"ChargptChat处理命令: {content}")
-        
-        # 解析命令
-        parts = content.split(" ", 1)
-        command = parts[0][len(f"{self.trigger_keyword}_"):].lower()
-        args = parts[1] if len(parts) > 1 else ""
-        
-        # 获取会话ID
-        session_id = room_id if room_id and self.separate_context else from_user_id
-        
-        # 处理不同命令
-        if command == "clear":
-            # 清除对话历史
-            self.api_client.clear_conversation(session_id)
-            await bot.send_at_message(room_id or from_user_id, "已清除当前会话历史记录", [from_user_id])
-            return False
-            
-        elif command == "model":
-            # 处理模型相关命令
-            if not args:
-                # 显示当前模型信息
-                model_text = f"当前使用的默认模型: {self.default_model}\n"
-                model_text += f"是否允许消息内指定模型: {'是' if self.allow_model_selection else '否'}\n\n"
-                model_text += "如需在消息中指定模型，请使用格式: chat [模型名] 问题\n"
-                model_text += "例如: chat [openai/gpt-4o] 你好\n\n"
-                model_text += "可用模型列表:\n"
-                model_text += "OpenAI模型:\n"
-                model_text += "- openai/gpt-4o - GPT-4o模型\n"
-                model_text += "- openai/gpt-4o-mini - GPT-4o mini模型\n"
-                model_text += "- openai/gpt-4o-image - GPT-4o支持图像分析\n"
-                model_text += "- openai/o1 - o1模型\n"
-                model_text += "- openai/o3-mini - o3 mini模型\n"
-                model_text += "- openai/gpt-3.5-turbo - GPT-3.5 Turbo模型\n"
-                model_text += "Anthropic模型:\n"
-                model_text += "- anthropic/claude-3.5-sonnet - Claude 3.5 Sonnet\n"
-                model_text += "- anthropic/claude-3.7-sonnet - Claude 3.7 Sonnet\n"
-                model_text += "Google模型:\n"
-                model_text += "- google/gemini-2.0-pro - Gemini 2.0 Pro\n"
-                model_text += "- google/gemini-2.0-flash - Gemini 2.0 Flash\n"
-                model_text += "- google/gemini-2.0-pro-exp-02-05 - Gemini 2.0 Pro实验版\n"
-                model_text += "- google/gemini-2.0-flash-thinking-exp-1219 - Gemini 2.0 Flash思考版\n"
-                model_text += "DeepSeek模型:\n"
-                model_text += "- deepseek/deepseek-r1 - DeepSeek R1 671B\n"
-                model_text += "- deepseek/deepseek-chat - DeepSeek V3\n"
-                model_text += "- deepseek/deepseek-chat-v3-0324 - DeepSeek V3 0324版\n"
-                model_text += "X-AI模型:\n"
-                model_text += "- x-ai/grok-3 - Grok 3\n"
-                model_text += "- x-ai/grok-3-reasoner - Grok 3 Reasoner\n"
-                model_text += "通义千问模型:\n"
-                model_text += "- qwen/qwq-32b - QwQ 32B\n"
-                model_text += "- qwen/qwen-max - Qwen Max\n"
-                
-                await bot.send_at_message(room_id or from_user_id, model_text, [from_user_id])
-            else:
-                # 用户指定了新的默认模型
-                new_model = args.strip()
-                if "/" in new_model:  # 确保格式正确
-                    self.default_model = new_model
-                    self.api_client.set_default_model(new_model)
-                    await bot.send_at_message(room_id or from_user_id, f"默认模型已设置为: {new_model}", [from_user_id])
-                else:
-                    await bot.send_at_message(room_id or from_user_id, "模型格式不正确，请使用格式: 提供商/模型名\n例如: openai/gpt-4o", [from_user_id])
-            return False
-            
-        elif command == "quota":
-            # 获取配额信息
-            try:
-                logger.info("正在请求配额信息...")
-                quota_result = await self.api_client.get_quota()
-                logger.debug(f"配额响应: {quota_result}")
-                
-                if quota_result["success"]:
-                    quota_data = quota_result["data"]
-                    # 记录原始数据
-                    logger.debug(f"原始配额数据: {quota_data}")
-                    
-                    # 格式化配额信息展示
-                    quota_text = "ChargptAI 配额信息:\n"
-                    quota_text += f"可用余额: {quota_data.get('available', '未知')}\n"
-                    quota_text += f"使用情况: {quota_data.get('used', '未知')}/{quota_data.get('total', '未知')}\n"
-                    
-                    # 添加更多信息，如果有的话
-                    if 'models' in quota_data:
-                        quota_text += "\n可用模型:\n"
-                        for model in quota_data['models']:
-                            quota_text += f"- {model}\n"
-                    
-                    # 添加全部字段，便于分析
-                    quota_text += "\n所有数据字段:\n"
-                    for key, value in quota_data.items():
-                        if key not in ['available', 'used', 'total', 'models']:
-                            quota_text += f"- {key}: {value}\n"
-                    
-                    await bot.send_at_message(room_id or from_user_id, quota_text, [from_user_id])
-                else:
-                    error_msg = f"获取配额信息失败: {quota_result.get('error', '未知错误')}"
-                    logger.warning(error_msg)
-                    await bot.send_at_message(room_id or from_user_id, error_msg, [from_user_id])
-            except Exception as e:
-                logger.error(f"获取配额异常: {str(e)}")
-                await bot.send_at_message(room_id or from_user_id, f"获取配额时出错: {str(e)}", [from_user_id])
-            return False
-                
-        elif command == "help":
-            # 帮助信息
-            help_text = f"""ChargptAI 助手使用指南:
-
-1. 基本使用:
-   - 发送 "{self.trigger_keyword} 问题" 进行提问
-   - 注：本插件仅通过触发词唤醒，不响应@消息
-
-2. 图片生成:
-   - 发送 "{self.trigger_keyword} {self.image_command}[描述]" 生成图片
-   - 例如: {self.trigger_keyword} {self.image_command}一个动漫风格的机甲战士
-   - 指定比例: {self.trigger_keyword} {self.image_command}16:9 一个宽屏风景
-   - 可用比例: 1:1(方形)、16:9(宽屏)、9:16(竖屏)、4:3、3:4
-   - 支持使用 [{self.default_image_model}] 模型
-
-3. 模型选择:
-   - 默认使用: {self.default_model}
-   - 在消息中临时指定模型: {self.trigger_keyword} [模型名] 问题
-     例如: {self.trigger_keyword} [anthropic/claude-3.5-sonnet] 你好
-   - 更改默认模型: {self.trigger_keyword}_model 模型名
-     例如: {self.trigger_keyword}_model openai/gpt-4o
-
-4. 可用模型:
-   OpenAI模型:
-   - openai/gpt-4o - GPT-4o模型
-   - openai/gpt-4o-mini - GPT-4o mini模型
-   - openai/gpt-4o-image - 支持图像生成
-   - openai/o1 - o1模型
-   - openai/o3-mini - o3 mini模型
-   - openai/gpt-3.5-turbo - GPT-3.5模型
-   
-   Anthropic模型:
-   - anthropic/claude-3.5-sonnet - Claude 3.5
-   - anthropic/claude-3.7-sonnet - Claude 3.7
-   
-   Google模型:
-   - google/gemini-2.0-pro - Gemini 2.0 Pro
-   - google/gemini-2.0-flash - Gemini 2.0 Flash
-   
-   DeepSeek模型:
-   - deepseek/deepseek-r1 - DeepSeek R1 671B
-   - deepseek/deepseek-chat - DeepSeek V3
-   
-   X-AI模型:
-   - x-ai/grok-3 - Grok 3
-   
-   通义千问模型:
-   - qwen/qwq-32b - QwQ 32B
-   - qwen/qwen-max - Qwen Max
-
-5. 其他命令:
-   - {self.trigger_keyword}_clear: 清除当前会话历史
-   - {self.trigger_keyword}_quota: 查询API使用配额
-   - {self.trigger_keyword}_model: 查看/设置默认模型
-   - {self.trigger_keyword}_image: 查看/设置图片生成功能"""
-            await bot.send_at_message(room_id or from_user_id, help_text, [from_user_id])
-            return False
-        elif command == "image":
-            # 处理图片生成相关设置
-            if not args:
-                # 显示当前图片生成设置
-                image_text = f"图片生成功能设置:\n"
-                image_text += f"启用状态: {'已启用' if self.enable_image_generation else '已禁用'}\n"
-                image_text += f"默认模型: {self.default_image_model}\n"
-                image_text += f"生成命令前缀: {self.trigger_keyword} {self.image_command}...\n"
-                image_text += f"默认图片比例: {self.default_ratio}\n"
-                image_text += f"保存图片: {'是' if self.save_images else '否'}\n"
-                image_text += f"图片保存路径: {self.image_save_path}\n\n"
-                image_text += f"使用示例:\n"
-                image_text += f"{self.trigger_keyword} {self.image_command}一个动漫风格的机甲战士\n"
-                image_text += f"{self.trigger_keyword} {self.image_command}16:9 一个宽屏风景\n"
-                
-                await bot.send_at_message(room_id or from_user_id, image_text, [from_user_id])
-            else:
-                # 解析设置参数
-                arg_parts = args.split(" ", 1)
-                setting = arg_parts[0].lower()
-                value = arg_parts[1] if len(arg_parts) > 1 else ""
-                
-                if setting == "ratio" and value:
-                    # 设置默认图片比例
-                    if value in ["1:1", "16:9", "9:16", "4:3", "3:4"]:
-                        self.default_ratio = value
-                        await bot.send_at_message(room_id or from_user_id, f"默认图片比例已设置为: {value}", [from_user_id])
-                    else:
-                        await bot.send_at_message(room_id or from_user_id, f"不支持的比例设置，可用选项: 1:1, 16:9, 9:16, 4:3, 3:4", [from_user_id])
-                
-                elif setting == "enable":
-                    # 启用/禁用图片生成
-                    if value.lower() in ["true", "yes", "1", "on"]:
-                        self.enable_image_generation = True
-                        await bot.send_at_message(room_id or from_user_id, "图片生成功能已启用", [from_user_id])
-                    elif value.lower() in ["false", "no", "0", "off"]:
-                        self.enable_image_generation = False
-                        await bot.send_at_message(room_id or from_user_id, "图片生成功能已禁用", [from_user_id])
-                    else:
-                        await bot.send_at_message(room_id or from_user_id, f"无效的参数，请使用 true/false", [from_user_id])
-                
-                elif setting == "save":
-                    # 是否保存图片
-                    if value.lower() in ["true", "yes", "1", "on"]:
-                        self.save_images = True
-                        # 确保图片保存目录存在
-                        image_dir = os.path.join(os.path.dirname(__file__), self.image_save_path)
-                        if not os.path.exists(image_dir):
-                            try:
-                                os.makedirs(image_dir)
-                                logger.info(f"创建图片保存目录: {image_dir}")
-                            except Exception as e:
-                                logger.error(f"创建图片保存目录失败: {str(e)}")
-                                self.save_images = False
-                                await bot.send_at_message(room_id or from_user_id, f"无法创建图片保存目录，图片保存功能已禁用: {str(e)}", [from_user_id])
-                                return False
-                        await bot.send_at_message(room_id or from_user_id, f"图片保存功能已启用，保存路径: {image_dir}", [from_user_id])
-                    elif value.lower() in ["false", "no", "0", "off"]:
-                        self.save_images = False
-                        await bot.send_at_message(room_id or from_user_id, "图片保存功能已禁用", [from_user_id])
-                    else:
-                        await bot.send_at_message(room_id or from_user_id, f"无效的参数，请使用 true/false", [from_user_id])
-                        
-                elif setting == "model" and value:
-                    # 设置默认图片生成模型
-                    if "/" in value and "image" in value.lower():
-                        self.default_image_model = value
-                        await bot.send_at_message(room_id or from_user_id, f"默认图片生成模型已设置为: {value}", [from_user_id])
-                    else:
-                        await bot.send_at_message(room_id or from_user_id, f"无效的模型，请确保模型名包含提供商前缀和image关键词", [from_user_id])
-                
-                else:
-                    # 显示使用帮助
-                    help_text = "图片生成设置命令用法:\n"
-                    help_text += f"{self.trigger_keyword}_image - 显示当前设置\n"
-                    help_text += f"{self.trigger_keyword}_image ratio 1:1 - 设置默认图片比例\n"
-                    help_text += f"{self.trigger_keyword}_image enable true/false - 启用/禁用图片生成\n"
-                    help_text += f"{self.trigger_keyword}_image save true/false - 启用/禁用图片保存\n"
-                    help_text += f"{self.trigger_keyword}_image model openai/gpt-4o-image - 设置默认图片生成模型"
-                    await bot.send_at_message(room_id or from_user_id, help_text, [from_user_id])
-            
-            return False
-        else:
-            # 未知命令
-            await bot.send_at_message(room_id or from_user_id, f"未知命令: {command}，发送 {self.trigger_keyword}_help 查看帮助", [from_user_id])
-            return False 
\ No newline at end of file
+from loguru import logger
+import tomllib
+import os
+import asyncio
+import time
+import re
+from types import SimpleNamespace
+from typing import Any, AsyncGenerator, Dict, Iterable, List, Optional, Tuple
+import aiohttp
+
+from WechatAPI import WechatAPIClient
+from utils.decorators import *
+from utils.plugin_base import PluginBase
+from .api_client import ChargptAPIClient
+from .circuit_breaker import CircuitBreakerRegistry
+from .config_watcher import ConfigWatcher
+from .context_builder import ContextBuilder
+from .hedging import HedgedRequests
+from .image_downloader import ImageDownloader
+from .image_persistence import ImagePersistenceQueue
+from .image_store import ImageStore
+from .message_router import MessageRouter, ParsedMessage
+from .model_selector import ModelSelector
+from .quota_monitor import QuotaMonitor
+from .response_cache import ResponseCache
+from .scheduler import SchedulerRejected, UpstreamScheduler
+from .session_queue import SessionRequestQueue
+from .stream_delivery import StreamSegmenter, deliver_stream
+from .stream_timeouts import PHASES, PhaseTimeouts, TimeoutPolicy
+from .token_pool import TokenPool
+from .word_filter import SensitiveWordFilter
+
+# 热加载时需要重新构建的派生结构及其依赖的配置项
+DERIVED_SETTINGS = {
+    "word_filter": ("enable_filter", "sensitive_words", "replace_with"),
+    "router": ("trigger_keyword", "image_command", "allow_model_selection"),
+    "timeout_policy": ("timeout", "connect_timeout", "first_byte_timeout", "idle_timeout", "image_timeout",
+                       "image_connect_timeout", "image_first_byte_timeout", "image_idle_timeout", "model_timeouts"),
+    "model_selector": ("enable_routing", "routing_groups", "routing_alpha", "routing_error_penalty",
+                       "routing_explore"),
+    "context_builder": ("enable_context", "context_max_tokens", "context_model_tokens", "context_summary_tokens",
+                        "context_summary_line_chars")
+}
+
+# 热加载时校验的数值配置项的取值范围: 配置项 -> (最小值, 最大值)，None 表示不限制
+# 阶段超时小于等于0表示不限制；其余下限与启动时各组件对参数的要求一致
+NUMBER_RANGES = {
+    "timeout": (1, None),
+    "connect_timeout": (0, None),
+    "first_byte_timeout": (0, None),
+    "idle_timeout": (0, None),
+    "image_timeout": (0, None),
+    "image_connect_timeout": (0, None),
+    "image_first_byte_timeout": (0, None),
+    "image_idle_timeout": (0, None),
+    "queue_depth": (1, None),
+    "stream_first_chars": (1, None),
+    "stream_min_chars": (1, None),
+    "stream_max_chars": (1, None),
+    "stream_flush_interval": (0.1, None),
+    "compare_max_models": (1, None),
+    "compare_concurrency": (1, None),
+    "context_max_tokens": (1, None),
+    "context_summary_tokens": (0, None),
+    "context_summary_line_chars": (1, None),
+    "routing_alpha": (0.01, 1),
+    "routing_error_penalty": (0, None),
+    "routing_explore": (0, 1),
+    "min_balance": (None, None),
+    "chat_cost": (0, None),
+    "image_cost": (0, None),
+    "reload_interval": (0.1, None)
+}
+
+# 不需要重启就能生效的配置项，其余配置项（连接池、令牌、会话存储、缓存、调度并发数等）修改后需要重启插件
+RELOADABLE_SETTINGS = frozenset(
+    [key for keys in DERIVED_SETTINGS.values() for key in keys] + [
+        "respond_to_at", "allow_private_chat", "default_model", "prompt_template",
+        "enable_image_generation", "default_image_model", "default_ratio", "web_access", "timezone",
+        "filter_mode", "filter_output", "blocked_message",
+        "show_thinking", "queue_depth", "stream_delivery", "stream_first_chars", "stream_min_chars",
+        "stream_max_chars", "stream_flush_interval",
+        "compare_default_models", "compare_max_models", "compare_concurrency",
+        "min_balance", "downgrade_model", "quota_reject_message", "chat_cost", "image_cost",
+        "reload_interval"
+    ]
+)
+
+
+class ChargptChat(PluginBase):
+    description = "Chargpt.ai AI聊天插件"
+    author = "ChatGPT"
+    version = "1.0.0"
+
+    def __init__(self):
+        super().__init__()
+        
+        # 获取配置文件路径
+        config_path = os.path.join(os.path.dirname(__file__), "config.toml")
+        
+        try:
+            with open(config_path, "rb") as f:
+                config = tomllib.load(f)
+                
+            # 读取配置项，配置文件变化时同样通过 _read_config 重新读取
+            settings = self._read_config(config)
+            self._settings = dict(vars(settings))
+            
+            # 读取基本配置
+            self.enable = settings.enable
+            self.trigger_keyword = settings.trigger_keyword
+            self.respond_to_at = settings.respond_to_at
+            self.allow_private_chat = settings.allow_private_chat
+            
+            # 读取API配置
+            self.api_token = settings.api_token
+            self.api_tokens = settings.api_tokens
+            self.token_eject_seconds = settings.token_eject_seconds
+            self.quota_eject_seconds = settings.quota_eject_seconds
+            self.base_url = settings.base_url
+            self.client_version = settings.client_version
+            self.language = settings.language
+            self.pool_limit = settings.pool_limit
+            self.pool_limit_per_host = settings.pool_limit_per_host
+            self.keepalive_timeout = settings.keepalive_timeout
+            self.dns_cache_ttl = settings.dns_cache_ttl
+            
+            # 读取模型配置
+            self.default_model = settings.default_model
+            self.allow_model_selection = settings.allow_model_selection
+            self.prompt_template = settings.prompt_template
+            
+            # 读取模型自动选择配置
+            self.enable_routing = settings.enable_routing
+            self.routing_groups = settings.routing_groups
+            self.routing_alpha = settings.routing_alpha
+            self.routing_error_penalty = settings.routing_error_penalty
+            self.routing_explore = settings.routing_explore
+            
+            # 读取图片生成配置
+            self.enable_image_generation = settings.enable_image_generation
+            self.default_image_model = settings.default_image_model
+            self.image_command = settings.image_command
+            self.default_ratio = settings.default_ratio
+            self.image_save_path = settings.image_save_path
+            self.save_images = settings.save_images
+            self.web_access = settings.web_access
+            self.timezone = settings.timezone
+            self.max_image_mb = settings.max_image_mb
+            self.save_workers = settings.save_workers
+            self.save_queue_size = settings.save_queue_size
+            self.save_retries = settings.save_retries
+            self.save_backoff = settings.save_backoff
+            self.save_jobs_file = settings.save_jobs_file
+            self.max_disk_mb = settings.max_disk_mb
+            self.image_retention_days = settings.image_retention_days
+            self.image_timeout = settings.image_timeout
+            self.image_connect_timeout = settings.image_connect_timeout
+            self.image_first_byte_timeout = settings.image_first_byte_timeout
+            self.image_idle_timeout = settings.image_idle_timeout
+            
+            # 读取敏感词过滤配置
+            self.enable_filter = settings.enable_filter
+            self.filter_mode = settings.filter_mode
+            self.filter_output = settings.filter_output
+            self.replace_with = settings.replace_with
+            self.sensitive_words = settings.sensitive_words
+            self.blocked_message = settings.blocked_message
+            
+            # 读取聊天配置
+            self.max_history = settings.max_history
+            self.session_ttl = settings.session_ttl
+            self.max_sessions = settings.max_sessions
+            self.max_history_chars = settings.max_history_chars
+            self.persist_history = settings.persist_history
+            self.history_db = settings.history_db
+            self.history_retention_days = settings.history_retention_days
+            self.separate_context = settings.separate_context
+            self.timeout = settings.timeout
+            self.connect_timeout = settings.connect_timeout
+            self.first_byte_timeout = settings.first_byte_timeout
+            self.idle_timeout = settings.idle_timeout
+            self.stall_marker = settings.stall_marker
+            self.show_thinking = settings.show_thinking
+            self.queue_depth = settings.queue_depth
+            self.stream_delivery = settings.stream_delivery
+            self.stream_first_chars = settings.stream_first_chars
+            self.stream_min_chars = settings.stream_min_chars
+            self.stream_max_chars = settings.stream_max_chars
+            self.stream_flush_interval = settings.stream_flush_interval
+            
+            # 读取上下文组装配置
+            self.enable_context = settings.enable_context
+            self.context_max_tokens = settings.context_max_tokens
+            self.context_model_tokens = settings.context_model_tokens
+            self.context_summary_tokens = settings.context_summary_tokens
+            self.context_summary_line_chars = settings.context_summary_line_chars
+            
+            # 读取多模型对比配置
+            self.compare_default_models = settings.compare_default_models
+            self.compare_max_models = settings.compare_max_models
+            self.compare_concurrency = settings.compare_concurrency
+            
+            # 读取调度配置
+            self.max_concurrency = settings.max_concurrency
+            self.text_concurrency = settings.text_concurrency
+            self.image_concurrency = settings.image_concurrency
+            self.private_weight = settings.private_weight
+            
+            # 读取回复缓存配置
+            self.enable_cache = settings.enable_cache
+            self.cache_ttl = settings.cache_ttl
+            self.cache_max_entries = settings.cache_max_entries
+            self.cache_max_chars = settings.cache_max_chars
+            self.cache_ignore_history = settings.cache_ignore_history
+            
+            # 读取对冲请求配置
+            self.enable_hedge = settings.enable_hedge
+            self.hedge_quantile = settings.hedge_quantile
+            self.hedge_default_delay = settings.hedge_default_delay
+            self.hedge_min_delay = settings.hedge_min_delay
+            self.hedge_budget = settings.hedge_budget
+            self.hedge_min_samples = settings.hedge_min_samples
+            
+            # 读取配额配置
+            self.enable_quota_refresh = settings.enable_quota_refresh
+            self.quota_refresh_interval = settings.quota_refresh_interval
+            self.min_balance = settings.min_balance
+            self.downgrade_model = settings.downgrade_model
+            self.quota_reject_message = settings.quota_reject_message
+            self.chat_cost = settings.chat_cost
+            self.image_cost = settings.image_cost
+            
+            # 读取按模型覆盖的超时配置
+            self.model_timeouts = settings.model_timeouts
+            
+            # 读取熔断配置
+            self.enable_breaker = settings.enable_breaker
+            self.breaker_window = settings.breaker_window
+            self.breaker_min_requests = settings.breaker_min_requests
+            self.breaker_failure_rate = settings.breaker_failure_rate
+            self.breaker_open_seconds = settings.breaker_open_seconds
+            self.breaker_slow_call_seconds = settings.breaker_slow_call_seconds
+            self.breaker_half_open_probes = settings.breaker_half_open_probes
+            
+            # 读取配置热加载配置
+            self.enable_reload = settings.enable_reload
+            self.reload_interval = settings.reload_interval
+            
+            derived = self._build_derived(settings)
+            self.word_filter = derived["word_filter"]
+            
+            # 会话历史数据库路径（相对于插件目录）
+            history_db_path = None
+            if self.persist_history:
+                history_db_path = os.path.join(os.path.dirname(__file__), self.history_db)
+            
+            # 回复缓存，相同问题共享同一个上游请求
+            response_cache = None
+            if self.enable_cache:
+                response_cache = ResponseCache(
+                    ttl=self.cache_ttl,
+                    max_entries=self.cache_max_entries,
+                    max_chars=self.cache_max_chars
+                )
+            
+            # 按端点和模型的熔断器，上游持续出错时直接返回提示
+            circuit_breakers = CircuitBreakerRegistry(
+                enabled=self.enable_breaker,
+                window=self.breaker_window,
+                min_requests=self.breaker_min_requests,
+                failure_rate=self.breaker_failure_rate,
+                open_seconds=self.breaker_open_seconds,
+                slow_call_seconds=self.breaker_slow_call_seconds,
+                half_open_probes=self.breaker_half_open_probes
+            )
+            
+            # 对冲请求，首字节迟迟不到时再发一个相同的请求，先返回的胜出；对冲请求同样占用调度器的文本通道槽位
+            hedging = None
+            if self.enable_hedge:
+                hedging = HedgedRequests(
+                    quantile=self.hedge_quantile,
+                    default_delay=self.hedge_default_delay,
+                    min_delay=self.hedge_min_delay,
+                    budget=self.hedge_budget,
+                    min_samples=self.hedge_min_samples,
+                    try_acquire=lambda: self.scheduler.try_acquire("text"),
+                    release=lambda: self.scheduler.release("text")
+                )
+            
+            # 账号池：api_tokens 中的令牌和 api_token 一起按负载和余额分配
+            token_pool = TokenPool(
+                [self.api_token] + list(self.api_tokens),
+                pool_limit_per_host=self.pool_limit_per_host,
+                eject_seconds=self.token_eject_seconds,
+                quota_eject_seconds=self.quota_eject_seconds,
+                costs={"chat": self.chat_cost, "image": self.image_cost}
+            )
+            
+            # 初始化API客户端
+            self.api_client = ChargptAPIClient(
+                api_token=self.api_token,
+                base_url=self.base_url,
+                client_version=self.client_version,
+                language=self.language,
+                default_model=self.default_model,
+                prompt_template=self.prompt_template,
+                pool_limit=self.pool_limit,
+                pool_limit_per_host=self.pool_limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                dns_cache_ttl=self.dns_cache_ttl,
+                max_history=self.max_history,
+                session_ttl=self.session_ttl,
+                max_sessions=self.max_sessions,
+                max_history_chars=self.max_history_chars,
+                history_db=history_db_path,
+                history_retention_days=self.history_retention_days,
+                response_cache=response_cache,
+                cache_ignore_history=self.cache_ignore_history,
+                circuit_breakers=circuit_breakers,
+                timeout_policy=derived["timeout_policy"],
+                stall_marker=self.stall_marker,
+                hedging=hedging,
+                token_pool=token_pool,
+                model_selector=derived["model_selector"],
+                context_builder=derived["context_builder"]
+            )
+            
+            # 配额监控，后台定时刷新配额快照，余额不足时在本地拒绝或降级请求
+            self.quota_monitor = None
+            if self.enable_quota_refresh:
+                self.quota_monitor = QuotaMonitor(
+                    self.api_client,
+                    interval=self.quota_refresh_interval,
+                    min_balance=self.min_balance,
+                    downgrade_model=self.downgrade_model,
+                    reject_message=self.quota_reject_message
+                )
+            
+            # 全局上游请求调度器，排队超过超时时间的请求会被提前拒绝
+            self.scheduler = UpstreamScheduler(
+                max_concurrency=self.max_concurrency,
+                lane_limits={"text": self.text_concurrency, "image": self.image_concurrency},
+                max_wait=self.timeout,
+                private_weight=self.private_weight
+            )
+            
+            # 图片下载器，流式写入磁盘
+            self.image_downloader = ImageDownloader(max_bytes=int(self.max_image_mb * 1024 * 1024))
+            
+            # 按内容寻址的图片存储，超过磁盘配额时淘汰最久未访问的图片
+            self.image_store = ImageStore(
+                os.path.join(os.path.dirname(__file__), self.image_save_path),
+                self.image_downloader,
+                max_bytes=int(self.max_disk_mb * 1024 * 1024),
+                max_age_days=self.image_retention_days
+            )
+            
+            # 后台图片保存队列，未完成的任务记录在任务文件中（相对于插件目录）
+            self.image_saver = ImagePersistenceQueue(
+                self.image_store,
+                self.api_client.get_session,
+                jobs_file=os.path.join(os.path.dirname(__file__), self.save_jobs_file),
+                workers=self.save_workers,
+                max_pending=self.save_queue_size,
+                max_retries=self.save_retries,
+                backoff=self.save_backoff
+            )
+            
+            # 消息解析器和命令表
+            self.router = derived["router"]
+            self._commands = {
+                "clear": self._command_clear,
+                "model": self._command_model,
+                "quota": self._command_quota,
+                "stats": self._command_stats,
+                "help": self._command_help,
+                "image": self._command_image,
+                "compare": self._command_compare
+            }
+            
+            # 按会话排队处理请求，同一会话同一时间只处理一个请求
+            self.request_queue = SessionRequestQueue(self._process_request, max_depth=self.queue_depth)
+            
+            # 配置热加载，轮询配置文件的修改时间，变化时校验并替换可以热加载的配置
+            self.config_watcher = None
+            if self.enable_reload:
+                self.config_watcher = ConfigWatcher(config_path, self._reload_config, interval=self.reload_interval)
+            
+            # 确保图片保存目录存在
+            if self.save_images:
+                image_dir = os.path.join(os.path.dirname(__file__), self.image_save_path)
+                if not os.path.exists(image_dir):
+                    try:
+                        os.makedirs(image_dir)
+                        logger.info(f"创建图片保存目录: {image_dir}")
+                    except Exception as e:
+                        logger.error(f"创建图片保存目录失败: {str(e)}")
+                        self.save_images = False
+            
+        except Exception as e:
+            logger.error(f"加载ChargptChat配置文件失败: {str(e)}")
+            self.enable = False
+
+    async def async_init(self):
+        # 创建共享的HTTP连接池
+        if self.enable:
+            await self.api_client.start()
+            # 保存队列会恢复上次未完成的任务，只在图片存储打开后启动
+            if self.save_images:
+                await self.image_store.open()
+                await self.image_saver.start()
+            if self.config_watcher is not None:
+                await self.config_watcher.start()
+            
+        # 检查所有令牌的配额，确认API可用；开启后台刷新时由配额监控定时更新快照
+        if self.enable and (self.api_token or self.api_tokens):
+            try:
+                if self.quota_monitor is not None:
+                    await self.quota_monitor.start()
+                    results, _ = self.quota_monitor.snapshot()
+                else:
+                    results = await self.api_client.get_all_quotas()
+                for token, quota_result in results:
+                    if quota_result["success"]:
+                        logger.info(f"ChargptChat API连接成功，令牌 {token.label}")
+                    else:
+                        logger.warning(f"ChargptChat API配额检查失败，令牌 {token.label}: {quota_result.get('error', '未知错误')}")
+            except Exception as e:
+                logger.error(f"ChargptChat API初始化异常: {str(e)}")
+                
+    async def on_disable(self):
+        """插件卸载时关闭共享的HTTP连接池并保存会话历史"""
+        await super().on_disable()
+        try:
+            if self.config_watcher is not None:
+                await self.config_watcher.close()
+            await self.request_queue.close()
+            if self.quota_monitor is not None:
+                await self.quota_monitor.close()
+            await self.image_saver.close()
+            await self.image_store.close()
+            await self.api_client.close()
+            await self.image_downloader.close()
+        except Exception as e:
+            logger.warning(f"关闭ChargptChat连接池异常: {str(e)}")
+                
+    @staticmethod
+    def _read_config(config: dict) -> SimpleNamespace:
+        """读取配置文件中的设置，只读取不创建组件，热加载时在后台线程中调用"""
+        settings = SimpleNamespace()
+        
+        # 读取基本配置
+        basic_config = config.get("basic", {})
+        settings.enable = basic_config.get("enable", False)
+        settings.trigger_keyword = basic_config.get("trigger_keyword", "ai")
+        settings.respond_to_at = basic_config.get("respond_to_at", True)
+        settings.allow_private_chat = basic_config.get("allow_private_chat", True)
+        
+        # 读取API配置
+        api_config = config.get("api", {})
+        settings.api_token = api_config.get("api_token", "")
+        settings.api_tokens = api_config.get("api_tokens", [])
+        settings.token_eject_seconds = api_config.get("token_eject_seconds", 60)
+        settings.quota_eject_seconds = api_config.get("quota_eject_seconds", 600)
+        settings.base_url = api_config.get("base_url", "https://api.chargpt.ai")
+        settings.client_version = api_config.get("client_version", "1.1.76")
+        settings.language = api_config.get("language", "zh-CN")
+        settings.pool_limit = api_config.get("pool_limit", 100)
+        settings.pool_limit_per_host = api_config.get("pool_limit_per_host", 20)
+        settings.keepalive_timeout = api_config.get("keepalive_timeout", 30)
+        settings.dns_cache_ttl = api_config.get("dns_cache_ttl", 300)
+        
+        # 读取模型配置
+        model_config = config.get("model", {})
+        settings.default_model = model_config.get("default_model", "openai/gpt-4o")
+        settings.allow_model_selection = model_config.get("allow_model_selection", False)
+        settings.prompt_template = model_config.get("prompt_template", "{message}")
+        
+        # 读取模型自动选择配置
+        routing_config = config.get("routing", {})
+        settings.enable_routing = routing_config.get("enable", False)
+        settings.routing_groups = routing_config.get("groups", [])
+        settings.routing_alpha = routing_config.get("alpha", 0.3)
+        settings.routing_error_penalty = routing_config.get("error_penalty", 4.0)
+        settings.routing_explore = routing_config.get("explore", 0.05)
+        
+        # 读取图片生成配置
+        image_config = config.get("image", {})
+        settings.enable_image_generation = image_config.get("enable_image_generation", True)
+        settings.default_image_model = image_config.get("default_image_model", "openai/gpt-4o-image")
+        settings.image_command = image_config.get("image_command", "画")
+        settings.default_ratio = image_config.get("default_ratio", "1:1")
+        settings.image_save_path = image_config.get("image_save_path", "images")
+        settings.save_images = image_config.get("save_images", True)
+        settings.web_access = image_config.get("web_access", "close")
+        settings.timezone = image_config.get("timezone", "Asia/Shanghai")
+        settings.max_image_mb = image_config.get("max_image_mb", 20)
+        settings.save_workers = image_config.get("save_workers", 2)
+        settings.save_queue_size = image_config.get("save_queue_size", 100)
+        settings.save_retries = image_config.get("save_retries", 3)
+        settings.save_backoff = image_config.get("save_backoff", 2.0)
+        settings.save_jobs_file = image_config.get("save_jobs_file", "data/image_jobs.json")
+        settings.max_disk_mb = image_config.get("max_disk_mb", 1024)
+        settings.image_retention_days = image_config.get("image_retention_days", 0)
+        settings.image_timeout = image_config.get("timeout", 180)
+        settings.image_connect_timeout = image_config.get("connect_timeout", 10)
+        settings.image_first_byte_timeout = image_config.get("first_byte_timeout", 120)
+        settings.image_idle_timeout = image_config.get("idle_timeout", 60)
+        
+        # 读取敏感词过滤配置
+        filter_config = config.get("filter", {})
+        settings.enable_filter = filter_config.get("enable_filter", True)
+        settings.filter_mode = filter_config.get("mode", "block")
+        settings.filter_output = filter_config.get("filter_output", True)
+        settings.replace_with = filter_config.get("replace_with", "***")
+        settings.sensitive_words = filter_config.get("sensitive_words", [])
+        settings.blocked_message = filter_config.get("blocked_message", "抱歉，您的消息包含敏感内容，已被拦截。请遵守社区规则和法律法规。")
+        
+        # 读取聊天配置
+        chat_config = config.get("chat", {})
+        settings.max_history = chat_config.get("max_history", 10)
+        settings.session_ttl = chat_config.get("session_ttl", 86400)
+        settings.max_sessions = chat_config.get("max_sessions", 1000)
+        settings.max_history_chars = chat_config.get("max_history_chars", 5000000)
+        settings.persist_history = chat_config.get("persist_history", False)
+        settings.history_db = chat_config.get("history_db", "data/conversations.db")
+        settings.history_retention_days = chat_config.get("history_retention_days", 30)
+        settings.separate_context = chat_config.get("separate_context", True)
+        settings.timeout = chat_config.get("timeout", 60)
+        settings.connect_timeout = chat_config.get("connect_timeout", 10)
+        settings.first_byte_timeout = chat_config.get("first_byte_timeout", 30)
+        settings.idle_timeout = chat_config.get("idle_timeout", 20)
+        settings.stall_marker = chat_config.get("stall_marker", "\n\n（回复超时中断，以上为部分内容）")
+        settings.show_thinking = chat_config.get("show_thinking", True)
+        settings.queue_depth = chat_config.get("queue_depth", 5)
+        settings.stream_delivery = chat_config.get("stream_delivery", False)
+        settings.stream_first_chars = chat_config.get("stream_first_chars", 20)
+        settings.stream_min_chars = chat_config.get("stream_min_chars", 200)
+        settings.stream_max_chars = chat_config.get("stream_max_chars", 1500)
+        settings.stream_flush_interval = chat_config.get("stream_flush_interval", 2.0)
+        
+        # 读取上下文组装配置
+        context_config = config.get("context", {})
+        settings.enable_context = context_config.get("enable", False)
+        settings.context_max_tokens = context_config.get("max_tokens", 3000)
+        settings.context_model_tokens = context_config.get("model_tokens", {})
+        settings.context_summary_tokens = context_config.get("summary_tokens", 300)
+        settings.context_summary_line_chars = context_config.get("summary_line_chars", 80)
+        
+        # 读取多模型对比配置
+        compare_config = config.get("compare", {})
+        settings.compare_default_models = compare_config.get("default_models", [])
+        settings.compare_max_models = compare_config.get("max_models", 5)
+        settings.compare_concurrency = compare_config.get("concurrency", 3)
+        
+        # 读取调度配置
+        scheduler_config = config.get("scheduler", {})
+        settings.max_concurrency = scheduler_config.get("max_concurrency", 16)
+        settings.text_concurrency = scheduler_config.get("text_concurrency", 12)
+        settings.image_concurrency = scheduler_config.get("image_concurrency", 4)
+        settings.private_weight = scheduler_config.get("private_weight", 1.0)
+        
+        # 读取回复缓存配置
+        cache_config = config.get("cache", {})
+        settings.enable_cache = cache_config.get("enable", False)
+        settings.cache_ttl = cache_config.get("ttl", 300)
+        settings.cache_max_entries = cache_config.get("max_entries", 500)
+        settings.cache_max_chars = cache_config.get("max_chars", 2000000)
+        settings.cache_ignore_history = cache_config.get("ignore_history", False)
+        
+        # 读取对冲请求配置
+        hedge_config = config.get("hedge", {})
+        settings.enable_hedge = hedge_config.get("enable", False)
+        settings.hedge_quantile = hedge_config.get("quantile", 0.9)
+        settings.hedge_default_delay = hedge_config.get("default_delay", 5.0)
+        settings.hedge_min_delay = hedge_config.get("min_delay", 1.0)
+        settings.hedge_budget = hedge_config.get("budget", 0.05)
+        settings.hedge_min_samples = hedge_config.get("min_samples", 20)
+        
+        # 读取配额配置
+        quota_config = config.get("quota", {})
+        settings.enable_quota_refresh = quota_config.get("enable_refresh", True)
+        settings.quota_refresh_interval = quota_config.get("refresh_interval", 300)
+        settings.min_balance = quota_config.get("min_balance", 0)
+        settings.downgrade_model = quota_config.get("downgrade_model", "")
+        settings.quota_reject_message = quota_config.get("reject_message", "AI服务余额不足，请稍后再试或联系管理员。")
+        settings.chat_cost = quota_config.get("chat_cost", 1)
+        settings.image_cost = quota_config.get("image_cost", 1)
+        
+        # 读取按模型覆盖的超时配置
+        settings.model_timeouts = config.get("model_timeouts", {})
+        
+        # 读取熔断配置
+        breaker_config = config.get("breaker", {})
+        settings.enable_breaker = breaker_config.get("enable", True)
+        settings.breaker_window = breaker_config.get("window", 60)
+        settings.breaker_min_requests = breaker_config.get("min_requests", 5)
+        settings.breaker_failure_rate = breaker_config.get("failure_rate", 0.5)
+        settings.breaker_open_seconds = breaker_config.get("open_seconds", 30)
+        settings.breaker_slow_call_seconds = breaker_config.get("slow_call_seconds", 30)
+        settings.breaker_half_open_probes = breaker_config.get("half_open_probes", 1)
+        
+        # 读取配置热加载配置
+        reload_config = config.get("reload", {})
+        settings.enable_reload = reload_config.get("enable", True)
+        settings.reload_interval = reload_config.get("interval", 5)
+        return settings
+
+    @staticmethod
+    def _build_derived(settings: SimpleNamespace, names: Iterable[str] = tuple(DERIVED_SETTINGS)) -> Dict[str, Any]:
+        """按配置构建派生结构，热加载时在后台线程中只重建依赖的配置项有变化的结构
+        
+        Args:
+            settings: _read_config 读取的配置
+            names: 需要构建的结构，为 DERIVED_SETTINGS 中的键
+            
+        Returns:
+            Dict[str, Any]: 结构名到新对象的映射，未启用的功能为None
+        """
+        derived = {}
+        
+        # 敏感词自动机只在加载配置时构建一次
+        if "word_filter" in names:
+            word_filter = None
+            if settings.enable_filter and settings.sensitive_words:
+                word_filter = SensitiveWordFilter(settings.sensitive_words, settings.replace_with)
+                logger.debug(f"已加载{word_filter.word_count}个敏感词，过滤模式: {settings.filter_mode}")
+            derived["word_filter"] = word_filter
+        
+        # 消息解析器
+        if "router" in names:
+            derived["router"] = MessageRouter(
+                settings.trigger_keyword, settings.image_command, settings.allow_model_selection)
+        
+        # 分阶段超时：连接、首个数据块、数据块之间的停顿和总时长
+        if "timeout_policy" in names:
+            derived["timeout_policy"] = TimeoutPolicy(
+                {
+                    "chat": PhaseTimeouts(
+                        connect=settings.connect_timeout,
+                        first_byte=settings.first_byte_timeout,
+                        idle=settings.idle_timeout,
+                        total=settings.timeout
+                    ),
+                    "image": PhaseTimeouts(
+                        connect=settings.image_connect_timeout,
+                        first_byte=settings.image_first_byte_timeout,
+                        idle=settings.image_idle_timeout,
+                        total=settings.image_timeout
+                    )
+                },
+                settings.model_timeouts
+            )
+        
+        # 模型自动选择，未指定模型的请求在默认模型的等价组内按延迟选择
+        if "model_selector" in names:
+            model_selector = None
+            if settings.enable_routing and settings.routing_groups:
+                model_selector = ModelSelector(
+                    settings.routing_groups,
+                    alpha=settings.routing_alpha,
+                    error_penalty=settings.routing_error_penalty,
+                    explore=settings.routing_explore
+                )
+            derived["model_selector"] = model_selector
+        
+        # 上下文组装，按模型的token预算把会话历史带进提示词，更早的对话压缩为摘要
+        if "context_builder" in names:
+            context_builder = None
+            if settings.enable_context:
+                context_builder = ContextBuilder(
+                    max_tokens=settings.context_max_tokens,
+                    model_tokens=settings.context_model_tokens,
+                    summary_tokens=settings.context_summary_tokens,
+                    summary_line_chars=settings.context_summary_line_chars
+                )
+            derived["context_builder"] = context_builder
+        return derived
+
+    @staticmethod
+    def _validate_settings(settings: SimpleNamespace) -> List[str]:
+        """校验可以热加载的配置项的类型和取值
+        
+        Returns:
+            List[str]: 错误描述，为空表示配置有效
+        """
+        errors = []
+        for name in ("trigger_keyword", "default_model", "default_image_model"):
+            value = getattr(settings, name)
+            if not isinstance(value, str) or not value.strip():
+                errors.append(f"{name} 必须是非空字符串")
+        if isinstance(settings.trigger_keyword, str) and any(c.isspace() for c in settings.trigger_keyword):
+            errors.append("trigger_keyword 不能包含空白字符")
+        for name in ("image_command", "prompt_template", "replace_with", "blocked_message", "downgrade_model",
+                     "quota_reject_message", "default_ratio", "web_access", "timezone"):
+            if not isinstance(getattr(settings, name), str):
+                errors.append(f"{name} 必须是字符串")
+        for name, (low, high) in NUMBER_RANGES.items():
+            value = getattr(settings, name)
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                errors.append(f"{name} 必须是数字")
+            elif (low is not None and value < low) or (high is not None and value > high):
+                bounds = "，".join(text for text in (
+                    f"不能小于{low}" if low is not None else "", f"不能大于{high}" if high is not None else "") if text)
+                errors.append(f"{name} {bounds}")
+        if (isinstance(settings.stream_min_chars, int) and isinstance(settings.stream_max_chars, int)
+                and settings.stream_max_chars < settings.stream_min_chars):
+            errors.append("stream_max_chars 不能小于 stream_min_chars")
+        if settings.filter_mode not in ("block", "replace"):
+            errors.append("filter.mode 必须是 block 或 replace")
+        for name in ("sensitive_words", "compare_default_models"):
+            value = getattr(settings, name)
+            if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+                errors.append(f"{name} 必须是字符串列表")
+        groups = settings.routing_groups
+        if not isinstance(groups, list) or not all(
+                isinstance(group, list) and all(isinstance(model, str) for model in group) for group in groups):
+            errors.append("routing.groups 必须是模型名列表的列表")
+        timeouts = settings.model_timeouts
+        if not isinstance(timeouts, dict) or not all(
+                isinstance(overrides, dict) and all(
+                    phase in PHASES and isinstance(value, (int, float)) and value >= 0
+                    for phase, value in overrides.items())
+                for overrides in timeouts.values()):
+            errors.append(f"model_timeouts 中每个模型只能设置 {'/'.join(PHASES)} 的秒数")
+        tokens = settings.context_model_tokens
+        if not isinstance(tokens, dict) or not all(isinstance(value, int) and value > 0 for value in tokens.values()):
+            errors.append("context.model_tokens 必须是模型名到token数的映射")
+        if isinstance(settings.prompt_template, str):
+            try:
+                settings.prompt_template.format(message="", context="")
+            except (KeyError, IndexError, ValueError) as e:
+                errors.append(f"prompt_template 格式错误: {str(e)}")
+        return errors
+
+    async def _reload_config(self, config: dict):
+        """配置文件变化时由配置监视器调用：读取、校验新配置并在后台线程构建派生结构，再一次性替换
+        
+        替换只是属性赋值，中间没有await，对其他协程是原子的。正在处理的请求已经取得旧的
+        过滤器、超时策略、模型选择器等对象，会按旧配置完成；之后的请求使用新配置。
+        只替换文件中有变化的配置项，通过命令临时修改的默认模型等不会被未改动的配置覆盖。
+        """
+        settings = await asyncio.to_thread(self._read_config, config)
+        errors = self._validate_settings(settings)
+        if errors:
+            raise ValueError("；".join(errors))
+        
+        values = vars(settings)
+        changed = {name for name, value in values.items() if value != self._settings.get(name)}
+        restart = sorted(changed.difference(RELOADABLE_SETTINGS))
+        if restart:
+            logger.warning(f"以下配置需要重启插件才能生效: {', '.join(restart)}")
+            # 记下已经提示过的值，之后的重新加载不再重复提示
+            for name in restart:
+                self._settings[name] = values[name]
+        changed.intersection_update(RELOADABLE_SETTINGS)
+        if not changed:
+            return
+        
+        rebuild = [name for name, keys in DERIVED_SETTINGS.items() if changed.intersection(keys)]
+        derived = await asyncio.to_thread(self._build_derived, settings, rebuild)
+        
+        # 以下为原子替换
+        for name in changed:
+            setattr(self, name, values[name])
+            self._settings[name] = values[name]
+        if "word_filter" in derived:
+            self.word_filter = derived["word_filter"]
+        if "router" in derived:
+            self.router = derived["router"]
+        client = self.api_client
+        if "timeout_policy" in derived:
+            client.timeout_policy = derived["timeout_policy"]
+        if "model_selector" in derived:
+            model_selector = derived["model_selector"]
+            if model_selector is not None and client.model_selector is not None:
+                model_selector.inherit(client.model_selector)
+            client.model_selector = model_selector
+        if "context_builder" in derived:
+            context_builder = derived["context_builder"]
+            client.context_builder = context_builder
+            client.conversations.summarizer = context_builder.summarize if context_builder is not None else None
+        if "default_model" in changed:
+            client.set_default_model(self.default_model)
+        client.prompt_template = self.prompt_template
+        client.token_pool.costs = {"chat": self.chat_cost, "image": self.image_cost}
+        self.scheduler.max_wait = self.timeout
+        self.request_queue.max_depth = max(0, self.queue_depth)
+        if self.quota_monitor is not None:
+            self.quota_monitor.min_balance = self.min_balance
+            self.quota_monitor.downgrade_model = self.downgrade_model
+            self.quota_monitor.reject_message = self.quota_reject_message
+        if "reload_interval" in changed and self.config_watcher is not None:
+            self.config_watcher.interval = max(0.1, self.reload_interval)
+        logger.info(f"配置已重新加载: {', '.join(sorted(changed))}")
+
+    @on_text_message(priority=70)  # 设置较高优先级，保证能在一般插件之前执行
+    async def handle_text(self, bot: WechatAPIClient, message: dict):
+        """处理文本消息：对话、图片生成和插件命令"""
+        if not self.enable:
+            return True
+            
+        # 不含触发词的消息在一次前缀比较后直接放行
+        parsed = self.router.parse_text(message)
+        if parsed is None:
+            return True
+            
+        logger.debug(f"ChargptChat收到消息: {message}")
+        
+        if parsed.kind == ParsedMessage.COMMAND:
+            return await self.handle_command(bot, parsed)
+            
+        # 检查是否是私聊消息且是否允许私聊
+        if not parsed.room_id and not self.allow_private_chat:
+            return True
+            
+        logger.info(f"ChargptChat处理消息: {parsed.content}")
+        
+        if parsed.kind == ParsedMessage.EMPTY:
+            # 如果只有触发词没有内容，发送帮助信息
+            await bot.send_at_message(parsed.target, "我是ChargptAI助手，请在触发词后面输入您的问题。", [parsed.from_user_id])
+            return False  # 已经处理完成，阻止其他插件执行
+            
+        await self._submit_parsed(bot, parsed)
+        return False  # 已经处理完成，阻止其他插件执行
+
+    @on_at_message(priority=70)
+    async def handle_at(self, bot: WechatAPIClient, message: dict):
+        """处理@消息"""
+        if not self.enable or not self.respond_to_at:
+            return True
+            
+        # 必须在群聊中
+        room_id = message.get("room_id", message.get("FromWxid", ""))
+        if not room_id:
+            return True
+            
+        # 添加调试日志
+        logger.debug(f"ChargptChat收到@消息: {message}")
+        
+        parsed = self.router.parse_at(message)
+            
+        # 如果内容为空，发送提示
+        if parsed.kind == ParsedMessage.EMPTY:
+            await bot.send_at_message(room_id, "请问有什么可以帮助您的？", [parsed.from_user_id])
+            return False  # 已经处理，阻止其他插件执行
+            
+        logger.info(f"ChargptChat处理@消息: {parsed.content}")
+        await self._submit_parsed(bot, parsed)
+        return False  # 已经处理，阻止其他插件执行
+
+    async def _block_sensitive(self, bot: WechatAPIClient, target: str, from_user_id: str, text: str) -> bool:
+        """拦截模式下检查消息是否包含敏感词，包含时发送拦截提示
+        
+        Returns:
+            bool: 消息是否被拦截
+        """
+        if self.word_filter is None or self.filter_mode != "block":
+            return False
+        word = self.word_filter.find(text)
+        if word is None:
+            return False
+        logger.warning(f"检测到敏感词: {word}, 消息: {text}")
+        await bot.send_at_message(target, self.blocked_message, [from_user_id])
+        return True
+
+    async def _submit_parsed(self, bot: WechatAPIClient, parsed: ParsedMessage):
+        """检查敏感词后将解析好的对话或图片请求加入会话队列"""
+        # 检查是否包含敏感词（替换模式下在提交请求时替换，不拦截）
+        if await self._block_sensitive(bot, parsed.target, parsed.from_user_id, parsed.query):
+            return
+            
+        if parsed.model:
+            logger.info(f"用户指定使用模型: {parsed.model}")
+            
+        # 图片生成请求，未指定比例时使用默认比例
+        image_prompt = None
+        ratio = None
+        if parsed.image_prompt is not None and self.enable_image_generation:
+            image_prompt = parsed.image_prompt
+            ratio = parsed.ratio or self.default_ratio
+            logger.info(f"检测到图片生成请求: {image_prompt}, 比例: {ratio}")
+            
+        # 余额低于阈值时在本地拒绝或降级，不再请求上游
+        # 未指定模型时按默认模型检查，但请求中仍不写入模型，以便按模型自动选择；只有降级时才写入降级后的模型
+        model = parsed.model
+        if self.quota_monitor is not None:
+            if image_prompt is not None:
+                requested = model or self.default_image_model
+                checked, error = self.quota_monitor.preflight("image", requested)
+            else:
+                requested = model or self.api_client.default_model
+                checked, error = self.quota_monitor.preflight("chat", requested)
+            if error is not None:
+                await bot.send_at_message(parsed.target, error, [parsed.from_user_id])
+                return
+            if checked != requested:
+                model = checked
+            
+        # 获取会话ID
+        session_id = parsed.room_id if parsed.room_id and self.separate_context else parsed.from_user_id
+        
+        # 加入会话请求队列
+        request = {
+            "room_id": parsed.room_id,
+            "from_user_id": parsed.from_user_id,
+            "query": parsed.query,
+            "model": model,
+            "image_prompt": image_prompt,
+            "ratio": ratio,
+            "compare_models": None
+        }
+        await self._submit_request(bot, session_id, request)
+
+    async def _submit_request(self, bot: WechatAPIClient, session_id: str, request: dict):
+        """将请求加入会话队列，并告知用户排队情况"""
+        room_id = request["room_id"]
+        from_user_id = request["from_user_id"]
+        target = room_id or from_user_id
+        
+        # 替换模式下将敏感词替换后再发送给AI
+        if self.word_filter is not None and self.filter_mode == "replace":
+            request["query"] = self.word_filter.replace(request["query"])
+            if request["image_prompt"] is not None:
+                request["image_prompt"] = self.word_filter.replace(request["image_prompt"])
+        
+        # 相同模型下内容相同的问题视为重复请求
+        if request["image_prompt"] is not None:
+            kind, text, model = "image", request["image_prompt"], request["model"] or ""
+        elif request["compare_models"]:
+            kind, text, model = "compare", request["query"], ",".join(request["compare_models"])
+        else:
+            kind, text, model = "chat", request["query"], request["model"] or ""
+        key = f"{kind}|{model}|{' '.join(text.split()).lower()}"
+        
+        status, position = self.request_queue.submit(session_id, key, from_user_id, (bot, request))
+        if status == SessionRequestQueue.QUEUED:
+            await bot.send_at_message(target, f"我正在思考上一个问题，您的问题已排队（第{position}位），请稍候...", [from_user_id])
+        elif status == SessionRequestQueue.MERGED:
+            await bot.send_at_message(target, "相同的问题正在处理中，稍后将一并回复您。", [from_user_id])
+        elif status == SessionRequestQueue.FULL:
+            await bot.send_at_message(target, f"当前排队的问题过多（最多{self.queue_depth}个），请稍后再试。", [from_user_id])
+
+    async def _process_request(self, session_id: str, payload: tuple, users: List[str]):
+        """处理队列中的一个请求（文本对话、图片生成或多模型对比）
+        
+        Args:
+            session_id: 会话ID
+            payload: (bot, 请求内容)
+            users: 需要@的用户列表（包含合并的重复请求）
+        """
+        bot, request = payload
+        target = request["room_id"] or request["from_user_id"]
+        # 开始处理时取得过滤器，处理过程中配置重新加载也按原来的过滤器完成
+        output_filter = self.word_filter if self.filter_output else None
+        
+        try:
+            # 如果开启思考提示，先发送思考中的消息
+            thinking_message_id = None
+            if self.show_thinking:
+                try:
+                    thinking_result = await bot.send_at_message(target, "思考中...", users)
+                    # 检查返回值类型并适当处理
+                    if isinstance(thinking_result, tuple) and len(thinking_result) > 0:
+                        thinking_message_id = thinking_result[0]  # 假设第一个元素是消息ID
+                    elif isinstance(thinking_result, dict) and thinking_result.get("status") == "success":
+                        thinking_message_id = thinking_result.get("data", {}).get("message_id")
+                    logger.debug(f"思考消息ID: {thinking_message_id}, 返回值类型: {type(thinking_result)}")
+                except Exception as e:
+                    logger.warning(f"发送思考消息异常: {str(e)}")
+            
+            # 根据请求类型处理响应
+            response_text = ""
+            streamed_segments = 0
+            image_prompt = request["image_prompt"]
+            
+            if request["compare_models"]:
+                # 多模型对比，各模型的回复分别发送
+                await self._compare_reply(bot, session_id, target, users, request, thinking_message_id,
+                                          output_filter)
+                return
+            
+            if image_prompt is not None:
+                # 处理图片生成请求
+                ratio = request["ratio"]
+                
+                logger.debug(f"开始处理图片生成请求，提示词: {image_prompt}, 比例: {ratio}")
+                
+                # 获取并发送进度更新
+                progress_updates = []
+                image_url = None
+                
+                async with self.scheduler.slot("image", session_id, private=not request["room_id"]):
+                    async for chunk in self.api_client.generate_image(
+                        session_id, 
+                        image_prompt, 
+                        model=request["model"] or self.default_image_model,
+                        ratio=ratio,
+                        web_access=self.web_access,
+                        timezone=self.timezone
+                    ):
+                        # 累积进度更新，但不直接发送每个小更新
+                        if "进度" in chunk or "%" in chunk:
+                            progress_updates.append(chunk)
+                            # 每接收到3个进度更新，或进度达到100%，发送一次更新
+                            if len(progress_updates) >= 3 or "100%" in chunk or "生成完成" in chunk:
+                                update_text = "图片生成中...\n" + "\n".join(progress_updates[-3:])
+                                # 尝试更新思考消息，如果不行则发送新消息
+                                try:
+                                    if thinking_message_id:
+                                        await bot.edit_message(target, thinking_message_id, update_text)
+                                    else:
+                                        await bot.send_at_message(target, update_text, users)
+                                except Exception as e:
+                                    logger.warning(f"更新进度消息失败: {str(e)}")
+                    
+                        # 如果是图片URL，保存下来
+                        elif "![" in chunk and "](http" in chunk:
+                            response_text = chunk
+                            # 提取图片URL
+                            start_idx = chunk.find("](") + 2
+                            end_idx = chunk.find(")", start_idx)
+                            if start_idx > 1 and end_idx > start_idx:
+                                image_url = chunk[start_idx:end_idx]
+                                logger.info(f"图片生成完成，URL: {image_url}")
+                        else:
+                            response_text += chunk
+                
+                # 如果有图片URL，交给后台任务保存到本地，不等待下载完成
+                if image_url and self.save_images:
+                    self.image_saver.submit(
+                        image_url, session_id, image_prompt, request["model"] or self.default_image_model)
+            else:
+                # 处理普通文本请求
+                logger.debug(f"开始处理API流式响应...")
+                chunk_count = 0
+                # 只有真正请求上游时才占用调度槽位，命中缓存或合并到相同请求时不排队
+                chunks = self.api_client.chat(
+                    session_id, request["query"], request["model"],
+                    slot=lambda: self.scheduler.slot("text", session_id, private=not request["room_id"]))
+                if output_filter is not None:
+                    # 过滤AI回复中的敏感词
+                    chunks = self._filter_stream(chunks, output_filter)
+                if self.stream_delivery:
+                    # 边接收边按句子/段落分段发送
+                    response_text, streamed_segments = await self._stream_reply(
+                        bot, target, users, chunks, thinking_message_id)
+                else:
+                    async for chunk in chunks:
+                        chunk_count += 1
+                        response_text += chunk
+                        if chunk_count % 10 == 0:  # 每收到10个块记录一次日志
+                            logger.debug(f"已接收{chunk_count}个响应块，当前长度:{len(response_text)}")
+                
+                logger.info(f"API响应接收完成，总计{chunk_count}个块，总长度:{len(response_text)}")
+            
+            # 确保回复不为空
+            if not response_text.strip():
+                response_text = "抱歉，AI没有返回有效回复。"
+                logger.warning("API返回了空响应")
+            
+            # 流式发送模式下回复已经分段发出
+            if streamed_segments:
+                logger.debug(f"流式回复发送完成，共{streamed_segments}段")
+                return
+            
+            # 发送完整响应
+            if thinking_message_id:
+                # 如果有思考中消息，则撤回
+                await self._revoke_thinking(bot, target, thinking_message_id)
+                
+            # 发送最终回复
+            logger.debug(f"发送最终回复，长度:{len(response_text)}")
+            await bot.send_at_message(target, response_text, users)
+                
+        except SchedulerRejected as e:
+            await bot.send_at_message(target, str(e), users)
+        except Exception as e:
+            logger.error(f"处理AI回复异常: {str(e)}")
+            await bot.send_at_message(target, f"处理您的请求时出错: {str(e)}", users)
+
+    async def _stream_reply(self, bot: WechatAPIClient, target: str, users: List[str], chunks,
+                            thinking_message_id) -> Tuple[str, int]:
+        """流式发送回复：首段@用户并撤回思考消息，后续各段作为普通消息发送
+        
+        Returns:
+            Tuple[str, int]: (完整回复, 已发送的段数)
+        """
+        segmenter = StreamSegmenter(
+            max_chars=self.stream_max_chars,
+            min_chars=self.stream_min_chars,
+            first_min_chars=self.stream_first_chars
+        )
+        
+        sent = 0
+        
+        async def send(segment: str):
+            nonlocal sent
+            if sent == 0:
+                if thinking_message_id:
+                    await self._revoke_thinking(bot, target, thinking_message_id)
+                await bot.send_at_message(target, segment, users)
+            else:
+                await bot.send_text_message(target, segment)
+            sent += 1
+        
+        response_text = await deliver_stream(chunks, segmenter, send, self.stream_flush_interval)
+        return response_text, sent
+
+    async def _compare_reply(self, bot: WechatAPIClient, session_id: str, target: str, users: List[str],
+                             request: dict, thinking_message_id, output_filter: Optional[SensitiveWordFilter]):
+        """同时向多个模型提问，每个模型回答完成后立即发送，标注模型、首字延迟和总耗时
+        
+        每次对比最多同时请求 compare_concurrency 个模型，各请求仍受全局上游调度器限制。
+        对比的问答不写入会话历史，每个模型使用单独的上游会话。
+        """
+        query = request["query"]
+        semaphore = asyncio.Semaphore(max(1, self.compare_concurrency))
+        conversation_prefix = f"{session_id}#compare{int(time.time() * 1000)}"
+        thinking = [thinking_message_id]
+        
+        async def ask(index: int, model: str):
+            header = f"【{model}】"
+            text = ""
+            try:
+                async with semaphore:
+                    async with self.scheduler.slot("text", session_id, private=not request["room_id"]):
+                        started = time.monotonic()
+                        ttfb = None
+                        chunks = self.api_client.chat(f"{conversation_prefix}-{index}", query, model, save_history=False)
+                        if output_filter is not None:
+                            chunks = self._filter_stream(chunks, output_filter)
+                        async for chunk in chunks:
+                            if ttfb is None:
+                                ttfb = time.monotonic() - started
+                            text += chunk
+                        total = time.monotonic() - started
+                if ttfb is not None:
+                    header += f" 首字 {ttfb:.2f}秒，总耗时 {total:.2f}秒"
+            except SchedulerRejected as e:
+                text = str(e)
+            except Exception as e:
+                logger.error(f"模型对比请求异常 {model}: {str(e)}")
+                text = f"请求出错: {str(e)}"
+            
+            # 第一个完成的模型发送前撤回思考消息
+            message_id, thinking[0] = thinking[0], None
+            if message_id:
+                await self._revoke_thinking(bot, target, message_id)
+            await bot.send_at_message(target, f"{header}\n{text.strip() or '没有返回有效回复'}", users)
+        
+        await asyncio.gather(*(ask(index, model) for index, model in enumerate(request["compare_models"])))
+
+    async def _filter_stream(self, chunks: AsyncGenerator[str, None],
+                             word_filter: SensitiveWordFilter) -> AsyncGenerator[str, None]:
+        """逐片段替换流式回复中的敏感词，能识别跨片段的敏感词"""
+        stream_filter = word_filter.stream()
+        async for chunk in chunks:
+            filtered = stream_filter.feed(chunk)
+            if filtered:
+                yield filtered
+        rest = stream_filter.finish()
+        if rest:
+            yield rest
+
+    async def _revoke_thinking(self, bot: WechatAPIClient, target: str, thinking_message_id):
+        """撤回思考中消息"""
+        try:
+            # 根据API不同，可能需要不同的参数组合
+            logger.debug(f"尝试撤回消息ID: {thinking_message_id}")
+            
+            # 尝试不同的撤回方式
+            try:
+                # 方式1: 直接使用消息ID
+                await bot.revoke_message(thinking_message_id)
+            except Exception:
+                try:
+                    # 方式2: 提供聊天ID和消息ID
+                    await bot.revoke_message(target, thinking_message_id)
+                except Exception:
+                    # 方式3: 忽略撤回
+                    logger.warning(f"无法撤回思考消息，将直接发送回复")
+        except Exception as e:
+            logger.warning(f"撤回思考消息失败: {str(e)}")
+
+    async def handle_command(self, bot: WechatAPIClient, parsed: ParsedMessage) -> bool:
+        """按命令表分发插件命令
+        
+        Args:
+            bot: 微信API客户端
+            parsed: 解析后的命令消息
+            
+        Returns:
+            bool: 是否继续执行其他插件，命令消息总是返回False
+        """
+        logger.info(f"ChargptChat处理命令: {parsed.content}")
+        
+        handler = self._commands.get(parsed.command)
+        if handler is None:
+            # 未知命令
+            await bot.send_at_message(parsed.target, f"未知命令: {parsed.command}，发送 {self.trigger_keyword}_help 查看帮助", [parsed.from_user_id])
+        else:
+            await handler(bot, parsed)
+        return False
+
+    async def _command_clear(self, bot: WechatAPIClient, parsed: ParsedMessage):
+        """清除当前会话历史"""
+        # 清除对话历史
+        session_id = parsed.room_id if parsed.room_id and self.separate_context else parsed.from_user_id
+        self.api_client.clear_conversation(session_id)
+        await bot.send_at_message(parsed.target, "已清除当前会话历史记录", [parsed.from_user_id])
+
+    async def _command_model(self, bot: WechatAPIClient, parsed: ParsedMessage):
+        """查看或设置默认模型"""
+        # 处理模型相关命令
+        if not parsed.args:
+            # 显示当前模型信息
+            model_text = f"当前使用的默认模型: {self.default_model}\n"
+            model_text += f"是否允许消息内指定模型: {'是' if self.allow_model_selection else '否'}\n\n"
+            model_text += "如需在消息中指定模型，请使用格式: chat [模型名] 问题\n"
+            model_text += "例如: chat [openai/gpt-4o] 你好\n\n"
+            model_text += "可用模型列表:\n"
+            model_text += "OpenAI模型:\n"
+            model_text += "- openai/gpt-4o - GPT-4o模型\n"
+            model_text += "- openai/gpt-4o-mini - GPT-4o mini模型\n"
+            model_text += "- openai/gpt-4o-image - GPT-4o支持图像分析\n"
+            model_text += "- openai/o1 - o1模型\n"
+            model_text += "- openai/o3-mini - o3 mini模型\n"
+            model_text += "- openai/gpt-3.5-turbo - GPT-3.5 Turbo模型\n"
+            model_text += "Anthropic模型:\n"
+            model_text += "- anthropic/claude-3.5-sonnet - Claude 3.5 Sonnet\n"
+            model_text += "- anthropic/claude-3.7-sonnet - Claude 3.7 Sonnet\n"
+            model_text += "Google模型:\n"
+            model_text += "- google/gemini-2.0-pro - Gemini 2.0 Pro\n"
+            model_text += "- google/gemini-2.0-flash - Gemini 2.0 Flash\n"
+            model_text += "- google/gemini-2.0-pro-exp-02-05 - Gemini 2.0 Pro实验版\n"
+            model_text += "- google/gemini-2.0-flash-thinking-exp-1219 - Gemini 2.0 Flash思考版\n"
+            model_text += "DeepSeek模型:\n"
+            model_text += "- deepseek/deepseek-r1 - DeepSeek R1 671B\n"
+            model_text += "- deepseek/deepseek-chat - DeepSeek V3\n"
+            model_text += "- deepseek/deepseek-chat-v3-0324 - DeepSeek V3 0324版\n"
+            model_text += "X-AI模型:\n"
+            model_text += "- x-ai/grok-3 - Grok 3\n"
+            model_text += "- x-ai/grok-3-reasoner - Grok 3 Reasoner\n"
+            model_text += "通义千问模型:\n"
+            model_text += "- qwen/qwq-32b - QwQ 32B\n"
+            model_text += "- qwen/qwen-max - Qwen Max\n"
+            
+            # 开启自动选择时显示各等价组的模型统计，按当前优先级排列
+            selector = self.api_client.model_selector
+            if selector is not None:
+                model_text += "\n自动选择模型（未指定模型时在默认模型所在的组内选择）:\n"
+                for number, group in enumerate(selector.get_stats(), 1):
+                    model_text += f"组{number}:\n"
+                    for stats in group["models"]:
+                        ttfb = "未知" if stats["ttfb"] is None else f"{stats['ttfb']:.2f}秒"
+                        rate = "未知" if stats["rate"] is None else f"{stats['rate']:.0f}字/秒"
+                        model_text += f"- {stats['model']}: 首字 {ttfb}，速度 {rate}，错误率 {stats['error_rate']:.0%}，"
+                        model_text += f"请求 {stats['requests']}，失败 {stats['failures']}，切换 {stats['fallbacks']}\n"
+            
+            await bot.send_at_message(parsed.target, model_text, [parsed.from_user_id])
+        else:
+            # 用户指定了新的默认模型
+            new_model = parsed.args.strip()
+            if "/" in new_model:  # 确保格式正确
+                self.default_model = new_model
+                self.api_client.set_default_model(new_model)
+                await bot.send_at_message(parsed.target, f"默认模型已设置为: {new_model}", [parsed.from_user_id])
+            else:
+                await bot.send_at_message(parsed.target, "模型格式不正确，请使用格式: 提供商/模型名\n例如: openai/gpt-4o", [parsed.from_user_id])
+
+    async def _command_compare(self, bot: WechatAPIClient, parsed: ParsedMessage):
+        """同时向多个模型提问并对比回答，如: chat_compare [openai/gpt-4o,deepseek/deepseek-chat] 问题"""
+        args = parsed.args.strip()
+        models = list(self.compare_default_models)
+        if args.startswith("["):
+            end = args.find("]")
+            if end > 0:
+                models = [model.strip() for model in re.split(r"[,，\s]+", args[1:end]) if model.strip()]
+                args = args[end + 1:].strip()
+        models = list(dict.fromkeys(models))
+        
+        usage = (f"用法: {self.trigger_keyword}_compare [模型1,模型2,...] 问题\n"
+                 f"例如: {self.trigger_keyword}_compare [openai/gpt-4o,deepseek/deepseek-chat] 你好")
+        if not args or len(models) < 1:
+            await bot.send_at_message(parsed.target, usage, [parsed.from_user_id])
+            return
+        invalid = [model for model in models if "/" not in model]
+        if invalid:
+            await bot.send_at_message(parsed.target, f"模型格式不正确: {', '.join(invalid)}\n{usage}", [parsed.from_user_id])
+            return
+        if len(models) > self.compare_max_models:
+            await bot.send_at_message(parsed.target, f"一次最多对比{self.compare_max_models}个模型", [parsed.from_user_id])
+            return
+        if await self._block_sensitive(bot, parsed.target, parsed.from_user_id, args):
+            return
+        
+        # 余额不足时在本地拒绝，对比请求不降级模型
+        if self.quota_monitor is not None:
+            _, error = self.quota_monitor.preflight("compare", models[0])
+            if error is not None:
+                await bot.send_at_message(parsed.target, error, [parsed.from_user_id])
+                return
+        
+        session_id = parsed.room_id if parsed.room_id and self.separate_context else parsed.from_user_id
+        request = {
+            "room_id": parsed.room_id,
+            "from_user_id": parsed.from_user_id,
+            "query": args,
+            "model": None,
+            "image_prompt": None,
+            "ratio": None,
+            "compare_models": models
+        }
+        await self._submit_request(bot, session_id, request)
+
+    async def _command_quota(self, bot: WechatAPIClient, parsed: ParsedMessage):
+        """查询API使用配额，默认读取后台刷新的快照，参数为 refresh 时立即刷新"""
+        # 获取配额信息
+        try:
+            monitor = self.quota_monitor
+            results, age = monitor.snapshot() if monitor is not None else ([], 0.0)
+            if not results or parsed.args.strip().lower() == "refresh":
+                logger.info("正在请求配额信息...")
+                results = await (monitor.refresh() if monitor is not None else self.api_client.get_all_quotas())
+                age = 0.0
+            token, quota_result = results[0]
+            logger.debug(f"配额响应: {quota_result}")
+            
+            if quota_result["success"]:
+                quota_data = quota_result["data"]
+                # 记录原始数据
+                logger.debug(f"原始配额数据: {quota_data}")
+                
+                # 格式化配额信息展示
+                quota_text = "ChargptAI 配额信息:\n"
+                if age >= 1:
+                    quota_text += f"（{int(age)}秒前更新，发送 {self.trigger_keyword}_quota refresh 立即刷新）\n"
+                quota_text += f"可用余额: {quota_data.get('available', '未知')}\n"
+                if monitor is not None and age >= 1 and token.available is not None:
+                    quota_text += f"本地预估余额: {token.available:g}\n"
+                quota_text += f"使用情况: {quota_data.get('used', '未知')}/{quota_data.get('total', '未知')}\n"
+                
+                # 添加更多信息，如果有的话
+                if 'models' in quota_data:
+                    quota_text += "\n可用模型:\n"
+                    for model in quota_data['models']:
+                        quota_text += f"- {model}\n"
+                
+                # 添加全部字段，便于分析
+                quota_text += "\n所有数据字段:\n"
+                for key, value in quota_data.items():
+                    if key not in ['available', 'used', 'total', 'models']:
+                        quota_text += f"- {key}: {value}\n"
+                
+                # 配置了多个令牌时，列出所有令牌的预估余额
+                if len(results) > 1:
+                    quota_text += "\n账号池:\n"
+                    for token, result in results:
+                        if token.available is not None:
+                            quota_text += f"- {token.label}: 可用余额 {token.available:g}\n"
+                        elif result["success"]:
+                            quota_text += f"- {token.label}: 可用余额 {result['data'].get('available', '未知')}\n"
+                        else:
+                            quota_text += f"- {token.label}: {result.get('error', '未知错误')}\n"
+                
+                await bot.send_at_message(parsed.target, quota_text, [parsed.from_user_id])
+            else:
+                error_msg = f"获取配额信息失败: {quota_result.get('error', '未知错误')}"
+                logger.warning(error_msg)
+                await bot.send_at_message(parsed.target, error_msg, [parsed.from_user_id])
+        except Exception as e:
+            logger.error(f"获取配额异常: {str(e)}")
+            await bot.send_at_message(parsed.target, f"获取配额时出错: {str(e)}", [parsed.from_user_id])
+
+    async def _command_stats(self, bot: WechatAPIClient, parsed: ParsedMessage):
+        """查看运行状态统计"""
+        # 运行状态统计
+        pool_stats = self.api_client.get_pool_stats()
+        stats_text = "ChargptAI 运行状态:\n"
+        stats_text += "连接池:\n"
+        stats_text += f"- 状态: {'已打开' if pool_stats['open'] else '未打开'}\n"
+        stats_text += f"- 活动连接: {pool_stats['active']}/{pool_stats['limit']} (单主机上限 {pool_stats['limit_per_host']})\n"
+        stats_text += f"- 空闲连接: {pool_stats['idle']}\n"
+        stats_text += f"- 进行中请求: {pool_stats['requests_in_flight']}\n"
+        stats_text += f"- 累计请求: {pool_stats['requests_total']}\n"
+        queue_stats = self.request_queue.get_stats()
+        stats_text += "请求队列:\n"
+        stats_text += f"- 处理中会话: {queue_stats['active_sessions']}\n"
+        stats_text += f"- 排队请求: {queue_stats['queued']} (每会话上限 {queue_stats['max_depth']})\n"
+        stats_text += f"- 累计受理/合并/拒绝: {queue_stats['submitted']}/{queue_stats['merged']}/{queue_stats['rejected']}\n"
+        scheduler_stats = self.scheduler.get_stats()
+        stats_text += f"上游调度 (并发 {scheduler_stats['in_flight']}/{scheduler_stats['max_concurrency']}):\n"
+        for lane_name, lane_stats in scheduler_stats["lanes"].items():
+            stats_text += f"- {lane_name}: 进行中 {lane_stats['in_flight']}/{lane_stats['limit']}，排队 {lane_stats['waiting']}，"
+            stats_text += f"平均等待 {lane_stats['avg_wait']}秒，最长等待 {lane_stats['max_wait']}秒，"
+            stats_text += f"拒绝 {lane_stats['rejected']}，超时 {lane_stats['timed_out']}\n"
+        store_stats = self.api_client.conversations.get_stats()
+        stats_text += "会话历史:\n"
+        stats_text += f"- 会话数: {store_stats['sessions']}/{store_stats['max_sessions']}\n"
+        stats_text += f"- 历史字符数: {store_stats['total_chars']}/{store_stats['max_total_chars']}\n"
+        stats_text += f"- 命中/未命中: {store_stats['hits']}/{store_stats['misses']}\n"
+        evictions = store_stats['evictions']
+        stats_text += f"- 淘汰(过期/数量/内存): {evictions['ttl']}/{evictions['lru']}/{evictions['memory']}\n"
+        if "backend" in store_stats:
+            backend_stats = store_stats["backend"]
+            stats_text += f"- 持久化: 待写入 {backend_stats['pending']}，已写入 {backend_stats['writes']}，加载 {backend_stats['loads']}，压缩 {backend_stats['compactions']}\n"
+        context_builder = self.api_client.context_builder
+        if context_builder is not None:
+            context_stats = context_builder.get_stats()
+            stats_text += f"- 上下文: 平均 {context_stats['avg_prompt_tokens']:.0f} tokens（预算 {context_stats['max_tokens']}），"
+            stats_text += f"压缩为摘要 {context_stats['compacted']}/{context_stats['builds']}\n"
+        cache = self.api_client.response_cache
+        if cache is not None:
+            cache_stats = cache.get_stats()
+            stats_text += "回复缓存:\n"
+            stats_text += f"- 缓存条数: {cache_stats['entries']}/{cache_stats['max_entries']}，进行中 {cache_stats['in_flight']}\n"
+            stats_text += f"- 命中率: {cache_stats['hit_rate']:.1%} ({cache_stats['hits']}/{cache_stats['requests']})\n"
+            stats_text += f"- 合并率: {cache_stats['coalesce_rate']:.1%} ({cache_stats['coalesced']}/{cache_stats['requests']})\n"
+            stats_text += f"- 上游请求: {cache_stats['upstream']}，淘汰: {cache_stats['evictions']}\n"
+        hedging = self.api_client.hedging
+        if hedging is not None:
+            hedge_stats = hedging.get_stats()
+            stats_text += "对冲请求:\n"
+            stats_text += f"- 对冲率: {hedge_stats['hedge_rate']:.1%} ({hedge_stats['hedged']}/{hedge_stats['requests']})，"
+            stats_text += f"额度不足/无空闲槽位未对冲: {hedge_stats['budget_denied']}/{hedge_stats['capacity_denied']}\n"
+            stats_text += f"- 对冲胜出率: {hedge_stats['win_rate']:.1%} ({hedge_stats['hedge_wins']}/{hedge_stats['hedged']})\n"
+            if hedge_stats["delays"]:
+                delays = "，".join(f"{model} {delay}秒" for model, delay in hedge_stats["delays"].items())
+                stats_text += f"- 对冲延迟: {delays}\n"
+        if self.quota_monitor is not None:
+            quota_stats = self.quota_monitor.get_stats()
+            balance = quota_stats["balance"]
+            stats_text += "配额:\n"
+            stats_text += f"- 预估余额: {'未知' if balance is None else f'{balance:g}'}，{int(quota_stats['age'])}秒前刷新\n"
+            stats_text += f"- 刷新/失败: {quota_stats['refreshes']}/{quota_stats['refresh_failures']}，"
+            stats_text += f"余额不足拒绝/降级: {quota_stats['rejected']}/{quota_stats['downgraded']}\n"
+        token_pool = self.api_client.token_pool
+        if len(token_pool) > 1:
+            pool_info = token_pool.get_stats()
+            stats_text += f"账号池 (固定会话 {pool_info['affinity']}，改派 {pool_info['reassigned']}):\n"
+            for token_stats in pool_info["tokens"]:
+                available = token_stats["available"]
+                stats_text += f"- {token_stats['label']}: 进行中 {token_stats['outstanding']}/{token_stats['share']}，"
+                stats_text += f"余额 {'未知' if available is None else available}，累计请求 {token_stats['requests']}"
+                if token_stats["ejected"]:
+                    stats_text += f"，暂停中（{token_stats['eject_reason']}，{token_stats['retry_after']}秒后恢复）"
+                stats_text += "\n"
+        breakers = self.api_client.circuit_breakers
+        breaker_stats = breakers.get_stats()
+        if breaker_stats:
+            state_names = {"closed": "正常", "open": "熔断", "half_open": "试探"}
+            stats_text += f"熔断器{'' if breakers.enabled else ' (未启用，仅统计)'}:\n"
+            for name, stats in breaker_stats.items():
+                stats_text += f"- {name}: {state_names.get(stats['state'], stats['state'])}"
+                if stats["state"] == "open":
+                    stats_text += f" ({stats['retry_after']}秒后试探)"
+                stats_text += f"，窗口失败率 {stats['window_failure_rate']:.0%} ({stats['window_requests']}次)，"
+                stats_text += f"平均延迟 {stats['latency']}秒，失败/超时/快速拒绝 {stats['failures']}/{stats['timeouts']}/{stats['rejected']}，"
+                stats_text += f"熔断 {stats['opened']}次\n"
+        download_stats = self.image_downloader.get_stats()
+        stats_text += "图片下载:\n"
+        stats_text += f"- 成功/失败/拒绝: {download_stats['downloads']}/{download_stats['failures']}/{download_stats['rejected']}\n"
+        stats_text += f"- 累计下载: {download_stats['bytes_total'] / 1024 / 1024:.1f}MB，"
+        stats_text += f"平均速度 {download_stats['avg_throughput'] / 1024:.1f}KB/s，最近一次 {download_stats['last_throughput'] / 1024:.1f}KB/s\n"
+        if self.config_watcher is not None:
+            reload_stats = self.config_watcher.get_stats()
+            stats_text += "配置热加载:\n"
+            stats_text += f"- 成功/失败: {reload_stats['reloads']}/{reload_stats['failures']}"
+            if reload_stats["last_reload"] is not None:
+                stats_text += f"，最近一次 {int(time.time() - reload_stats['last_reload'])}秒前"
+            stats_text += "\n"
+            if reload_stats["last_error"]:
+                stats_text += f"- 最近的错误: {reload_stats['last_error']}\n"
+        await bot.send_at_message(parsed.target, stats_text, [parsed.from_user_id])
+
+    async def _command_help(self, bot: WechatAPIClient, parsed: ParsedMessage):
+        """发送帮助信息"""
+        # 帮助信息
+        help_text = f"""ChargptAI 助手使用指南:
+
+1. 基本使用:
+   - 发送 "{self.trigger_keyword} 问题" 进行提问
+   - 注：本插件仅通过触发词唤醒，不响应@消息
+
+2. 图片生成:
+   - 发送 "{self.trigger_keyword} {self.image_command}[描述]" 生成图片
+   - 例如: {self.trigger_keyword} {self.image_command}一个动漫风格的机甲战士
+   - 指定比例: {self.trigger_keyword} {self.image_command}16:9 一个宽屏风景
+   - 可用比例: 1:1(方形)、16:9(宽屏)、9:16(竖屏)、4:3、3:4
+   - 支持使用 [{self.default_image_model}] 模型
+
+3. 模型选择:
+   - 默认使用: {self.default_model}
+   - 在消息中临时指定模型: {self.trigger_keyword} [模型名] 问题
+     例如: {self.trigger_keyword} [anthropic/claude-3.5-sonnet] 你好
+   - 更改默认模型: {self.trigger_keyword}_model 模型名
+     例如: {self.trigger_keyword}_model openai/gpt-4o
+
+4. 可用模型:
+   OpenAI模型:
+   - openai/gpt-4o - GPT-4o模型
+   - openai/gpt-4o-mini - GPT-4o mini模型
+   - openai/gpt-4o-image - 支持图像生成
+   - openai/o1 - o1模型
+   - openai/o3-mini - o3 mini模型
+   - openai/gpt-3.5-turbo - GPT-3.5模型
+   
+   Anthropic模型:
+   - anthropic/claude-3.5-sonnet - Claude 3.5
+   - anthropic/claude-3.7-sonnet - Claude 3.7
+   
+   Google模型:
+   - google/gemini-2.0-pro - Gemini 2.0 Pro
+   - google/gemini-2.0-flash - Gemini 2.0 Flash
+   
+   DeepSeek模型:
+   - deepseek/deepseek-r1 - DeepSeek R1 671B
+   - deepseek/deepseek-chat - DeepSeek V3
+   
+   X-AI模型:
+   - x-ai/grok-3 - Grok 3
+   
+   通义千问模型:
+   - qwen/qwq-32b - QwQ 32B
+   - qwen/qwen-max - Qwen Max
+
+5. 其他命令:
+   - {self.trigger_keyword}_clear: 清除当前会话历史
+   - {self.trigger_keyword}_quota: 查询API使用配额
+   - {self.trigger_keyword}_stats: 查看运行状态统计
+   - {self.trigger_keyword}_model: 查看/设置默认模型
+   - {self.trigger_keyword}_image: 查看/设置图片生成功能
+   - {self.trigger_keyword}_compare [模型1,模型2] 问题: 同时向多个模型提问，对比回答和耗时"""
+        await bot.send_at_message(parsed.target, help_text, [parsed.from_user_id])
+
+    async def _command_image(self, bot: WechatAPIClient, parsed: ParsedMessage):
+        """查看或设置图片生成功能"""
+        # 处理图片生成相关设置
+        if not parsed.args:
+            # 显示当前图片生成设置
+            image_text = f"图片生成功能设置:\n"
+            image_text += f"启用状态: {'已启用' if self.enable_image_generation else '已禁用'}\n"
+            image_text += f"默认模型: {self.default_image_model}\n"
+            image_text += f"生成命令前缀: {self.trigger_keyword} {self.image_command}...\n"
+            image_text += f"默认图片比例: {self.default_ratio}\n"
+            image_text += f"保存图片: {'是' if self.save_images else '否'}\n"
+            image_text += f"图片保存路径: {self.image_save_path}\n"
+            saver_stats = self.image_saver.get_stats()
+            image_text += f"保存队列: 待保存 {saver_stats['pending']}/{saver_stats['max_pending']}（下载中 {saver_stats['in_progress']}，等待重试 {saver_stats['retrying']}）\n"
+            image_text += f"保存统计: 成功 {saver_stats['saved']}，失败 {saver_stats['failed']}，丢弃 {saver_stats['dropped']}，重试 {saver_stats['retries']}\n"
+            store_stats = self.image_store.get_stats()
+            image_text += f"图片存储: {store_stats['files']}张，{store_stats['bytes'] / 1024 / 1024:.1f}/{store_stats['max_bytes'] / 1024 / 1024:.0f}MB，"
+            image_text += f"重复 {store_stats['duplicates']}，淘汰 {store_stats['evicted']}\n\n"
+            image_text += f"使用示例:\n"
+            image_text += f"{self.trigger_keyword} {self.image_command}一个动漫风格的机甲战士\n"
+            image_text += f"{self.trigger_keyword} {self.image_command}16:9 一个宽屏风景\n"
+            
+            await bot.send_at_message(parsed.target, image_text, [parsed.from_user_id])
+        else:
+            # 解析设置参数
+            arg_parts = parsed.args.split(" ", 1)
+            setting = arg_parts[0].lower()
+            value = arg_parts[1] if len(arg_parts) > 1 else ""
+            
+            if setting == "ratio" and value:
+                # 设置默认图片比例
+                if value in ["1:1", "16:9", "9:16", "4:3", "3:4"]:
+                    self.default_ratio = value
+                    await bot.send_at_message(parsed.target, f"默认图片比例已设置为: {value}", [parsed.from_user_id])
+                else:
+                    await bot.send_at_message(parsed.target, f"不支持的比例设置，可用选项: 1:1, 16:9, 9:16, 4:3, 3:4", [parsed.from_user_id])
+            
+            elif setting == "enable":
+                # 启用/禁用图片生成
+                if value.lower() in ["true", "yes", "1", "on"]:
+                    self.enable_image_generation = True
+                    await bot.send_at_message(parsed.target, "图片生成功能已启用", [parsed.from_user_id])
+                elif value.lower() in ["false", "no", "0", "off"]:
+                    self.enable_image_generation = False
+                    await bot.send_at_message(parsed.target, "图片生成功能已禁用", [parsed.from_user_id])
+                else:
+                    await bot.send_at_message(parsed.target, f"无效的参数，请使用 true/false", [parsed.from_user_id])
+            
+            elif setting == "save":
+                # 是否保存图片
+                if value.lower() in ["true", "yes", "1", "on"]:
+                    self.save_images = True
+                    # 确保图片保存目录存在
+                    image_dir = os.path.join(os.path.dirname(__file__), self.image_save_path)
+                    if not os.path.exists(image_dir):
+                        try:
+                            os.makedirs(image_dir)
+                            logger.info(f"创建图片保存目录: {image_dir}")
+                        except Exception as e:
+                            logger.error(f"创建图片保存目录失败: {str(e)}")
+                            self.save_images = False
+                            await bot.send_at_message(parsed.target, f"无法创建图片保存目录，图片保存功能已禁用: {str(e)}", [parsed.from_user_id])
+                            return
+                    try:
+                        await self.image_store.open()
+                        await self.image_saver.start()
+                    except Exception as e:
+                        logger.error(f"打开图片存储失败: {str(e)}")
+                        self.save_images = False
+                        await bot.send_at_message(parsed.target, f"无法打开图片存储，图片保存功能已禁用: {str(e)}", [parsed.from_user_id])
+                        return
+                    await bot.send_at_message(parsed.target, f"图片保存功能已启用，保存路径: {image_dir}", [parsed.from_user_id])
+                elif value.lower() in ["false", "no", "0", "off"]:
+                    self.save_images = False
+                    await bot.send_at_message(parsed.target, "图片保存功能已禁用", [parsed.from_user_id])
+                else:
+                    await bot.send_at_message(parsed.target, f"无效的参数，请使用 true/false", [parsed.from_user_id])
+                    
+            elif setting == "model" and value:
+                # 设置默认图片生成模型
+                if "/" in value and "image" in value.lower():
+                    self.default_image_model = value
+                    await bot.send_at_message(parsed.target, f"默认图片生成模型已设置为: {value}", [parsed.from_user_id])
+                else:
+                    await bot.send_at_message(parsed.target, f"无效的模型，请确保模型名包含提供商前缀和image关键词", [parsed.from_user_id])
+            
+            else:
+                # 显示使用帮助
+                help_text = "图片生成设置命令用法:\n"
+                help_text += f"{self.trigger_keyword}_image - 显示当前设置\n"
+                help_text += f"{self.trigger_keyword}_image ratio 1:1 - 设置默认图片比例\n"
+                help_text += f"{self.trigger_keyword}_image enable true/false - 启用/禁用图片生成\n"
+                help_text += f"{self.trigger_keyword}_image save true/false - 启用/禁用图片保存\n"
+                help_text += f"{self.trigger_keyword}_image model openai/gpt-4o-image - 设置默认图片生成模型"
+                await bot.send_at_message(parsed.target, help_text, [parsed.from_user_id])
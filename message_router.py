@@ -0,0 +1,152 @@
+from typing import Optional
+
+# 解析结果缓存在消息字典中的键，同一条消息被多个处理函数处理时只解析一次
+PARSED_KEY = "_chargpt_parsed"
+
+# 支持的图片比例写法的最大长度，如 "16:9"
+MAX_RATIO_LENGTH = 5
+
+
+class ParsedMessage:
+    """解析后的消息"""
+
+    __slots__ = ("kind", "content", "from_user_id", "room_id", "query", "command", "args",
+                 "model", "image_prompt", "ratio")
+
+    # 消息类型
+    CHAT = "chat"
+    COMMAND = "command"
+    EMPTY = "empty"
+
+    def __init__(self, kind: str, content: str, from_user_id: str, room_id: str):
+        self.kind = kind
+        self.content = content
+        self.from_user_id = from_user_id
+        self.room_id = room_id
+        # 对话内容（已去掉触发词和模型指定）
+        self.query = ""
+        # 命令名（小写）和参数
+        self.command = ""
+        self.args = ""
+        # 消息中指定的模型
+        self.model: Optional[str] = None
+        # 以图片命令开头时的图片提示词和指定的比例
+        self.image_prompt: Optional[str] = None
+        self.ratio: Optional[str] = None
+
+    @property
+    def target(self) -> str:
+        """回复的目标：群聊为群ID，私聊为发送者ID"""
+        return self.room_id or self.from_user_id
+
+
+class MessageRouter:
+    """消息解析器
+
+    每条消息只做一次解析：先用一次前缀比较排除不含触发词的消息（绝大多数群消息），
+    命中后再解析命令、模型指定、图片命令和图片比例。
+    """
+
+    def __init__(self, trigger_keyword: str, image_command: str, allow_model_selection: bool = False):
+        """初始化解析器
+
+        Args:
+            trigger_keyword: 触发词，不区分大小写
+            image_command: 图片生成命令前缀
+            allow_model_selection: 是否允许在消息中用 [模型名] 指定模型
+        """
+        self.trigger_keyword = trigger_keyword.lower()
+        self.image_command = image_command
+        self.allow_model_selection = allow_model_selection
+        self._trigger_length = len(self.trigger_keyword)
+
+    def parse_text(self, message: dict) -> Optional[ParsedMessage]:
+        """解析文本消息
+
+        Args:
+            message: 原始消息
+
+        Returns:
+            Optional[ParsedMessage]: 解析结果，不是发给本插件的消息返回None
+        """
+        if PARSED_KEY in message:
+            return message[PARSED_KEY]
+
+        parsed = None
+        content = message.get("content", message.get("Content", ""))
+        length = self._trigger_length
+        if isinstance(content, str) and content[:length].lower() == self.trigger_keyword:
+            separator = content[length:length + 1]
+            if separator == "":
+                parsed = self._new(ParsedMessage.EMPTY, content, message)
+            elif separator == " ":
+                parsed = self._parse_chat(content[length:].strip(), content, message)
+            elif separator == "_":
+                parsed = self._parse_command(content, message)
+
+        message[PARSED_KEY] = parsed
+        return parsed
+
+    def parse_at(self, message: dict) -> ParsedMessage:
+        """解析@消息，整条消息内容都作为对话内容
+
+        Args:
+            message: 原始消息
+
+        Returns:
+            ParsedMessage: 解析结果
+        """
+        if message.get(PARSED_KEY) is not None:
+            return message[PARSED_KEY]
+        content = message.get("content", message.get("Content", "")).strip()
+        parsed = self._parse_chat(content, content, message)
+        message[PARSED_KEY] = parsed
+        return parsed
+
+    def _new(self, kind: str, content: str, message: dict) -> ParsedMessage:
+        return ParsedMessage(
+            kind,
+            content,
+            message.get("sender_id", message.get("SenderWxid", "")),
+            message.get("room_id", message.get("FromWxid", ""))
+        )
+
+    def _parse_chat(self, query: str, content: str, message: dict) -> ParsedMessage:
+        if not query:
+            return self._new(ParsedMessage.EMPTY, content, message)
+        parsed = self._new(ParsedMessage.CHAT, content, message)
+
+        # 提取模型信息，如 "[openai/gpt-4o] 你好"
+        if self.allow_model_selection and query.startswith("["):
+            model_end = query.find("]")
+            model_name = query[1:model_end].strip() if model_end > 0 else ""
+            if model_name:
+                parsed.model = model_name
+                query = query[model_end + 1:].strip()
+        parsed.query = query
+
+        # 提取图片提示词和比例，如 "画 16:9 一个风景"
+        if self.image_command and query.startswith(self.image_command):
+            image_prompt = query[len(self.image_command):].strip()
+            if image_prompt:
+                first_part, _, rest = image_prompt.partition(" ")
+                if rest and self._is_ratio(first_part):
+                    parsed.ratio = first_part
+                    image_prompt = rest.strip()
+                parsed.image_prompt = image_prompt
+        return parsed
+
+    def _parse_command(self, content: str, message: dict) -> ParsedMessage:
+        parsed = self._new(ParsedMessage.COMMAND, content, message)
+        command, _, args = content.partition(" ")
+        parsed.command = command[self._trigger_length + 1:].lower()
+        parsed.args = args
+        return parsed
+
+    @staticmethod
+    def _is_ratio(text: str) -> bool:
+        """简单判断是否是比例格式"""
+        if len(text) > MAX_RATIO_LENGTH:
+            return False
+        width, colon, height = text.partition(":")
+        return bool(colon) and width.isdigit() and height.isdigit()
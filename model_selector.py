@@ -0,0 +1,149 @@
+import random
+from typing import Dict, List, Optional
+
+# 估算回复耗时使用的典型回复长度（字符），得分 = 首字节延迟 + 该长度 / 输出速度
+REFERENCE_CHARS = 300
+
+
+class ModelStats:
+    """单个模型的指数加权统计"""
+
+    __slots__ = ("ttfb", "rate", "error_rate", "requests", "failures", "fallbacks")
+
+    def __init__(self):
+        # 首字节延迟（秒）和输出速度（字符每秒），没有样本时为None
+        self.ttfb: Optional[float] = None
+        self.rate: Optional[float] = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.failures = 0
+        # 因该模型失败而切换到下一个模型的次数
+        self.fallbacks = 0
+
+
+class ModelSelector:
+    """按延迟在等价模型组内自动选择模型
+
+    每个模型记录首字节延迟、输出速度和错误率的指数加权平均。请求未指定模型时，
+    在默认模型所在的组内按预计耗时（错误率越高惩罚越大）排序，依次尝试；
+    尚无统计的模型排在最前面，另有少量请求随机选择首选模型，使各模型的统计保持更新。
+    """
+
+    def __init__(self, groups: List[List[str]], alpha: float = 0.3, error_penalty: float = 4.0,
+                 explore: float = 0.05):
+        """初始化模型选择器
+
+        Args:
+            groups: 等价模型组，每组内的模型可以互相替代
+            alpha: 指数加权平均的平滑系数，越大越看重最近的请求
+            error_penalty: 错误率的惩罚系数，得分乘以 (1 + error_penalty * 错误率)
+            explore: 随机选择首选模型的请求比例
+        """
+        self.groups = [list(dict.fromkeys(group)) for group in groups if group]
+        self.alpha = alpha
+        self.error_penalty = error_penalty
+        self.explore = explore
+        self._group_of: Dict[str, List[str]] = {}
+        for group in self.groups:
+            for model in group:
+                self._group_of.setdefault(model, group)
+        self._stats: Dict[str, ModelStats] = {}
+
+    def candidates(self, model: str) -> List[str]:
+        """获取一次请求依次尝试的模型
+
+        Args:
+            model: 默认模型
+
+        Returns:
+            List[str]: 按优先级排列的模型，默认模型不在任何组中时只包含默认模型
+        """
+        group = self._group_of.get(model)
+        if group is None:
+            return [model]
+        ranked = sorted(group, key=self._score)
+        if len(ranked) > 1 and random.random() < self.explore:
+            first = ranked.pop(random.randrange(len(ranked)))
+            ranked.insert(0, first)
+        return ranked
+
+    def record_success(self, model: str, ttfb: float, chars: int, seconds: float) -> None:
+        """记录一次成功的请求
+
+        Args:
+            model: 模型
+            ttfb: 首个数据块的延迟（秒）
+            chars: 回复的字符数
+            seconds: 从首个数据块到结束的时间（秒）
+        """
+        stats = self._get(model)
+        stats.requests += 1
+        alpha = self.alpha
+        stats.ttfb = ttfb if stats.ttfb is None else stats.ttfb + alpha * (ttfb - stats.ttfb)
+        if chars > 0 and seconds > 0:
+            rate = chars / seconds
+            stats.rate = rate if stats.rate is None else stats.rate + alpha * (rate - stats.rate)
+        stats.error_rate -= alpha * stats.error_rate
+
+    def record_failure(self, model: str, fallback: bool = False) -> None:
+        """记录一次失败的请求
+
+        Args:
+            model: 模型
+            fallback: 是否已切换到下一个模型重试
+        """
+        stats = self._get(model)
+        stats.requests += 1
+        stats.failures += 1
+        if fallback:
+            stats.fallbacks += 1
+        stats.error_rate += self.alpha * (1.0 - stats.error_rate)
+
+    def inherit(self, other: "ModelSelector") -> None:
+        """沿用另一个选择器中各模型的统计，配置重新加载后不必重新探测各模型的延迟
+
+        Args:
+            other: 旧的模型选择器，两者共享统计对象，旧选择器上未完成的请求仍会更新统计
+        """
+        self._stats.update(other._stats)
+
+    def get_stats(self) -> List[Dict]:
+        """按组获取各模型的统计信息
+
+        Returns:
+            List[Dict]: 每组一项，包含 models（按当前优先级排列的各模型统计）
+        """
+        result = []
+        for group in self.groups:
+            models = []
+            for model in sorted(group, key=self._score):
+                stats = self._stats.get(model) or ModelStats()
+                models.append({
+                    "model": model,
+                    "ttfb": stats.ttfb,
+                    "rate": stats.rate,
+                    "error_rate": stats.error_rate,
+                    "requests": stats.requests,
+                    "failures": stats.failures,
+                    "fallbacks": stats.fallbacks
+                })
+            result.append({"models": models})
+        return result
+
+    def _get(self, model: str) -> ModelStats:
+        stats = self._stats.get(model)
+        if stats is None:
+            stats = ModelStats()
+            self._stats[model] = stats
+        return stats
+
+    def _score(self, model: str) -> float:
+        """预计耗时（秒），越小越优先"""
+        stats = self._stats.get(model)
+        if stats is None or stats.ttfb is None:
+            # 没有成功样本：从未请求过的模型优先试探，只失败过的模型排在最后
+            return 0.0 if stats is None or not stats.failures else float("inf")
+        score = stats.ttfb
+        if stats.rate:
+            score += REFERENCE_CHARS / stats.rate
+        return score * (1 + self.error_penalty * stats.error_rate)
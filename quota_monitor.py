@@ -0,0 +1,139 @@
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from .token_pool import TokenPool, TokenState
+
+
+class QuotaMonitor:
+    """后台定时刷新配额并缓存快照
+
+    - chat_quota 直接读取快照，不需要等待上游
+    - 两次刷新之间，每个成功的请求在本地按预估消耗扣减余额（见 TokenPool.consume），刷新时以上游数据为准
+    - 余额低于阈值时，请求在本地被拒绝或降级到指定模型，不再发送到上游后才失败
+    """
+
+    def __init__(self, client, interval: float = 300, min_balance: float = 0, downgrade_model: str = "",
+                 reject_message: str = "AI服务余额不足，请稍后再试或联系管理员。"):
+        """初始化配额监控
+
+        Args:
+            client: API客户端（ChargptAPIClient），用于查询配额和读取账号池
+            interval: 刷新间隔（秒）
+            min_balance: 余额阈值，所有令牌的可用余额之和低于该值时拒绝或降级请求，小于等于0表示不检查
+            downgrade_model: 余额不足时聊天请求改用的模型，为空则直接拒绝
+            reject_message: 拒绝请求时回复的提示
+        """
+        self.client = client
+        self.interval = max(10.0, interval)
+        self.min_balance = min_balance
+        self.downgrade_model = downgrade_model
+        self.reject_message = reject_message
+
+        self._task: Optional[asyncio.Task] = None
+        self._results: List[Tuple[TokenState, Dict]] = []
+        self.refreshed_at = 0.0
+
+        # 统计信息
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.rejected = 0
+        self.downgraded = 0
+
+    @property
+    def token_pool(self) -> TokenPool:
+        return self.client.token_pool
+
+    async def start(self) -> None:
+        """立即刷新一次并启动后台刷新任务（可重复调用）"""
+        if self._task is not None:
+            return
+        await self.refresh()
+        self._task = asyncio.create_task(self._loop())
+
+    async def close(self) -> None:
+        """停止后台刷新任务"""
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def refresh(self) -> List[Tuple[TokenState, Dict]]:
+        """查询所有令牌的配额并更新快照
+
+        Returns:
+            List[Tuple[TokenState, Dict]]: (令牌, get_quota的结果) 列表
+        """
+        results = await self.client.get_all_quotas()
+        self.refreshes += 1
+        if not any(result["success"] for _, result in results):
+            self.refresh_failures += 1
+        self._results = results
+        self.refreshed_at = time.time()
+        balance = self.balance()
+        if balance is not None:
+            logger.debug(f"配额已刷新，可用余额合计: {balance:g}")
+        return results
+
+    def snapshot(self) -> Tuple[List[Tuple[TokenState, Dict]], float]:
+        """获取最近一次的配额快照
+
+        Returns:
+            Tuple[List[Tuple[TokenState, Dict]], float]: (快照, 距离刷新的秒数)，尚未刷新时快照为空列表
+        """
+        age = time.time() - self.refreshed_at if self.refreshed_at else 0.0
+        return self._results, age
+
+    def balance(self) -> Optional[float]:
+        """当前可用令牌的预估余额之和，没有已知余额时返回None"""
+        now = time.monotonic()
+        known = [state.available for state in self.token_pool.tokens
+                 if state.available is not None and not state.is_ejected(now)]
+        return sum(known) if known else None
+
+    def preflight(self, kind: str, model: str) -> Tuple[str, Optional[str]]:
+        """请求发出前检查余额
+
+        Args:
+            kind: 请求类型，chat 或 image
+            model: 请求使用的模型
+
+        Returns:
+            Tuple[str, Optional[str]]: (实际使用的模型, 拒绝原因)，拒绝原因为None表示放行
+        """
+        if self.min_balance <= 0:
+            return model, None
+        balance = self.balance()
+        if balance is None or balance >= self.min_balance:
+            return model, None
+        if kind == "chat" and self.downgrade_model and model != self.downgrade_model:
+            self.downgraded += 1
+            logger.info(f"余额不足（{balance:g}），{model} 降级为 {self.downgrade_model}")
+            return self.downgrade_model, None
+        self.rejected += 1
+        logger.warning(f"余额不足（{balance:g}），拒绝{kind}请求")
+        return model, self.reject_message
+
+    def get_stats(self) -> Dict:
+        """获取配额监控统计信息"""
+        _, age = self.snapshot()
+        return {
+            "balance": self.balance(),
+            "min_balance": self.min_balance,
+            "age": age,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+            "rejected": self.rejected,
+            "downgraded": self.downgraded
+        }
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                self.refresh_failures += 1
+                logger.error(f"刷新配额失败: {str(e)}")
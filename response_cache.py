@@ -0,0 +1,216 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+
+def make_cache_key(model: str, message: str) -> str:
+    """生成缓存键：模型 + 规范化后的问题（合并空白、忽略大小写）"""
+    return f"{model}|{' '.join(message.split()).casefold()}"
+
+
+class _CacheEntry:
+    """一条缓存的回复"""
+
+    __slots__ = ("text", "expires_at")
+
+    def __init__(self, text: str, expires_at: float):
+        self.text = text
+        self.expires_at = expires_at
+
+
+class SharedStream:
+    """一次被多个请求共享的上游流式请求
+
+    上游流在单独的任务中读取，收到的片段依次保存，每个订阅者从头按顺序读取，
+    因此中途加入的订阅者也能拿到完整回复；某个订阅者中途退出不会影响其他订阅者。
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.chunks: List[str] = []
+        self.done = False
+        # 上游成功完成时的完整回复，失败时为None
+        self.result: Optional[str] = None
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        """按顺序读取共享流的所有片段
+
+        Yields:
+            str: 响应消息片段
+        """
+        self.subscribers += 1
+        index = 0
+        while True:
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            if self.done:
+                return
+            changed = self._changed
+            await changed.wait()
+
+    def _append(self, chunk: str) -> None:
+        self.chunks.append(chunk)
+        self._notify()
+
+    def _finish(self) -> None:
+        self.done = True
+        self._notify()
+
+    def _notify(self) -> None:
+        # 唤醒所有等待中的订阅者，并为下一批片段换一个新的事件
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+
+class ResponseCache:
+    """与会话历史无关的聊天回复缓存，带并发请求合并（singleflight）
+
+    - 以 模型 + 规范化问题 为键缓存完整回复，条目在 ttl 秒后过期，
+      条目数或总字符数超过上限时按 LRU 淘汰
+    - 缓存未命中时，相同键的并发请求只发起一次上游请求，所有请求共享同一个流
+    - 只有上游成功完成的回复才会写入缓存，错误提示不会被缓存
+    """
+
+    def __init__(self, ttl: float = 300, max_entries: int = 500, max_chars: int = 2_000_000):
+        """初始化回复缓存
+
+        Args:
+            ttl: 缓存过期时间（秒），小于等于0时只合并并发请求、不缓存回复
+            max_entries: 最多缓存的回复数
+            max_chars: 所有缓存回复的总字符数上限
+        """
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.max_chars = max_chars
+
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._total_chars = 0
+        self._flights: Dict[str, SharedStream] = {}
+
+        # 统计信息
+        self.requests = 0
+        self.hits = 0
+        self.coalesced = 0
+        self.upstream = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        """查找缓存的回复
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            Optional[str]: 缓存的回复，未命中或已过期时返回None
+        """
+        self.requests += 1
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.text
+
+    def join(self, key: str, factory: Callable[[Callable[[str], None]], AsyncIterator[str]]) -> Tuple[SharedStream, bool]:
+        """加入相同键的进行中请求，没有时用 factory 发起新的上游请求
+
+        Args:
+            key: 缓存键
+            factory: 创建上游流的函数，参数为成功完成时的回调（传入完整回复）
+
+        Returns:
+            Tuple[SharedStream, bool]: (共享流, 是否由本次调用发起上游请求)
+        """
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            return flight, False
+
+        flight = SharedStream(key)
+        self._flights[key] = flight
+        self.upstream += 1
+        flight._task = asyncio.create_task(self._run(flight, factory))
+        return flight, True
+
+    def put(self, key: str, text: str) -> None:
+        """写入一条缓存
+
+        Args:
+            key: 缓存键
+            text: 完整回复
+        """
+        if self.ttl <= 0 or not text:
+            return
+        if self.max_chars > 0 and len(text) > self.max_chars:
+            return
+        self._remove(key)
+        self._entries[key] = _CacheEntry(text, time.monotonic() + self.ttl)
+        self._total_chars += len(text)
+        while len(self._entries) > self.max_entries or (self.max_chars > 0 and self._total_chars > self.max_chars):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    async def close(self) -> None:
+        """取消所有进行中的共享请求"""
+        tasks = [flight._task for flight in self._flights.values() if flight._task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._flights.clear()
+
+    def get_stats(self) -> Dict:
+        """获取缓存统计信息
+
+        Returns:
+            Dict: 统计信息，命中率和合并率以请求总数为分母
+        """
+        requests = self.requests
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "total_chars": self._total_chars,
+            "in_flight": len(self._flights),
+            "requests": requests,
+            "hits": self.hits,
+            "coalesced": self.coalesced,
+            "upstream": self.upstream,
+            "hit_rate": round(self.hits / requests, 3) if requests else 0.0,
+            "coalesce_rate": round(self.coalesced / requests, 3) if requests else 0.0,
+            "evictions": self.evictions
+        }
+
+    async def _run(self, flight: SharedStream, factory) -> None:
+        """在后台读取上游流，并把片段分发给所有订阅者"""
+        completed: List[str] = []
+        try:
+            async for chunk in factory(completed.append):
+                flight._append(chunk)
+            if completed:
+                flight.result = completed[0]
+                self.put(flight.key, flight.result)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"共享上游请求异常: {str(e)}")
+            flight._append(f"请求异常: {str(e)}")
+        finally:
+            self._flights.pop(flight.key, None)
+            flight._finish()
+            if flight.subscribers > 1:
+                logger.debug(f"共享上游请求完成，共 {flight.subscribers} 个请求使用了同一个回复")
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_chars -= len(entry.text)
@@ -0,0 +1,250 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+
+class SchedulerRejected(Exception):
+    """上游请求因排队过长被拒绝"""
+
+    def __init__(self, lane: str, estimated_wait: float):
+        self.lane = lane
+        self.estimated_wait = estimated_wait
+        if estimated_wait >= 1:
+            super().__init__(f"当前请求较多，预计需要等待{int(estimated_wait)}秒，请稍后再试")
+        else:
+            super().__init__("当前请求较多，请稍后再试")
+
+
+class _Waiter:
+    """等待上游连接槽位的请求"""
+
+    __slots__ = ("lane", "session_id", "future", "enqueued_at")
+
+    def __init__(self, lane: str, session_id: str, future: asyncio.Future):
+        self.lane = lane
+        self.session_id = session_id
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class _Lane:
+    """一类上游请求（文本/图片）的调度状态"""
+
+    __slots__ = ("name", "limit", "in_flight", "heap", "waiting", "virtual_time", "finish_tags",
+                 "service_time", "wait_time", "max_wait_time", "granted", "rejected", "timed_out")
+
+    def __init__(self, name: str, limit: int, initial_service_time: float):
+        self.name = name
+        self.limit = limit
+        self.in_flight = 0
+        self.heap: List = []
+        self.waiting = 0
+        self.virtual_time = 0.0
+        # 每个会话最后一个请求的虚拟完成时间
+        self.finish_tags: Dict[str, float] = {}
+        # 服务时间和等待时间的指数加权平均
+        self.service_time = initial_service_time
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.granted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+
+class UpstreamScheduler:
+    """上游请求调度器
+
+    - 全局并发上限，文本和图片请求分别有独立的通道和并发上限
+    - 同一通道内按会话做加权公平排队(WFQ)：每个请求按所属会话的虚拟完成时间排序，
+      单个会话的突发请求不会饿死其他会话；权重越高的会话（如私聊）获得的份额越大
+    - 准入控制：按排队长度和平均服务时间估算等待时间，超过上限时立即拒绝
+    """
+
+    # 服务时间指数加权平均的平滑系数
+    EWMA_ALPHA = 0.2
+
+    def __init__(self, max_concurrency: int = 16, lane_limits: Optional[Dict[str, int]] = None,
+                 max_wait: float = 60, private_weight: float = 1.0):
+        """初始化调度器
+
+        Args:
+            max_concurrency: 全局最大并发上游请求数
+            lane_limits: 各通道的并发上限，如 {"text": 12, "image": 4}
+            max_wait: 最长排队时间（秒），估算等待时间超过该值的请求会被直接拒绝
+            private_weight: 私聊会话的调度权重，大于1表示私聊优先
+        """
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_wait = max_wait
+        self.private_weight = max(0.01, private_weight)
+
+        lane_limits = lane_limits or {"text": self.max_concurrency, "image": self.max_concurrency}
+        initial_service_time = {"text": 10.0, "image": 60.0}
+        self._lanes: Dict[str, _Lane] = {
+            name: _Lane(name, max(1, min(limit, self.max_concurrency)), initial_service_time.get(name, 10.0))
+            for name, limit in lane_limits.items()
+        }
+        self._in_flight = 0
+        self._seq = itertools.count()
+
+    @asynccontextmanager
+    async def slot(self, lane: str, session_id: str, private: bool = False):
+        """占用一个上游请求槽位
+
+        Args:
+            lane: 通道名称（text/image）
+            session_id: 会话ID，用于公平排队
+            private: 是否为私聊会话
+
+        Raises:
+            SchedulerRejected: 估算或实际等待时间超过上限
+        """
+        lane_state = self._lanes[lane]
+        await self._acquire(lane_state, session_id, self.private_weight if private else 1.0)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(lane_state, time.monotonic() - started)
+
+    def try_acquire(self, lane: str) -> bool:
+        """不排队地占用一个槽位，用于对冲等可以放弃的额外请求，成功后需调用 release
+
+        Args:
+            lane: 通道名称（text/image）
+
+        Returns:
+            bool: 是否占用成功，没有空闲槽位或已有请求在排队时返回False
+        """
+        lane_state = self._lanes[lane]
+        if lane_state.waiting or not self._has_capacity(lane_state):
+            return False
+        # 不计入 granted 和等待时间统计，避免对冲请求拉低平均等待时间
+        self._in_flight += 1
+        lane_state.in_flight += 1
+        return True
+
+    def release(self, lane: str) -> None:
+        """归还 try_acquire 占用的槽位"""
+        self._release(self._lanes[lane], None)
+
+    def estimate_wait(self, lane: str) -> float:
+        """估算新请求在指定通道的等待时间（秒）"""
+        lane_state = self._lanes[lane]
+        if self._has_capacity(lane_state) and lane_state.waiting == 0:
+            return 0.0
+        capacity = min(lane_state.limit, self.max_concurrency)
+        return (lane_state.waiting + 1) / capacity * lane_state.service_time
+
+    def get_stats(self) -> Dict:
+        """获取调度统计信息
+
+        Returns:
+            Dict: 全局和各通道的统计信息
+        """
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self._in_flight,
+            "lanes": {
+                name: {
+                    "limit": lane.limit,
+                    "in_flight": lane.in_flight,
+                    "waiting": lane.waiting,
+                    "avg_wait": round(lane.wait_time, 2),
+                    "max_wait": round(lane.max_wait_time, 2),
+                    "avg_service": round(lane.service_time, 2),
+                    "granted": lane.granted,
+                    "rejected": lane.rejected,
+                    "timed_out": lane.timed_out
+                }
+                for name, lane in self._lanes.items()
+            }
+        }
+
+    async def _acquire(self, lane: _Lane, session_id: str, weight: float) -> None:
+        # 空闲时直接放行
+        if lane.waiting == 0 and self._has_capacity(lane):
+            self._grant(lane, 0.0)
+            return
+
+        estimated = self.estimate_wait(lane.name)
+        if estimated > self.max_wait:
+            lane.rejected += 1
+            logger.warning(f"上游{lane.name}通道排队过长，预计等待{estimated:.1f}秒，拒绝请求")
+            raise SchedulerRejected(lane.name, estimated)
+
+        # 加权公平排队：虚拟完成时间 = max(当前虚拟时间, 该会话上一个请求的完成时间) + 1/权重
+        tag = max(lane.virtual_time, lane.finish_tags.get(session_id, 0.0)) + 1.0 / weight
+        lane.finish_tags[session_id] = tag
+        waiter = _Waiter(lane.name, session_id, asyncio.get_running_loop().create_future())
+        heapq.heappush(lane.heap, (tag, next(self._seq), waiter))
+        lane.waiting += 1
+
+        try:
+            done, _ = await asyncio.wait({waiter.future}, timeout=self.max_wait)
+        except asyncio.CancelledError:
+            self._abandon(lane, waiter)
+            raise
+        if not done:
+            self._abandon(lane, waiter)
+            lane.timed_out += 1
+            raise SchedulerRejected(lane.name, time.monotonic() - waiter.enqueued_at)
+
+    def _abandon(self, lane: _Lane, waiter: _Waiter) -> None:
+        """放弃等待；若槽位已分配则归还"""
+        if waiter.future.done() and not waiter.future.cancelled():
+            self._release(lane, None)
+        else:
+            waiter.future.cancel()
+            lane.waiting -= 1
+
+    def _has_capacity(self, lane: _Lane) -> bool:
+        return self._in_flight < self.max_concurrency and lane.in_flight < lane.limit
+
+    def _grant(self, lane: _Lane, waited: float) -> None:
+        self._in_flight += 1
+        lane.in_flight += 1
+        lane.granted += 1
+        lane.wait_time += self.EWMA_ALPHA * (waited - lane.wait_time)
+        lane.max_wait_time = max(lane.max_wait_time, waited)
+
+    def _release(self, lane: _Lane, service_time: Optional[float]) -> None:
+        self._in_flight -= 1
+        lane.in_flight -= 1
+        if service_time is not None:
+            lane.service_time += self.EWMA_ALPHA * (service_time - lane.service_time)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """将空闲槽位分配给等待中的请求，多个通道都有等待时优先等待最久的通道"""
+        while self._in_flight < self.max_concurrency:
+            candidate = None
+            for lane in self._lanes.values():
+                if lane.in_flight >= lane.limit:
+                    continue
+                # 丢弃已取消的等待者
+                while lane.heap and lane.heap[0][2].future.done():
+                    heapq.heappop(lane.heap)
+                if lane.heap and (candidate is None or lane.heap[0][2].enqueued_at < candidate.heap[0][2].enqueued_at):
+                    candidate = lane
+            if candidate is None:
+                return
+
+            tag, _, waiter = heapq.heappop(candidate.heap)
+            candidate.waiting -= 1
+            candidate.virtual_time = tag
+            self._prune_tags(candidate)
+            self._grant(candidate, time.monotonic() - waiter.enqueued_at)
+            waiter.future.set_result(None)
+
+    def _prune_tags(self, lane: _Lane) -> None:
+        """清理已落后于虚拟时间的会话标记，避免字典无限增长"""
+        if len(lane.finish_tags) > 1024:
+            virtual_time = lane.virtual_time
+            lane.finish_tags = {
+                session_id: tag for session_id, tag in lane.finish_tags.items() if tag > virtual_time
+            }
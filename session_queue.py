@@ -0,0 +1,148 @@
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Tuple
+
+from loguru import logger
+
+
+class QueuedRequest:
+    """队列中的一个请求"""
+
+    __slots__ = ("key", "payload", "users")
+
+    def __init__(self, key: str, payload: Any, user_id: str):
+        """初始化请求
+
+        Args:
+            key: 去重键，相同键的请求会被合并
+            payload: 请求内容，原样传给处理函数
+            user_id: 发起请求的用户ID
+        """
+        self.key = key
+        self.payload = payload
+        self.users: List[str] = [user_id]
+
+    def add_user(self, user_id: str) -> None:
+        """合并一个重复请求的用户"""
+        if user_id not in self.users:
+            self.users.append(user_id)
+
+
+class SessionRequestQueue:
+    """按会话排队处理请求
+
+    每个会话同一时间只处理一个请求，处理期间到达的请求按顺序排队，
+    队列长度超过上限时拒绝新请求。与队列中（或正在处理的）请求相同的新请求会被合并，
+    由同一次回复@所有提问的用户。会话的工作任务在队列清空后退出，不会常驻。
+    """
+
+    # submit() 的返回状态
+    STARTED = "started"
+    QUEUED = "queued"
+    MERGED = "merged"
+    FULL = "full"
+
+    def __init__(self, handler: Callable[[str, Any, List[str]], Awaitable[None]], max_depth: int = 5):
+        """初始化请求队列
+
+        Args:
+            handler: 请求处理函数，参数为 (会话ID, 请求内容, 需要@的用户列表)
+            max_depth: 每个会话最多排队的请求数（不含正在处理的请求）
+        """
+        self.handler = handler
+        self.max_depth = max(0, max_depth)
+
+        self._queues: Dict[str, Deque[QueuedRequest]] = {}
+        self._current: Dict[str, QueuedRequest] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+
+        # 统计信息
+        self.submitted = 0
+        self.merged = 0
+        self.rejected = 0
+
+    def submit(self, session_id: str, key: str, user_id: str, payload: Any) -> Tuple[str, int]:
+        """提交一个请求
+
+        Args:
+            session_id: 会话ID
+            key: 去重键
+            user_id: 发起请求的用户ID
+            payload: 请求内容
+
+        Returns:
+            Tuple[str, int]: (状态, 排队位置)，状态为 started/queued/merged/full 之一，
+            位置为请求前面还有多少个请求
+        """
+        queue = self._queues.get(session_id)
+
+        # 合并与正在处理或排队中相同的请求
+        current = self._current.get(session_id)
+        if current is not None and current.key == key:
+            current.add_user(user_id)
+            self.merged += 1
+            return self.MERGED, 0
+        if queue:
+            for index, request in enumerate(queue):
+                if request.key == key:
+                    request.add_user(user_id)
+                    self.merged += 1
+                    return self.MERGED, index + 1
+
+        if session_id in self._workers:
+            if len(queue) >= self.max_depth:
+                self.rejected += 1
+                return self.FULL, len(queue)
+            queue.append(QueuedRequest(key, payload, user_id))
+            self.submitted += 1
+            return self.QUEUED, len(queue)
+
+        request = QueuedRequest(key, payload, user_id)
+        self._current[session_id] = request
+        self._queues[session_id] = deque()
+        self._workers[session_id] = asyncio.create_task(self._worker(session_id, request))
+        self.submitted += 1
+        return self.STARTED, 0
+
+    async def close(self) -> None:
+        """取消所有会话的处理任务并清空队列"""
+        workers = list(self._workers.values())
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        self._queues.clear()
+        self._current.clear()
+        self._workers.clear()
+
+    def get_stats(self) -> Dict:
+        """获取队列统计信息
+
+        Returns:
+            Dict: 统计信息
+        """
+        return {
+            "active_sessions": len(self._workers),
+            "queued": sum(len(queue) for queue in self._queues.values()),
+            "max_depth": self.max_depth,
+            "submitted": self.submitted,
+            "merged": self.merged,
+            "rejected": self.rejected
+        }
+
+    async def _worker(self, session_id: str, request: QueuedRequest) -> None:
+        """按顺序处理一个会话的请求，队列清空后退出"""
+        queue = self._queues[session_id]
+        try:
+            while True:
+                try:
+                    await self.handler(session_id, request.payload, request.users)
+                except Exception as e:
+                    logger.error(f"处理会话 {session_id} 的排队请求异常: {str(e)}")
+                if not queue:
+                    break
+                request = queue.popleft()
+                self._current[session_id] = request
+        finally:
+            self._current.pop(session_id, None)
+            self._queues.pop(session_id, None)
+            self._workers.pop(session_id, None)
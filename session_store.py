@@ -0,0 +1,297 @@
+import sys
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+
+class ChatMessage:
+    """一条会话消息的紧凑表示"""
+
+    __slots__ = ("role", "content")
+
+    def __init__(self, role: str, content: str):
+        """初始化消息
+
+        Args:
+            role: 消息角色（user/assistant），会被驻留以共享同一字符串对象
+            content: 消息内容
+        """
+        self.role = sys.intern(role)
+        self.content = content
+
+    def to_dict(self) -> Dict[str, str]:
+        """转换为字典形式"""
+        return {"role": self.role, "content": self.content}
+
+
+class _Session:
+    """单个会话的历史记录"""
+
+    __slots__ = ("messages", "summary", "chars", "last_access")
+
+    def __init__(self, max_messages: int):
+        self.messages: Deque[ChatMessage] = deque(maxlen=max_messages)
+        # 因轮数上限被丢弃的消息的摘要
+        self.summary = ""
+        self.chars = 0
+        self.last_access = time.monotonic()
+
+
+class SessionStore:
+    """有界的会话历史存储
+
+    - 每个会话最多保留 max_history 轮对话（一问一答为一轮），超出时丢弃最旧的消息
+    - 按最近访问顺序（LRU）排列会话，空闲超过 ttl 秒的会话会被淘汰
+    - 会话总数和所有消息的总字符数都有全局上限，超出时淘汰最久未访问的会话
+
+    配置了 summarizer 时，因轮数上限丢弃的消息会并入该会话的滚动摘要（只保存在内存中）。
+
+    配置了持久化后端时，新消息会同时写入后端；不在内存中的会话在首次使用时
+    通过 ensure_loaded() 从后端加载，因此启动时间与已保存的会话数无关。
+    """
+
+    def __init__(self, max_history: int = 10, ttl: float = 86400, max_sessions: int = 1000,
+                 max_total_chars: int = 5_000_000, backend=None,
+                 summarizer: Optional[Callable[[str, str, str], str]] = None):
+        """初始化会话存储
+
+        Args:
+            max_history: 每个会话保留的最大对话轮数
+            ttl: 会话空闲过期时间（秒），小于等于0表示不过期
+            max_sessions: 最大会话数
+            max_total_chars: 所有会话消息的总字符数上限
+            backend: 可选的持久化后端，如 SQLiteConversationBackend
+            summarizer: 可选的摘要函数 (摘要, 角色, 内容) -> 新摘要，如 ContextBuilder.summarize
+        """
+        self.backend = backend
+        self.summarizer = summarizer
+        self.max_history = max(1, max_history)
+        self.ttl = ttl
+        self.max_sessions = max(1, max_sessions)
+        self.max_total_chars = max_total_chars
+
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._total_chars = 0
+        # 正在从后端加载的会话数及其加载期间被清除的次数，用于丢弃清除前读到的历史
+        self._loading: Dict[str, int] = {}
+        self._clears: Dict[str, int] = {}
+
+        # 统计信息
+        self.hits = 0
+        self.misses = 0
+        self.evictions = {"ttl": 0, "lru": 0, "memory": 0}
+
+    def __contains__(self, session_id: str) -> bool:
+        return self._touch(session_id, count=False) is not None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get(self, session_id: str) -> List[Dict[str, str]]:
+        """获取会话历史
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            List[Dict[str, str]]: 会话历史消息列表，会话不存在时返回空列表
+        """
+        session = self._touch(session_id)
+        if session is None:
+            return []
+        return [message.to_dict() for message in session.messages]
+
+    def get_context(self, session_id: str) -> Tuple[List[Dict[str, str]], str]:
+        """获取组装提示词用的会话历史和摘要（不计入命中统计）
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            Tuple[List[Dict[str, str]], str]: (会话历史消息列表, 已丢弃消息的摘要)
+        """
+        session = self._touch(session_id, count=False)
+        if session is None:
+            return [], ""
+        return [message.to_dict() for message in session.messages], session.summary
+
+    async def open(self) -> None:
+        """打开持久化后端"""
+        if self.backend is not None:
+            await self.backend.open()
+
+    async def close(self) -> None:
+        """关闭持久化后端，提交未写入的消息"""
+        if self.backend is not None:
+            await self.backend.close()
+
+    async def ensure_loaded(self, session_id: str) -> None:
+        """确保会话历史已加载到内存，不在内存中时从持久化后端读取
+
+        Args:
+            session_id: 会话ID
+        """
+        if self.backend is None or session_id in self._sessions:
+            return
+        generation = self._clears.get(session_id, 0)
+        self._loading[session_id] = self._loading.get(session_id, 0) + 1
+        try:
+            rows = await self.backend.load(session_id, self.max_history * 2)
+            cleared = self._clears.get(session_id, 0) != generation
+        finally:
+            self._loading[session_id] -= 1
+            if not self._loading[session_id]:
+                del self._loading[session_id]
+                self._clears.pop(session_id, None)
+        if session_id in self._sessions:
+            # 等待读取期间已有新消息写入
+            return
+        if cleared:
+            # 等待读取期间会话已被清除，读到的是清除前的历史
+            return
+        for role, content in rows:
+            self._append(session_id, role, content)
+        if rows:
+            logger.debug(f"已从持久化存储加载会话 {session_id}，共 {len(rows)} 条消息")
+
+    def append(self, session_id: str, role: str, content: str) -> None:
+        """向会话追加一条消息
+
+        Args:
+            session_id: 会话ID
+            role: 消息角色
+            content: 消息内容
+        """
+        self._append(session_id, role, content)
+        if self.backend is not None:
+            self.backend.enqueue_append(session_id, role, content)
+
+    def _append(self, session_id: str, role: str, content: str) -> None:
+        """向内存中的会话追加一条消息"""
+        session = self._touch(session_id, count=False)
+        if session is None:
+            session = _Session(self.max_history * 2)
+            self._sessions[session_id] = session
+
+        messages = session.messages
+        if len(messages) == messages.maxlen:
+            # deque会自动丢弃最旧的消息，这里同步扣减字符计数
+            dropped = messages[0]
+            session.chars -= len(dropped.content)
+            self._total_chars -= len(dropped.content)
+            if self.summarizer is not None:
+                summary = self.summarizer(session.summary, dropped.role, dropped.content)
+                delta = len(summary) - len(session.summary)
+                session.summary = summary
+                session.chars += delta
+                self._total_chars += delta
+        messages.append(ChatMessage(role, content))
+        session.chars += len(content)
+        self._total_chars += len(content)
+
+        self._enforce_limits(keep=session_id)
+
+    def add_turn(self, session_id: str, user_content: str, assistant_content: str) -> None:
+        """追加一轮完整对话
+
+        Args:
+            session_id: 会话ID
+            user_content: 用户消息
+            assistant_content: AI回复
+        """
+        self.append(session_id, "user", user_content)
+        self.append(session_id, "assistant", assistant_content)
+
+    def clear(self, session_id: str) -> None:
+        """清除会话历史
+
+        Args:
+            session_id: 会话ID
+        """
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._total_chars -= session.chars
+        if session_id in self._loading:
+            self._clears[session_id] = self._clears.get(session_id, 0) + 1
+        if self.backend is not None:
+            self.backend.enqueue_clear(session_id)
+
+    def evict_expired(self) -> int:
+        """淘汰所有空闲过期的会话
+
+        Returns:
+            int: 淘汰的会话数
+        """
+        if self.ttl <= 0:
+            return 0
+        deadline = time.monotonic() - self.ttl
+        evicted = 0
+        # 会话按访问时间排序，从最旧的开始检查即可
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_access > deadline:
+                break
+            self._remove(session_id, "ttl")
+            evicted += 1
+        return evicted
+
+    def get_stats(self) -> Dict:
+        """获取存储统计信息
+
+        Returns:
+            Dict: 统计信息
+        """
+        stats = {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "total_chars": self._total_chars,
+            "max_total_chars": self.max_total_chars,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": dict(self.evictions)
+        }
+        if self.backend is not None:
+            stats["backend"] = self.backend.get_stats()
+        return stats
+
+    def _touch(self, session_id: str, count: bool = True) -> Optional[_Session]:
+        """查找会话并更新访问时间，已过期的会话会被淘汰"""
+        session = self._sessions.get(session_id)
+        now = time.monotonic()
+        if session is not None and self.ttl > 0 and now - session.last_access > self.ttl:
+            self._remove(session_id, "ttl")
+            session = None
+        if session is None:
+            if count:
+                self.misses += 1
+            return None
+        if count:
+            self.hits += 1
+        session.last_access = now
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _enforce_limits(self, keep: str) -> None:
+        """执行过期、数量和内存上限淘汰，keep指定的会话不会因容量被淘汰"""
+        self.evict_expired()
+        while len(self._sessions) > self.max_sessions:
+            oldest = next(iter(self._sessions))
+            if oldest == keep:
+                break
+            self._remove(oldest, "lru")
+        while self.max_total_chars > 0 and self._total_chars > self.max_total_chars and len(self._sessions) > 1:
+            oldest = next(iter(self._sessions))
+            if oldest == keep:
+                break
+            self._remove(oldest, "memory")
+
+    def _remove(self, session_id: str, reason: str) -> None:
+        """移除会话并记录淘汰原因"""
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return
+        self._total_chars -= session.chars
+        self.evictions[reason] += 1
+        logger.debug(f"淘汰会话 {session_id}，原因: {reason}")
@@ -0,0 +1,271 @@
+import json
+import re
+from typing import List, Optional
+
+
+class SSEEvent:
+    """一个完整的SSE事件"""
+
+    __slots__ = ("event", "data")
+
+    def __init__(self, event: str, data: bytes):
+        """初始化SSE事件
+
+        Args:
+            event: 事件类型，未指定时为"message"
+            data: 事件数据（多行data字段以换行符拼接）
+        """
+        self.event = event
+        self.data = data
+
+    @property
+    def is_done(self) -> bool:
+        """是否为流结束标记[DONE]"""
+        return self.data.strip() == b"[DONE]"
+
+    @property
+    def text(self) -> str:
+        """事件数据的文本形式"""
+        return self.data.decode("utf-8", errors="replace")
+
+    def json(self):
+        """将事件数据解析为JSON，数据不是JSON对象或数组时返回None
+
+        Returns:
+            解析后的JSON对象，解析失败时返回None
+        """
+        data = self.data.lstrip()
+        # 先做字节级前缀检查，避免对明显不是JSON的数据调用json.loads
+        if not data or data[:1] not in (b"{", b"["):
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            return None
+
+    def __repr__(self) -> str:
+        return f"SSEEvent(event={self.event!r}, data={self.data[:80]!r})"
+
+
+class SSEDecoder:
+    """增量式SSE解码器
+
+    按照SSE规范逐字节块解析事件流：支持多行data字段、event字段与随后数据配对、
+    注释行以及\\r\\n/\\n/\\r三种行结束符。所有前缀判断都在字节层面完成，
+    单行和单个事件的大小都有上限，因此无论响应流多长，内存占用都是有界的。
+
+    为兼容不规范的服务端，也接受两种宽松格式：
+    - 没有空行分隔的连续data行（前一条数据已是完整JSON时立即分发）
+    - 不带字段前缀、直接以JSON开头的行
+    """
+
+    def __init__(self, max_line_bytes: int = 1024 * 1024, max_event_bytes: int = 4 * 1024 * 1024):
+        """初始化解码器
+
+        Args:
+            max_line_bytes: 单行最大字节数，超出的行将被丢弃
+            max_event_bytes: 单个事件数据最大字节数，超出的事件将被丢弃
+        """
+        self.max_line_bytes = max_line_bytes
+        self.max_event_bytes = max_event_bytes
+
+        self._buffer = bytearray()
+        self._discarding = False  # 正在丢弃超长行的剩余部分
+        self._event_type: Optional[str] = None
+        self._data_lines: List[bytes] = []
+        self._data_size = 0
+        self._data_overflow = False
+
+        # 统计信息
+        self.line_count = 0
+        self.event_count = 0
+        self.dropped_count = 0
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        """输入一段字节数据，返回其中已完整的事件
+
+        Args:
+            chunk: 从响应流读取的字节块，可以在任意位置截断
+
+        Returns:
+            List[SSEEvent]: 本次解析出的完整事件
+        """
+        events: List[SSEEvent] = []
+        buffer = self._buffer
+        buffer += chunk
+
+        pos = 0
+        length = len(buffer)
+        while pos < length:
+            nl = buffer.find(b"\n", pos)
+            cr = buffer.find(b"\r", pos, nl if nl >= 0 else length)
+            if cr >= 0:
+                # \r结尾的行需要看下一个字节是否为\n，位于缓冲末尾时等待更多数据
+                if cr + 1 >= length:
+                    break
+                end = cr
+                next_pos = cr + 2 if buffer[cr + 1] == 0x0A else cr + 1
+            elif nl >= 0:
+                end = nl
+                next_pos = nl + 1
+            else:
+                break
+
+            if self._discarding:
+                self._discarding = False
+            else:
+                self._process_line(bytes(buffer[pos:end]), events)
+            pos = next_pos
+
+        if pos:
+            del buffer[:pos]
+
+        # 未结束的行超过上限时丢弃，直到遇到下一个行结束符
+        if len(buffer) > self.max_line_bytes:
+            buffer.clear()
+            self._discarding = True
+            self.dropped_count += 1
+
+        return events
+
+    def flush(self) -> List[SSEEvent]:
+        """流结束时调用，分发缓冲中剩余的行和事件
+
+        Returns:
+            List[SSEEvent]: 剩余的完整事件
+        """
+        events: List[SSEEvent] = []
+        if self._buffer and not self._discarding:
+            line = bytes(self._buffer).rstrip(b"\r")
+            self._process_line(line, events)
+        self._buffer.clear()
+        self._discarding = False
+        self._dispatch(events)
+        return events
+
+    def _process_line(self, line: bytes, events: List[SSEEvent]) -> None:
+        """处理一个完整的行"""
+        self.line_count += 1
+
+        # 空行表示事件结束
+        if not line:
+            self._dispatch(events)
+            return
+
+        # 注释行
+        if line[:1] == b":":
+            return
+
+        colon = line.find(b":")
+        if colon < 0:
+            name, value = line, b""
+        else:
+            name = line[:colon]
+            value = line[colon + 1:]
+            if value[:1] == b" ":
+                value = value[1:]
+
+        if name == b"data":
+            # 兼容不以空行分隔事件的服务端：前一条数据已是完整JSON时先分发
+            if self._data_lines and value[:1] in (b"{", b"[") and self._pending_is_complete():
+                self._dispatch(events)
+            self._append_data(value)
+        elif name == b"event":
+            self._event_type = value.decode("utf-8", errors="replace").strip()
+        elif name in (b"id", b"retry"):
+            pass
+        elif line.lstrip()[:1] == b"{":
+            # 宽松格式：直接以JSON开头的行视为独立事件
+            self._dispatch(events)
+            self.event_count += 1
+            events.append(SSEEvent("message", line.strip()))
+
+    def _append_data(self, value: bytes) -> None:
+        """追加一行data字段，超出事件大小上限时标记丢弃"""
+        if self._data_overflow:
+            return
+        self._data_size += len(value) + 1
+        if self._data_size > self.max_event_bytes:
+            self._data_overflow = True
+            self._data_lines = []
+            return
+        self._data_lines.append(value)
+
+    def _pending_is_complete(self) -> bool:
+        """判断当前缓存的数据是否已是完整的JSON值"""
+        if len(self._data_lines) != 1:
+            return False
+        pending = self._data_lines[0].strip()
+        if pending[-1:] not in (b"}", b"]"):
+            return False
+        try:
+            json.loads(pending)
+            return True
+        except ValueError:
+            return False
+
+    def _dispatch(self, events: List[SSEEvent]) -> None:
+        """分发当前缓存的事件并重置状态"""
+        if self._data_overflow:
+            self.dropped_count += 1
+        elif self._data_lines:
+            data = self._data_lines[0] if len(self._data_lines) == 1 else b"\n".join(self._data_lines)
+            self.event_count += 1
+            events.append(SSEEvent(self._event_type or "message", data))
+        self._event_type = None
+        self._data_lines = []
+        self._data_size = 0
+        self._data_overflow = False
+
+
+class ContentFallbackScanner:
+    """备用内容扫描器
+
+    常规解析未能提取内容时，通过字符串搜索从无法识别的数据中提取"content"字段。
+    扫描是增量进行的：一旦常规解析得到内容就停止扫描并释放已收集的片段，
+    已收集的片段总大小也有上限。
+    """
+
+    _CONTENT_PATTERN = re.compile(rb'"content":\s?"((?:[^"\\]|\\.)*)"')
+
+    def __init__(self, max_chars: int = 1024 * 1024):
+        """初始化扫描器
+
+        Args:
+            max_chars: 收集的片段总字符数上限
+        """
+        self.max_chars = max_chars
+        self.enabled = True
+        self._fragments: List[str] = []
+        self._size = 0
+
+    def scan(self, data: bytes) -> None:
+        """扫描一段未被常规解析识别的数据
+
+        Args:
+            data: 事件数据
+        """
+        if not self.enabled or b'"content"' not in data:
+            return
+        for match in self._CONTENT_PATTERN.finditer(data):
+            raw = match.group(1)
+            try:
+                content = json.loads(b'"' + raw + b'"')
+            except ValueError:
+                content = raw.decode("utf-8", errors="replace")
+            if not content:
+                continue
+            if self._size + len(content) > self.max_chars:
+                return
+            self._fragments.append(content)
+            self._size += len(content)
+
+    def disable(self) -> None:
+        """常规解析已得到内容，停止扫描并释放片段"""
+        self.enabled = False
+        self._fragments = []
+        self._size = 0
+
+    def result(self) -> str:
+        """获取扫描得到的完整内容"""
+        return "".join(self._fragments)
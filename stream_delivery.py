@@ -0,0 +1,160 @@
+import asyncio
+import time
+from typing import AsyncIterator, Awaitable, Callable, List, Optional
+
+# 句子结束符，分段时优先在这些字符之后切分
+SENTENCE_ENDINGS = "。！？!?；;…\n"
+
+
+class StreamSegmenter:
+    """将流式回复切分为适合逐条发送的消息段
+
+    - 优先在段落（空行）处切分，其次在句子结束符处切分
+    - 缓冲达到 min_chars 时按边界切出一段；首段使用更小的阈值，尽快让用户看到内容
+    - 每段不超过 max_chars（微信单条消息长度限制），没有合适边界时强制切分
+    - 距离上次发送超过刷新间隔时，即使未达到大小阈值也在最近的边界处切出一段
+    """
+
+    def __init__(self, max_chars: int = 1500, min_chars: int = 200, first_min_chars: int = 20):
+        """初始化分段器
+
+        Args:
+            max_chars: 单段最大字符数
+            min_chars: 按大小切分的最小字符数
+            first_min_chars: 首段按大小切分的最小字符数
+        """
+        self.max_chars = max(1, max_chars)
+        self.min_chars = min(min_chars, self.max_chars)
+        self.first_min_chars = min(first_min_chars, self.min_chars)
+
+        self._buffer = ""
+        self.segments = 0
+        self.last_emit = time.monotonic()
+
+    def feed(self, text: str) -> List[str]:
+        """追加一段流式内容
+
+        Args:
+            text: 新收到的内容
+
+        Returns:
+            List[str]: 已可发送的消息段
+        """
+        self._buffer += text
+        ready = []
+        while True:
+            threshold = self.first_min_chars if self.segments == 0 else self.min_chars
+            if len(self._buffer) < threshold:
+                break
+            cut = self._find_cut(threshold)
+            if cut is None:
+                break
+            ready.append(self._take(cut))
+        return ready
+
+    def flush_due(self) -> Optional[str]:
+        """刷新间隔已到时调用，在最近的边界处切出一段
+
+        Returns:
+            Optional[str]: 可发送的消息段，没有合适内容时返回None
+        """
+        if not self._buffer.strip():
+            return None
+        cut = self._find_cut(1)
+        if cut is None and len(self._buffer) >= self.first_min_chars:
+            cut = len(self._buffer)
+        if cut is None:
+            return None
+        return self._take(cut)
+
+    def finish(self) -> List[str]:
+        """流结束时调用，返回剩余的所有消息段"""
+        ready = []
+        while self._buffer:
+            cut = self._find_cut(1) if len(self._buffer) > self.max_chars else len(self._buffer)
+            ready.append(self._take(cut or self.max_chars))
+        return [segment for segment in ready if segment.strip()]
+
+    def _find_cut(self, min_pos: int) -> Optional[int]:
+        """在缓冲的前 max_chars 个字符内查找切分位置"""
+        window = self._buffer[:self.max_chars]
+        paragraph = window.rfind("\n\n")
+        if paragraph >= 0 and paragraph + 2 >= min_pos:
+            return paragraph + 2
+        for pos in range(len(window) - 1, min_pos - 2, -1):
+            if window[pos] in SENTENCE_ENDINGS:
+                return pos + 1
+        if len(self._buffer) >= self.max_chars:
+            # 缓冲已满，退而求其次使用更靠前的边界，实在没有才强制切分
+            return self._find_cut(1) if min_pos > 1 else self.max_chars
+        return None
+
+    def _take(self, cut: int) -> str:
+        segment, self._buffer = self._buffer[:cut], self._buffer[cut:]
+        self.segments += 1
+        self.last_emit = time.monotonic()
+        return segment.strip("\n")
+
+
+async def deliver_stream(chunks: AsyncIterator[str], segmenter: StreamSegmenter,
+                         send: Callable[[str], Awaitable[None]], flush_interval: float = 2.0) -> str:
+    """边接收流式回复边分段发送
+
+    读取流在单独的任务中进行，即使上游暂时没有新内容，到达刷新间隔时也能发送已缓冲的内容。
+
+    Args:
+        chunks: 流式回复
+        segmenter: 分段器
+        send: 发送一段消息的协程函数
+        flush_interval: 按时间刷新的间隔（秒）
+
+    Returns:
+        str: 完整的回复内容
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    done = object()
+
+    async def produce():
+        try:
+            async for chunk in chunks:
+                await queue.put(chunk)
+        except Exception as e:
+            await queue.put(e)
+        finally:
+            await queue.put(done)
+
+    async def emit(segment: Optional[str]):
+        if segment and segment.strip():
+            await send(segment)
+
+    producer = asyncio.create_task(produce())
+    parts: List[str] = []
+    try:
+        while True:
+            timeout = max(0.0, flush_interval - (time.monotonic() - segmenter.last_emit))
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                segment = segmenter.flush_due()
+                if segment:
+                    await emit(segment)
+                else:
+                    # 没有可发送的内容，重新计时
+                    segmenter.last_emit = time.monotonic()
+                continue
+
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            parts.append(item)
+            for segment in segmenter.feed(item):
+                await emit(segment)
+
+        for segment in segmenter.finish():
+            await emit(segment)
+    finally:
+        if not producer.done():
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+    return "".join(parts)
@@ -0,0 +1,138 @@
+import asyncio
+import time
+from typing import Awaitable, Dict, Optional, Tuple, TypeVar
+
+import aiohttp
+
+T = TypeVar("T")
+
+# 可以按请求类型和模型配置的阶段超时
+PHASES = ("connect", "first_byte", "idle", "total")
+
+
+class StreamStalled(asyncio.TimeoutError):
+    """流式请求在某个阶段超时"""
+
+    def __init__(self, phase: str, seconds: float):
+        """初始化异常
+
+        Args:
+            phase: 超时的阶段，first_byte（等待首个数据）/idle（数据之间停顿）/total（总时长）
+            seconds: 该阶段的超时时间（秒）
+        """
+        super().__init__(f"{phase} 超时（{seconds}秒）")
+        self.phase = phase
+        self.seconds = seconds
+
+
+class PhaseTimeouts:
+    """一次流式请求各阶段的超时时间（秒），小于等于0表示不限制
+
+    - connect: 建立TCP连接
+    - first_byte: 从发出请求到收到第一块响应体，包括模型开始输出前的等待
+    - idle: 收到第一块之后，相邻两块数据之间的最长间隔
+    - total: 整个请求的最长时间
+    """
+
+    __slots__ = PHASES
+
+    def __init__(self, connect: float = 10, first_byte: float = 30, idle: float = 20, total: float = 60):
+        self.connect = connect
+        self.first_byte = first_byte
+        self.idle = idle
+        self.total = total
+
+    def merged(self, overrides: Dict) -> "PhaseTimeouts":
+        """返回用overrides中的值覆盖后的新配置"""
+        values = {phase: overrides.get(phase, getattr(self, phase)) for phase in PHASES}
+        return PhaseTimeouts(**values)
+
+    def client_timeout(self) -> aiohttp.ClientTimeout:
+        """aiohttp只负责连接超时，其余阶段由 StreamDeadline 控制"""
+        return aiohttp.ClientTimeout(total=None, sock_connect=self.connect if self.connect > 0 else None)
+
+    def deadline(self) -> "StreamDeadline":
+        """开始计时"""
+        return StreamDeadline(self)
+
+
+class StreamDeadline:
+    """跟踪一次请求所处的阶段，为每次等待计算剩余时间"""
+
+    __slots__ = ("timeouts", "started", "received")
+
+    def __init__(self, timeouts: PhaseTimeouts):
+        self.timeouts = timeouts
+        self.started = time.monotonic()
+        # 是否已收到第一块响应体
+        self.received = False
+
+    def next_timeout(self) -> Tuple[Optional[float], str]:
+        """计算下一次等待的超时时间和对应的阶段
+
+        Returns:
+            Tuple[Optional[float], str]: (剩余秒数，None表示不限制, 阶段)
+        """
+        timeouts = self.timeouts
+        elapsed = time.monotonic() - self.started
+        if self.received:
+            timeout, phase = (timeouts.idle, "idle") if timeouts.idle > 0 else (None, "idle")
+        elif timeouts.first_byte > 0:
+            timeout, phase = timeouts.first_byte - elapsed, "first_byte"
+        else:
+            timeout, phase = None, "first_byte"
+        if timeouts.total > 0:
+            remaining = timeouts.total - elapsed
+            if timeout is None or remaining < timeout:
+                timeout, phase = remaining, "total"
+        return timeout, phase
+
+    async def wait(self, awaitable: Awaitable[T]) -> T:
+        """在当前阶段的剩余时间内等待
+
+        Raises:
+            StreamStalled: 超时
+        """
+        timeout, phase = self.next_timeout()
+        if timeout is None:
+            return await awaitable
+        try:
+            return await asyncio.wait_for(awaitable, max(timeout, 0))
+        except asyncio.TimeoutError:
+            raise StreamStalled(phase, getattr(self.timeouts, phase)) from None
+
+
+class TimeoutPolicy:
+    """按请求类型和模型解析阶段超时"""
+
+    def __init__(self, defaults: Dict[str, PhaseTimeouts], model_overrides: Optional[Dict[str, Dict]] = None):
+        """初始化超时策略
+
+        Args:
+            defaults: 请求类型（chat/image）到默认超时的映射
+            model_overrides: 模型名到覆盖值的映射，如 {"openai/o1": {"first_byte": 120}}
+        """
+        self.defaults = defaults
+        self.model_overrides = model_overrides or {}
+        self._resolved: Dict[Tuple[str, str], PhaseTimeouts] = {}
+
+    def resolve(self, kind: str, model: str) -> PhaseTimeouts:
+        """获取某类请求使用某个模型时的超时
+
+        Args:
+            kind: 请求类型，chat 或 image
+            model: 模型名
+
+        Returns:
+            PhaseTimeouts: 超时配置
+        """
+        overrides = self.model_overrides.get(model)
+        if not overrides:
+            # 模型名可能来自用户输入，只缓存配置了覆盖值的模型
+            return self.defaults.get(kind) or PhaseTimeouts()
+        key = (kind, model)
+        timeouts = self._resolved.get(key)
+        if timeouts is None:
+            timeouts = (self.defaults.get(kind) or PhaseTimeouts()).merged(overrides)
+            self._resolved[key] = timeouts
+        return timeouts
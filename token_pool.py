@@ -0,0 +1,220 @@
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+# 上游错误信息中表示配额或余额不足的关键词（小写）
+QUOTA_ERROR_KEYWORDS = ("quota", "insufficient", "balance", "credit", "额度", "余额", "配额", "次数")
+
+# 表示令牌无效的HTTP状态码
+AUTH_ERROR_STATUSES = (401, 403)
+
+# 表示配额不足或被限流的HTTP状态码
+QUOTA_ERROR_STATUSES = (402, 429)
+
+
+def is_quota_error(text: str) -> bool:
+    """判断上游错误信息是否表示配额不足"""
+    text = text.lower()
+    return any(keyword in text for keyword in QUOTA_ERROR_KEYWORDS)
+
+
+def parse_available(data) -> Optional[float]:
+    """从配额接口的返回数据中读取可用余额，无法识别时返回None"""
+    if not isinstance(data, dict):
+        return None
+    available = data.get("available")
+    if available is None and isinstance(data.get("data"), dict):
+        available = data["data"].get("available")
+    try:
+        return float(available)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenState:
+    """一个API令牌的状态"""
+
+    __slots__ = ("index", "token", "label", "share", "outstanding", "available",
+                 "ejected_until", "eject_reason", "quota_ejected", "requests", "ejections")
+
+    def __init__(self, index: int, token: str, share: int):
+        self.index = index
+        self.token = token
+        # 日志和统计中只显示令牌的首尾几位
+        self.label = f"#{index + 1}({token[:4]}…{token[-4:]})" if len(token) > 12 else f"#{index + 1}"
+        # 该令牌可使用的并发连接份额
+        self.share = share
+        self.outstanding = 0
+        # 最近一次查询到的可用余额，未知时为None
+        self.available: Optional[float] = None
+        self.ejected_until = 0.0
+        self.eject_reason = ""
+        # 是否因配额不足被移出，查询到余额恢复后可以提前恢复
+        self.quota_ejected = False
+        self.requests = 0
+        self.ejections = 0
+
+    def is_ejected(self, now: float) -> bool:
+        return now < self.ejected_until
+
+    def is_exhausted(self) -> bool:
+        return self.available is not None and self.available <= 0
+
+
+class TokenPool:
+    """多个API令牌组成的账号池
+
+    - 新会话分配给进行中请求数（相对于连接份额）最少的令牌，相同时优先可用余额多、累计请求少的令牌
+    - 同一个 conversation_id 固定使用同一个令牌，上游按账号保存对话上下文
+    - 返回认证错误或配额不足的令牌会被暂时移出，到期后自动恢复；已固定到该令牌的会话改用其他令牌
+    """
+
+    def __init__(self, tokens: List[str], pool_limit_per_host: int = 20, eject_seconds: float = 60,
+                 quota_eject_seconds: float = 600, max_affinity: int = 10000,
+                 costs: Optional[Dict[str, float]] = None):
+        """初始化账号池
+
+        Args:
+            tokens: API令牌列表
+            pool_limit_per_host: 连接池单个主机的连接数上限，平均分给各令牌
+            eject_seconds: 认证失败或被限流的令牌移出的时间（秒）
+            quota_eject_seconds: 配额不足的令牌移出的时间（秒）
+            max_affinity: 最多记录多少个会话与令牌的对应关系
+            costs: 每类请求（chat/image）成功后在本地预扣的余额，两次查询配额之间用于估算余额
+        """
+        # 去掉空令牌和重复令牌，一个都没有时保留空令牌，请求会由上游返回认证错误
+        tokens = [token for token in dict.fromkeys(tokens) if token] or [""]
+        share = max(1, pool_limit_per_host // max(1, len(tokens)))
+        self.tokens = [TokenState(index, token, share) for index, token in enumerate(tokens)]
+        self.eject_seconds = eject_seconds
+        self.quota_eject_seconds = quota_eject_seconds
+        self.max_affinity = max_affinity
+        self._affinity: "OrderedDict[str, int]" = OrderedDict()
+        self.costs = costs or {}
+
+        # 统计信息
+        self.reassigned = 0
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def acquire(self, conversation_id: Optional[str] = None) -> TokenState:
+        """为一次请求选择令牌，请求结束后需调用 release
+
+        Args:
+            conversation_id: 会话ID，为空则不固定令牌
+
+        Returns:
+            TokenState: 选中的令牌
+        """
+        now = time.monotonic()
+        state = None
+        if conversation_id:
+            index = self._affinity.get(conversation_id)
+            if index is not None:
+                state = self.tokens[index]
+                if state.is_ejected(now) or state.is_exhausted():
+                    self.reassigned += 1
+                    state = None
+                else:
+                    self._affinity.move_to_end(conversation_id)
+        if state is None:
+            state = self._pick(now)
+            if conversation_id:
+                self._affinity[conversation_id] = state.index
+                self._affinity.move_to_end(conversation_id)
+                if len(self._affinity) > self.max_affinity:
+                    self._affinity.popitem(last=False)
+        state.outstanding += 1
+        state.requests += 1
+        return state
+
+    def release(self, state: TokenState) -> None:
+        """请求结束，归还令牌"""
+        state.outstanding -= 1
+
+    def eject(self, state: TokenState, reason: str, seconds: Optional[float] = None, quota: bool = False) -> None:
+        """暂时移出一个令牌
+
+        Args:
+            state: 令牌
+            reason: 原因，显示在统计中
+            seconds: 移出时间（秒），为空时使用 eject_seconds
+            quota: 是否因配额不足移出，是则查询到余额恢复后提前恢复
+        """
+        if len(self.tokens) <= 1:
+            return
+        seconds = self.eject_seconds if seconds is None else seconds
+        was_ejected = state.is_ejected(time.monotonic())
+        state.ejected_until = time.monotonic() + seconds
+        state.eject_reason = reason
+        state.quota_ejected = quota
+        if not was_ejected:
+            state.ejections += 1
+            logger.warning(f"API令牌 {state.label} 暂停使用{seconds}秒: {reason}")
+
+    def record_status(self, state: TokenState, status: int) -> None:
+        """根据上游返回的HTTP状态码判断是否需要移出令牌"""
+        if status in AUTH_ERROR_STATUSES:
+            self.eject(state, f"认证失败 HTTP {status}")
+        elif status in QUOTA_ERROR_STATUSES:
+            quota = status == 402
+            self.eject(state, f"配额不足或被限流 HTTP {status}",
+                       self.quota_eject_seconds if quota else self.eject_seconds, quota=quota)
+
+    def record_error(self, state: TokenState, message: str) -> None:
+        """根据上游的业务错误信息判断是否需要移出令牌"""
+        if is_quota_error(message):
+            self.eject(state, "配额不足", self.quota_eject_seconds, quota=True)
+
+    def consume(self, state: TokenState, kind: str) -> None:
+        """请求成功后在本地预扣余额，下次查询配额时以上游数据为准"""
+        cost = self.costs.get(kind, 0)
+        if cost and state.available is not None:
+            state.available -= cost
+
+    def update_quota(self, state: TokenState, data) -> None:
+        """记录配额接口返回的可用余额，余额恢复后令牌重新参与分配"""
+        available = parse_available(data)
+        if available is None:
+            return
+        state.available = available
+        if available > 0 and state.quota_ejected:
+            state.ejected_until = 0.0
+            state.quota_ejected = False
+
+    def get_stats(self) -> Dict:
+        """获取账号池统计信息"""
+        now = time.monotonic()
+        return {
+            "affinity": len(self._affinity),
+            "reassigned": self.reassigned,
+            "tokens": [
+                {
+                    "label": state.label,
+                    "outstanding": state.outstanding,
+                    "share": state.share,
+                    "available": state.available,
+                    "requests": state.requests,
+                    "ejections": state.ejections,
+                    "ejected": state.is_ejected(now),
+                    "eject_reason": state.eject_reason if state.is_ejected(now) else "",
+                    "retry_after": round(max(0.0, state.ejected_until - now), 1)
+                }
+                for state in self.tokens
+            ]
+        }
+
+    def _pick(self, now: float) -> TokenState:
+        """选出负载最低的可用令牌，全部不可用时选最早恢复的令牌"""
+        candidates = [state for state in self.tokens if not state.is_ejected(now) and not state.is_exhausted()]
+        if not candidates:
+            return min(self.tokens, key=lambda state: (state.ejected_until, state.outstanding))
+        return min(
+            candidates,
+            key=lambda state: (state.outstanding / state.share,
+                               -(state.available if state.available is not None else 0.0),
+                               state.requests)
+        )
@@ -0,0 +1,193 @@
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class SensitiveWordFilter:
+    """基于Aho-Corasick自动机的敏感词过滤器
+
+    自动机在初始化时由词表一次性构建，之后每次检查只需对文本扫描一遍，
+    耗时与文本长度成正比，与词表大小无关。匹配不区分大小写。
+    """
+
+    def __init__(self, words: Iterable[str], replace_with: str = "***"):
+        """构建过滤器
+
+        Args:
+            words: 敏感词列表，空白词会被忽略
+            replace_with: 替换模式下用于替换敏感词的文本
+        """
+        self.replace_with = replace_with
+
+        # 节点0为根节点；goto为转移表，fail为失配指针，
+        # depth为节点对应前缀的长度，match为以该节点结尾的最长敏感词长度（含失配链上的词）
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._depth: List[int] = [0]
+        self._match: List[int] = [0]
+        self.word_count = 0
+        self.max_word_length = 0
+
+        for word in words:
+            word = word.strip().lower() if isinstance(word, str) else ""
+            if word:
+                self._add(word)
+        self._build()
+
+    def __bool__(self) -> bool:
+        return self.word_count > 0
+
+    def find(self, text: str) -> Optional[str]:
+        """查找文本中的第一个敏感词
+
+        Args:
+            text: 待检查的文本
+
+        Returns:
+            Optional[str]: 命中的敏感词（原文），未命中时返回None
+        """
+        if not self.word_count:
+            return None
+        state = 0
+        for index, char in enumerate(text):
+            state = self._step(state, char)
+            length = self._match[state]
+            if length:
+                return text[index + 1 - length:index + 1]
+        return None
+
+    def replace(self, text: str) -> str:
+        """将文本中的敏感词替换为 replace_with，相邻或重叠的敏感词合并替换一次
+
+        Args:
+            text: 待过滤的文本
+
+        Returns:
+            str: 过滤后的文本
+        """
+        if not self.word_count:
+            return text
+        spans, _ = self._scan(text, 0, 0, [])
+        return self._apply(text, spans, len(text))
+
+    def stream(self) -> "StreamWordFilter":
+        """创建一个用于过滤流式文本的过滤器"""
+        return StreamWordFilter(self)
+
+    def _add(self, word: str) -> None:
+        state = 0
+        for char in word:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._depth.append(self._depth[state] + 1)
+                self._match.append(0)
+                self._goto[state][char] = next_state
+            state = next_state
+        if not self._match[state]:
+            self.word_count += 1
+        self._match[state] = len(word)
+        self.max_word_length = max(self.max_word_length, len(word))
+
+    def _build(self) -> None:
+        """按广度优先顺序计算失配指针"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[child] = fail
+                self._match[child] = max(self._match[child], self._match[fail])
+                queue.append(child)
+
+    def _step(self, state: int, char: str) -> int:
+        char = char.lower()
+        goto = self._goto
+        while state and char not in goto[state]:
+            state = self._fail[state]
+        return goto[state].get(char, 0)
+
+    def _scan(self, text: str, start: int, state: int, spans: List[List[int]]) -> Tuple[List[List[int]], int]:
+        """从 start 开始扫描文本，将命中区间合并追加到 spans 中
+
+        Returns:
+            Tuple[List[List[int]], int]: (命中区间列表, 扫描结束时的自动机状态)
+        """
+        match = self._match
+        for index in range(start, len(text)):
+            state = self._step(state, text[index])
+            length = match[state]
+            if length:
+                begin, end = index + 1 - length, index + 1
+                if spans and begin <= spans[-1][1]:
+                    spans[-1][0] = min(spans[-1][0], begin)
+                    spans[-1][1] = end
+                else:
+                    spans.append([begin, end])
+        return spans, state
+
+    def _apply(self, text: str, spans: List[List[int]], end: int) -> str:
+        """替换 text[:end] 中的命中区间"""
+        parts = []
+        position = 0
+        for begin, stop in spans:
+            if begin >= end:
+                break
+            parts.append(text[position:max(begin, position)])
+            parts.append(self.replace_with)
+            position = stop
+        parts.append(text[position:end])
+        return "".join(parts)
+
+
+class StreamWordFilter:
+    """流式文本的敏感词过滤
+
+    跨片段保持自动机状态，因此被拆分到两个片段中的敏感词也能被识别。
+    每次只输出不可能再成为敏感词一部分的文本，暂扣的尾部最多为最长敏感词长度减一。
+    """
+
+    def __init__(self, word_filter: SensitiveWordFilter):
+        self._filter = word_filter
+        self._pending = ""
+        self._spans: List[List[int]] = []
+        self._state = 0
+
+    def feed(self, chunk: str) -> str:
+        """过滤一个新片段
+
+        Args:
+            chunk: 新收到的文本
+
+        Returns:
+            str: 可以安全输出的过滤后文本，可能为空
+        """
+        word_filter = self._filter
+        if not word_filter.word_count:
+            return chunk
+        text = self._pending + chunk
+        self._spans, self._state = word_filter._scan(text, len(self._pending), self._state, self._spans)
+
+        # 自动机当前深度内的字符可能与后续内容组成敏感词，暂不输出
+        cut = max(0, len(text) - word_filter._depth[self._state])
+        for begin, end in self._spans:
+            if begin < cut < end:
+                cut = end
+        return self._emit(text, cut)
+
+    def finish(self) -> str:
+        """流结束时调用，返回剩余的过滤后文本"""
+        text = self._pending
+        output = self._emit(text, len(text))
+        self._state = 0
+        return output
+
+    def _emit(self, text: str, cut: int) -> str:
+        output = self._filter._apply(text, self._spans, cut)
+        self._pending = text[cut:]
+        self._spans = [[max(0, begin - cut), end - cut] for begin, end in self._spans if end > cut]
+        return output